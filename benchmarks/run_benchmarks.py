@@ -0,0 +1,111 @@
+# run_benchmarks.py
+# Times every filter in the chain, filter 11 and the adjacency build on synthetic hit
+# tables (see synthetic_hits.py) of a few sizes, and reports how many hits per second
+# each stage gets through and how much memory it used. Runs anywhere, without the real data
+# Noah Stiegler
+# 10/18/26
+#
+# Usage: python run_benchmarks.py [<number of hits> ...] [--adjacency-rows N] [--seed S]
+#   (defaults to 3M and 32M hits, which is about the size of the real datasets)
+# The adjacency build is timed on a random sample of 100k of the coherent hits by default.
+# Its stages are named with the size of the sample, and their throughput doesn't carry over
+# to the whole table: every pair of hits at the same RFI frequency is a pair, so the number
+# of pairs (and the time and memory) grows with the square of the number of hits. All of the
+# hits of the 32M table would be trillions of pairs
+# The timings of every stage are saved as run manifests (see run_manifest.py) in
+# benchmarks/run_manifests, so runs before and after a change can be compared with compare_manifests
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import os
+import sys
+import argparse
+import shutil
+import tempfile
+
+script_path = os.path.abspath(__file__)
+script_dir = os.path.dirname(script_path)
+sys.path.append(os.path.join(script_dir, ".."))
+sys.path.append(os.path.join(script_dir, "../filters"))
+sys.path.append(os.path.join(script_dir, "../frequency_adjacency"))
+from synthetic_hits import make_synthetic_hits
+from run_manifest import start_manifest, stage, default_manifest_path
+from hit_store import source_categories
+from filter_chain import run_chain
+from find_adjacent_all_coherent import find_adjacent_pairs
+from adjacency import build_pairs_sharded
+
+# Width of the window the adjacency is found in (1000Hz in MHz, like find_adjacent_all_coherent.py)
+adjacency_window = 1000 * 1e-6
+
+# Don't print the filter chain's progress
+def _no_log(message):
+    pass
+
+# Run every benchmark on num_hits synthetic hits
+# Parameters:
+# - num_hits: size of the synthetic table (all categories, the chain runs on the coherent part)
+# - adjacency_rows: how many of the coherent hits to build the adjacency of (all of them if None).
+#   The number of pairs grows with the square of the number of hits at the same frequency
+#   (and every pair is kept in memory), so it's timed on a sample. The adjacency stages are
+#   named with the sample size and record sample_of (the number of coherent hits)
+# - seed: seed for the synthetic table
+# Returns:
+# - the run manifest with a stage for each benchmark
+def run_benchmarks(num_hits, adjacency_rows=None, seed=0):
+    name = f"benchmark_{num_hits}"
+    manifest = start_manifest(name, default_manifest_path(script_dir, name))
+
+    with stage(manifest, "make synthetic hits", rows_in=num_hits) as record:
+        hits = make_synthetic_hits(num_hits, seed=seed)
+        coherent = hits[source_categories(hits.source_name) == "coherent"].reset_index(drop=True)
+        del hits
+        record["rows_out"] = len(coherent)
+
+    # Every filter (including filter 11) as a stage of the chain
+    run_chain(coherent, save=False, log=_no_log, manifest=manifest)
+
+    # Adjacency of a random sample of the coherent frequencies
+    rng = np.random.default_rng(seed)
+    sample = coherent.signal_frequency.values
+    if adjacency_rows is not None and adjacency_rows < len(sample):
+        sample = rng.choice(sample, adjacency_rows, replace=False)
+    sampled = f"sample of {len(sample)} hits" if len(sample) < len(coherent) else None
+    with stage(manifest, f"adjacency build ({sampled})" if sampled else "adjacency build",
+               rows_in=len(sample), sample_of=len(coherent)) as record:
+        pairs = find_adjacent_pairs(pd.Series(sample), adjacency_window, os.devnull)
+        record["rows_out"] = len(pairs["i"]) # Number of adjacent pairs
+    with stage(manifest, f"adjacency build (sharded, {sampled})" if sampled else "adjacency build (sharded)",
+               rows_in=len(sample), sample_of=len(coherent)) as record:
+        pairs_dir = tempfile.mkdtemp(prefix="benchmark_pairs_")
+        try:
+            pairs = build_pairs_sharded(sample, adjacency_window, pairs_dir, log=_no_log)
+            record["rows_out"] = len(pairs["i"])
+            del pairs
+        finally:
+            shutil.rmtree(pairs_dir)
+    return manifest
+
+# Table of how long each stage took, its throughput and memory
+def summarize(manifest):
+    stages = pd.DataFrame(manifest["stages"])
+    summary = stages[["stage", "rows_in", "rows_out", "wall_time_s", "cpu_time_s", "peak_rss_mb"]].copy()
+    summary["hits_per_s"] = summary.rows_in / summary.wall_time_s
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the filters on synthetic hits")
+    parser.add_argument("sizes", nargs="*", type=float, default=[3e6, 32e6], help="number of hits in each synthetic table")
+    parser.add_argument("--adjacency-rows", type=int, default=100_000, help="hits to build the adjacency of (0 for all)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        manifest = run_benchmarks(int(size), args.adjacency_rows or None, args.seed)
+        print(f"\n{int(size)} hits (saved to {manifest['path']})")
+        with pd.option_context("display.width", 200, "display.float_format", "{:.3f}".format):
+            print(summarize(manifest).to_string(index=False))
+        if any(s.get("sample_of", 0) > s["rows_in"] for s in manifest["stages"]):
+            print("The adjacency stages ran on a sample of the coherent hits. The number of pairs grows with the square "
+                  "of the number of hits at each frequency, so their throughput doesn't scale to the whole table")
@@ -0,0 +1,79 @@
+# category_chain.py
+# Runs the filter chain on the coherent, incoherent and phase center hits at the same
+# time from one copy of the full hit table. The columns the filters need are put in
+# shared memory once (sorted by category, see shared_hits.py) and each category's chain
+# runs in its own process on its range of rows, so the incoherent beam's RFI statistics
+# come for free with the coherent search
+# Noah Stiegler
+# 10/18/26
+#
+# Filters which look at other hits (1-5 and 9-11) only look at hits in the same category
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import multiprocessing
+from filter_chain import FILTERS, run_chain, chain_columns
+from shared_hits import share_columns, read_rows, remove_shared_columns
+from rejections import first_rejecting_filter, rejection_bits, attrition
+from hit_store import source_categories
+
+# Don't print anything from the chains running in the workers
+def _no_log(message):
+    pass
+
+# Run the chain on one category's rows of the shared columns (what the workers run)
+# Returns (category, rows of the full table, first rejecting filter, rejection bits)
+def category_chain_rows(columns_dir, start, stop, category, filters=FILTERS):
+    hits = read_rows(columns_dir, start, stop).rename(columns={"source_code": "source_name"})
+    passes = {}
+    selections = run_chain(hits, filters, save=False, log=_no_log, passes=passes)
+    return category, np.asarray(hits.row.values), first_rejecting_filter(selections), rejection_bits(passes, selections, filters)
+
+# Run the chain on every category of hits at once
+# Parameters:
+# - hits: the full hit table (every category)
+# - filters: list of (number, filter function) like filter_chain.FILTERS (they have to be
+#   functions defined at the top level of a module so they can be sent to the workers)
+# - categories: category of each hit (from hit_store.source_categories if None)
+# Returns:
+# - (categories, first, bits): the category, first rejecting filter and rejection bits of
+#   every hit, lined up with the rows of hits (see rejections.py)
+def run_chain_by_category(hits, filters=FILTERS, categories=None):
+    if categories is None:
+        categories = source_categories(hits.source_name)
+    categories = np.asarray(categories, dtype=object)
+
+    # Strings can't be memory mapped, so sources are shared as integer codes
+    columns = [c for c in chain_columns if c in hits.columns and c != "source_name"]
+    shared = pd.DataFrame({c: hits[c].values for c in columns}, copy=False)
+    shared["source_code"] = pd.factorize(hits.source_name)[0]
+    shared["row"] = np.arange(len(hits))
+    shared["category"] = categories
+    columns_dir, category_ranges = share_columns(shared, columns + ["source_code", "row"], by="category")
+
+    first = np.zeros(len(hits), dtype=np.uint8)
+    bits = None
+    try:
+        inputs = [(columns_dir, start, stop, category, filters) for category, start, stop in category_ranges]
+        with multiprocessing.Pool(max(1, len(inputs))) as p:
+            for category, rows, category_first, category_bits in p.starmap(category_chain_rows, inputs):
+                if bits is None:
+                    bits = np.zeros(len(hits), dtype=category_bits.dtype)
+                first[rows] = category_first
+                bits[rows] = category_bits
+    finally:
+        remove_shared_columns(columns_dir)
+    return categories, first, bits
+
+# How many hits in each category passed each filter
+# Returns a dataframe with a row per (category, filter)
+def category_survival(categories, first, numbers):
+    tables = []
+    for category in pd.unique(categories):
+        in_category = categories == category
+        table = attrition(first[in_category], numbers)
+        table.insert(0, "category", category)
+        table["fraction_of_all"] = table.remaining / in_category.sum()
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
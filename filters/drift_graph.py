@@ -0,0 +1,189 @@
+# drift_graph.py
+# Keeps the matches filter 11 finds (hit -> hit it looks like it drifted to in the next
+# observation of the source) as a directed graph instead of collapsing them to a valid
+# flag, so chains of hits which keep drifting can be followed (see the TODO in
+# filter11/run_filter_11_coherent.py)
+# Noah Stiegler
+# 10/18/26
+#
+# The graph is stored in CSR form: node i is row i of the hit table, and the hits node i
+# drifted to are indices[indptr[i]:indptr[i + 1]] with the distance (in Hz) between where
+# each one was expected and where it was in residuals[indptr[i]:indptr[i + 1]]. Edges
+# always point to a later observation, so there are no cycles
+#
+# Usage: python drift_graph.py (builds the graph for all coherent data)
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import os
+from filter_chain import drift_follow_up_matches, load_coherent, coherent_dataset_path, coherent_store_path
+
+### Paths
+script_path = os.path.abspath(__file__)
+script_dir = os.path.dirname(script_path)
+drift_graph_path = os.path.join(script_dir, "filter11/drift_graph/")
+
+### Building the graph
+# Build the graph from the hit table
+# Returns a dict of arrays:
+# - indptr, indices, residuals: the edges in CSR form (see above)
+# - ids: the id of the hit each node is
+# - drift_rates: the drift rate of each node
+def build_drift_graph(hits, max_drift_time_to_search=10 * 60):
+    from_rows, to_rows, residuals = drift_follow_up_matches(hits, max_drift_time_to_search)
+    order = np.argsort(from_rows, kind="stable")
+    indptr = np.zeros(len(hits) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(from_rows, minlength=len(hits)))
+    return {
+        "indptr": indptr,
+        "indices": to_rows[order].astype(np.int32),
+        "residuals": residuals[order].astype(np.float32),
+        "ids": hits.id.values,
+        "drift_rates": hits.signal_drift_rate.values.astype(np.float32),
+    }
+
+# Save each array as its own .npy so they can be memory mapped when loaded
+def save_drift_graph(graph, path=drift_graph_path):
+    os.makedirs(path, exist_ok=True)
+    for name, array in graph.items():
+        np.save(os.path.join(path, name + ".npy"), array)
+
+def load_drift_graph(path=drift_graph_path, mmap_mode="r"):
+    names = ["indptr", "indices", "residuals", "ids", "drift_rates"]
+    return {name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode) for name in names}
+
+### Queries
+def num_nodes(graph):
+    return len(graph["indptr"]) - 1
+
+# Hits node drifted to
+def successors(graph, node):
+    return np.asarray(graph["indices"][graph["indptr"][node]:graph["indptr"][node + 1]])
+
+# All the edges leaving the nodes in frontier as (from, to) arrays
+def _out_edges(graph, frontier):
+    starts = graph["indptr"][frontier]
+    counts = graph["indptr"][frontier + 1] - starts
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(frontier, counts), np.asarray(graph["indices"][np.repeat(starts, counts) + offsets], dtype=np.int64)
+
+# Every hit reachable from node by following drifts (not including node)
+def descendants(graph, node):
+    visited = np.zeros(num_nodes(graph), dtype=bool)
+    frontier = np.array([node], dtype=np.int64)
+    while len(frontier) > 0:
+        _, reached = _out_edges(graph, frontier)
+        reached = np.unique(reached)
+        frontier = reached[~visited[reached]]
+        visited[frontier] = True
+    return np.flatnonzero(visited)
+
+# Which of the edges into to_nodes to keep: for each node, the edge with the biggest value
+# (as positions in to_nodes)
+def _best_into(to_nodes, values):
+    order = np.lexsort((values, to_nodes))
+    sorted_to = to_nodes[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = sorted_to[1:] != sorted_to[:-1]
+    return order[last]
+
+# Length of the longest chain ending at each node (in nodes, so 1 for a hit nothing drifted to)
+# and the previous node on that chain (-1 if there isn't one). Works through the graph a
+# level at a time: a node is done once every node which drifted to it is done
+# If min_change is given, also works out the longest chain ending at each node where the
+# drift rate changes by at least min_change Hz/s between some pair of hits next to each
+# other on it (see changing_drift_chains), and returns
+# (length, previous, changing_length, changing_previous, from_changing), where
+# changing_length is 0 if no such chain ends at the node, and from_changing says whether
+# the chain carries on back along the previous node's changing chain (True) or its
+# longest chain (False, when the change is the last step)
+def longest_chain_ends(graph, min_change=None):
+    n = num_nodes(graph)
+    indices = np.asarray(graph["indices"], dtype=np.int64)
+    drift_rates = np.asarray(graph["drift_rates"])
+    in_degree = np.bincount(indices, minlength=n)
+    length = np.ones(n, dtype=np.int64)
+    previous = np.full(n, -1, dtype=np.int64)
+    changing_length = np.zeros(n, dtype=np.int64)
+    changing_previous = np.full(n, -1, dtype=np.int64)
+    from_changing = np.zeros(n, dtype=bool)
+    frontier = np.flatnonzero(in_degree == 0)
+    while len(frontier) > 0:
+        from_nodes, to_nodes = _out_edges(graph, frontier)
+        # Longest chain through each edge, keep the longest one into each node
+        through = length[from_nodes] + 1
+        better = np.flatnonzero(through > length[to_nodes])
+        best = better[_best_into(to_nodes[better], through[better])]
+        length[to_nodes[best]] = through[best]
+        previous[to_nodes[best]] = from_nodes[best]
+
+        # Longest chain with a big enough change through each edge: either the changing
+        # chain into the node it's from carries on, or this edge is the change
+        if min_change is not None:
+            continued = np.where(changing_length[from_nodes] > 0, changing_length[from_nodes] + 1, 0)
+            changes = np.abs(drift_rates[to_nodes] - drift_rates[from_nodes]) >= min_change
+            started = np.where(changes, length[from_nodes] + 1, 0)
+            through = np.maximum(continued, started)
+            better = np.flatnonzero(through > changing_length[to_nodes])
+            best = better[_best_into(to_nodes[better], through[better])]
+            changing_length[to_nodes[best]] = through[best]
+            changing_previous[to_nodes[best]] = from_nodes[best]
+            from_changing[to_nodes[best]] = continued[best] >= started[best]
+
+        # Nodes whose predecessors are all done are next
+        in_degree -= np.bincount(to_nodes, minlength=n)
+        frontier = np.unique(to_nodes[in_degree[to_nodes] == 0])
+    if min_change is None:
+        return length, previous
+    return length, previous, changing_length, changing_previous, from_changing
+
+# Follow previous back from end to get the chain of nodes ending there
+def _chain_to(previous, end):
+    chain = [end]
+    while previous[chain[-1]] != -1:
+        chain.append(previous[chain[-1]])
+    return np.array(chain[::-1], dtype=np.int64)
+
+# The num_chains longest chains of hits drifting from one observation to the next
+# Returns a list of arrays of nodes, longest first
+def longest_chains(graph, num_chains=10):
+    length, previous = longest_chain_ends(graph)
+    ends = np.argsort(-length, kind="stable")[:num_chains]
+    return [_chain_to(previous, end) for end in ends if length[end] > 1]
+
+# For every hit which didn't drift anywhere else (the end of a chain which can't be made
+# any longer), the longest chain ending there (of at least min_length hits) where the drift
+# rate changes by at least min_change Hz/s between some pair of hits next to each other on
+# the chain. These could be signals with a changing drift rate (ex. sinusoidally). Every
+# chain into the hit is looked at, not just the longest one, so a hit is missed only if no
+# chain into it has a big enough change
+# Returns a list of arrays of nodes, longest first
+def changing_drift_chains(graph, min_change, min_length=3):
+    _, previous, changing_length, changing_previous, from_changing = longest_chain_ends(graph, min_change)
+    out_degree = np.diff(np.asarray(graph["indptr"]))
+    ends = np.flatnonzero((out_degree == 0) & (changing_length >= max(min_length, 2)))
+    ends = ends[np.argsort(-changing_length[ends], kind="stable")]
+
+    chains = []
+    for end in ends:
+        # Follow the changing chains back until the change, then the longest chain
+        chain = [end]
+        changing = True
+        while True:
+            node = chain[-1]
+            before = changing_previous[node] if changing else previous[node]
+            if before == -1:
+                break
+            changing = changing and from_changing[node]
+            chain.append(before)
+        chains.append(np.array(chain[::-1], dtype=np.int64))
+    return chains
+
+if __name__ == "__main__":
+    dataset_path = coherent_store_path if os.path.isdir(coherent_store_path) else coherent_dataset_path
+    print("Reading in coherent data from: " + dataset_path)
+    coherent = load_coherent(dataset_path)
+    graph = build_drift_graph(coherent)
+    save_drift_graph(graph)
+    print(f"Saved drift graph with {len(graph['indices'])} edges to {drift_graph_path}")
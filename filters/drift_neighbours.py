@@ -0,0 +1,120 @@
+# drift_neighbours.py
+# Finds pairs of hits from the same source which look like one drifting signal: a later
+# hit is where the earlier one should have drifted to (its frequency + drift rate * the
+# time between them). Filter 11 only looks for this in the very next observation of the
+# source. This looks in every later observation within a time horizon, for every hit at once
+# Noah Stiegler
+# 10/18/26
+#
+# The hits are put in a grid hash over (source, start time): time is cut into cells as long
+# as the horizon, so the hits an earlier hit could have drifted to are all in its own cell
+# or the next one. The hits in each cell are sorted by frequency, so for each hit and each
+# of the two cells, the hits between the lowest and highest frequency it could have drifted
+# to in that cell (its projected frequency over that part of the horizon, give or take the
+# tolerance) are found with a binary search, for every hit at once. Those candidates are
+# then checked exactly against where the hit should be at the candidate's time
+#
+# Ex.
+#   from_rows, to_rows, residuals, dt = drift_consistent_pairs(coherent, horizon=60 * 60)
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+from filter_chain import block_searchsorted, sigma_drift_rate, tstart_seconds
+
+# Pairs of hits where the first looks like it drifted to the second
+# Parameters:
+# - frequency: frequency of each hit in MHz
+# - drift_rate: drift rate of each hit in Hz/s
+# - t: start time of each hit in seconds
+# - sources: source of each hit as a number (ex. from pd.factorize)
+# - horizon: longest time (seconds) between the hits of a pair
+# - tolerance_hz: how close (Hz) the later hit has to be to where the earlier one should
+#   have drifted to (strictly closer, like filter 11)
+# - drift_rate_error: (optional) error on each hit's drift rate in Hz/s. The tolerance for
+#   a pair is then the bigger of tolerance_hz and the error * the time between the hits
+# - queries: hits to look for drift from (boolean array or rows). Hits with a drift rate of
+#   0 if None, since anything at the same frequency later on is consistent with a hit which
+#   doesn't drift (filter 11 doesn't look from them either)
+# - batch_size: number of hits to look from at once (to limit memory)
+# Returns:
+# - (from_rows, to_rows, residuals, dt): the earlier and later hit of each pair, how far (Hz)
+#   the later hit is from where the earlier one should have drifted to, and the time between them
+def drift_neighbour_pairs(frequency, drift_rate, t, sources, horizon, tolerance_hz=2, drift_rate_error=None,
+                          queries=None, batch_size=1_000_000):
+    frequency, drift_rate, t = np.asarray(frequency), np.asarray(drift_rate), np.asarray(t, dtype=np.float64)
+    if drift_rate_error is None:
+        drift_rate_error = np.zeros(len(frequency))
+    drift_rate_error = np.nan_to_num(np.asarray(drift_rate_error, dtype=np.float64))
+    if queries is None:
+        queries = drift_rate != 0
+    queries = np.asarray(queries)
+    if queries.dtype == bool:
+        queries = np.flatnonzero(queries)
+    if len(frequency) == 0 or len(queries) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([]), np.array([])
+
+    # Grid hash: the cell of each hit is its source and which horizon-long stretch of time it's in
+    t0 = t.min()
+    time_cell = np.floor((t - t0) / horizon).astype(np.int64)
+    num_cells = time_cell.max() + 2 # (+1 for the cell after the last one)
+    cell = np.asarray(sources, dtype=np.int64) * num_cells + time_cell
+    order = np.lexsort((frequency, cell))
+    sorted_cell, sorted_frequency = cell[order], frequency[order]
+
+    from_parts, to_parts = [], []
+    for batch_start in range(0, len(queries), batch_size):
+        searched = queries[batch_start:batch_start + batch_size]
+        f, r, ts, error = frequency[searched], drift_rate[searched], t[searched], drift_rate_error[searched]
+        for step in (0, 1): # The hit's own cell, then the next one
+            # The part of the horizon which is in this cell
+            cell_start = t0 + (time_cell[searched] + step) * horizon
+            dt_low = np.maximum(cell_start - ts, 0)
+            dt_high = np.minimum(cell_start + horizon - ts, horizon)
+            # Lowest and highest frequency the hit could be at in that part of the horizon
+            drift_low, drift_high = r * dt_low * 1e-6, r * dt_high * 1e-6
+            tolerance = np.maximum(tolerance_hz, error * dt_high) * 1e-6
+            lowest = f + np.minimum(drift_low, drift_high) - tolerance
+            highest = f + np.maximum(drift_low, drift_high) + tolerance
+
+            lo = block_searchsorted(sorted_cell, sorted_frequency, cell[searched] + step, lowest, side="left")
+            hi = block_searchsorted(sorted_cell, sorted_frequency, cell[searched] + step, highest, side="right")
+            counts = np.maximum(hi - lo, 0)
+
+            # Turn each range into candidate pairs
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            from_parts.append(np.repeat(searched, counts))
+            to_parts.append(order[np.repeat(lo, counts) + offsets])
+
+    # Check each candidate against where the hit should have drifted to by the candidate's time
+    from_rows, to_rows = np.concatenate(from_parts), np.concatenate(to_parts)
+    dt = t[to_rows] - t[from_rows]
+    residuals = (frequency[to_rows] - (frequency[from_rows] + drift_rate[from_rows] * dt * 1e-6)) * 1e6
+    tolerance = np.maximum(tolerance_hz, drift_rate_error[from_rows] * dt)
+    keep = (dt > 0) & (dt <= horizon) & (np.abs(residuals) < tolerance)
+    return from_rows[keep], to_rows[keep], residuals[keep], dt[keep]
+
+# Drift consistent pairs of a hit table, with the same tolerance as filter 11 (the error on
+# the drift rate * the time between the hits, but at least 2Hz)
+# Parameters:
+# - hits: the hit table (needs signal_frequency, signal_drift_rate, source_name, tsamp,
+#   signal_num_timesteps and tstart or tstart_h)
+# - horizon: longest time (seconds) between the hits of a pair
+# - queries: like drift_neighbour_pairs
+# Returns:
+# - (from_rows, to_rows, residuals, dt) like drift_neighbour_pairs
+def drift_consistent_pairs(hits, horizon=10 * 60, queries=None, min_tolerance_hz=2):
+    drift_rate = hits.signal_drift_rate.values
+    error = sigma_drift_rate(drift_rate, hits.tsamp.values, hits.signal_num_timesteps.values)
+    return drift_neighbour_pairs(hits.signal_frequency.values, drift_rate, tstart_seconds(hits),
+                                 pd.factorize(hits.source_name)[0], horizon, min_tolerance_hz, error, queries)
+
+# Hits which are in a drift consistent pair (either end), like filter 11 but looking in
+# every later observation within the horizon
+def has_drift_neighbour(hits, horizon=10 * 60, queries=None):
+    from_rows, to_rows, _, _ = drift_consistent_pairs(hits, horizon, queries)
+    found = np.zeros(len(hits), dtype=bool)
+    found[from_rows] = True
+    found[to_rows] = True
+    return found
@@ -1,4 +1,4 @@
- # run_filter_11_coherent.py
+# run_filter_11_coherent.py
 # Runs filter 11 on all coherent data
 # Noah Stiegler
 # 7/29/24
@@ -7,40 +7,22 @@
 import numpy as np
 import pandas as pd
 import os
-import socket
+import sys
 from datetime import datetime, timedelta
 import multiprocessing
 
 ### Setup for logging
 script_path = os.path.abspath(__file__)
 script_dir = os.path.dirname(script_path)
+sys.path.append(os.path.join(script_dir, ".."))
+sys.path.append(os.path.join(script_dir, "../.."))
+from filter_chain import drift_follow_up_matches, tstart_seconds
+from shared_hits import share_columns, read_rows, remove_shared_columns
+from hit_store import load_hits, default_store_path
 
 ### Read in the data
-# Check which server we're on (in case the data is in different places on different servers)
-import socket
-hostname = socket.gethostname()
-
-# Get paths to data
-if hostname == "blpc1" or hostname == "blpc2":
-    data_path = "/datax/scratch/nstieg/"
-elif hostname == "cosmic-gpu-1":
-    data_path = "/mnt/cosmic-gpu-1/data0/nstiegle/"
-else:
-    raise Exception("Data path not known")
-
-from astropy.time import Time
-
-# Get the coherent dataset but with all the columns
-full_coherent = pd.read_pickle(data_path + "25GHz_higher_coherent_all_columns.pkl")
-
-# Pass in row of dataframe for a single hit, get the error on that drift rate
-def sigma_drift_rate(hit):
-    # Error propagation on the error of the drift rate as dr =  df/dt (change in frequency / change in time)
-    signal_dt = hit.tsamp * hit.signal_num_timesteps # Total number of seconds observed for
-    signal_dr = hit.signal_drift_rate # Drift rate observed
-    sigma_df = 2 # Error in measured frequency - 2Hz bins
-    sigma_dt = hit.tsamp # Error in measured time - tsamp integration time per timestep
-    return abs((signal_dr / signal_dt) * np.sqrt((sigma_df/ signal_dr)**2 + (sigma_dt)**2)) # Error propagation formula for division substituting df = dr * dt
+full_dataset_path = os.path.join(script_dir,"../../../highfrequency_hit_feb12024_apr302025_coherent_full.pkl")
+coherent_store_path = default_store_path(full_dataset_path)
 
 # TOOD / FUTURE WORK
 # - Figure out what the distribution of dts are for sources
@@ -51,41 +33,40 @@ def sigma_drift_rate(hit):
 # Parameters of search
 max_drift_time_to_search = 10 * 60 # in seconds
 
-# Setup dataframe to flag hits which are validated by search
-full_coherent["valid"] = False
-
-# Do search within each source
-for source_name, source_group in full_coherent.groupby('source_name'):
-    # Group by time and figure out what all the times observed are
-    time_groups = source_group.groupby('tstart_h')
-    time_names = list(time_groups.groups.keys())
-
-    # Look at all times for this source which have a following time (all but the last)
-    for t_idx in range(0, len(time_names) - 1):
-        this_time = time_names[t_idx]
-        next_time = time_names[t_idx + 1]
-        dt = (next_time - this_time).total_seconds()
+### Run filter 11
+# Find the hits from a single source which drifted to a hit in the next observation of the
+# source, or which another hit drifted to. The matching is done for every observation of
+# the source at once in filter_chain.drift_follow_up_matches
+# Parameters:
+# - columns_dir, start, stop: rows of the shared columns which hold this source's hits
+# - name: the source's name
+# Returns the ids of the hits which pass the filter
+def filter11_source_rows(columns_dir, start, stop, name=None):
+    source = read_rows(columns_dir, start, stop)
+    source["source_name"] = name
+    from_rows, to_rows, _ = drift_follow_up_matches(source, max_drift_time_to_search, t=source.tstart_seconds.values)
+    valid = np.zeros(len(source), dtype=bool)
+    valid[from_rows] = True
+    valid[to_rows] = True
+    return source.id.values[valid]
 
-        # If the source was observed again within 10 minutes, look for
-        # signals which drifted in the next observation time
-        if dt <= max_drift_time_to_search:
-            time_group = time_groups.get_group(this_time)
-            next_time_group = time_groups.get_group(next_time)
-            for i, hit in time_group.iterrows():
-                # Ignore zero drift rate signals
-                if hit.signal_drift_rate != 0:
-                    # Compute some useful quantities
-                    drift = (dt * hit.signal_drift_rate) * 1e-6 # Total drift in MHz
-                    sigma_drift = max((dt * sigma_drift_rate(hit)) * 1e-6, 2 * 1e-6) # Error in drift in Mhz
-                    expected_new_frequency = hit.signal_frequency + drift # Where we expect it to drift to in Mhz
+if __name__ == "__main__":
+    # Get the coherent dataset with just the columns filter 11 needs, from the hit store
+    # (made with hit_store.py) if there is one, otherwise from the pickle
+    columns = ["id", "source_name", "signal_frequency", "signal_drift_rate", "tsamp", "signal_num_timesteps", "tstart"]
+    if os.path.isdir(coherent_store_path):
+        full_coherent = load_hits(coherent_store_path, columns=columns)
+    else:
+        full_coherent = pd.read_pickle(full_dataset_path)[columns].reset_index(drop=True)
+    full_coherent["tstart_seconds"] = tstart_seconds(full_coherent)
 
-                    # Get candidate hits from the next time
-                    candidates = next_time_group[(next_time_group.signal_frequency > expected_new_frequency - sigma_drift) &
-                                                (next_time_group.signal_frequency < expected_new_frequency + sigma_drift)]
-                    
-                    # If there was a match between this hit and a hit in the target range, validate them both in the full dataset
-                    full_coherent.loc[full_coherent.id == hit.id, 'valid'] = True
-                    full_coherent.loc[candidates.index, 'valid'] = True
+    # Do search within each source, with the sources spread across processes
+    columns_dir, source_ranges = share_columns(full_coherent, ["id", "signal_frequency", "signal_drift_rate", "tsamp",
+                                                               "signal_num_timesteps", "tstart_seconds"], by="source_name")
+    inputs = [(columns_dir, start, stop, source_name) for source_name, start, stop in source_ranges]
+    with multiprocessing.Pool() as p:
+        results = p.starmap(filter11_source_rows, inputs)
+    remove_shared_columns(columns_dir)
 
-results = full_coherent["id"][full_coherent["valid"]]
-np.save("/home/nstieg/BL-COSMIC-2024-proj/filters/filter11/run_filter_11_coherent_results.npy", results.values)
\ No newline at end of file
+    results = np.concatenate(results) if results else np.array([], dtype=int)
+    np.save(script_dir + "/run_filter_11_coherent_results.npy", results)
@@ -7,7 +7,7 @@
 import numpy as np
 import pandas as pd
 import os
-import socket
+import sys
 from datetime import datetime, timedelta
 import multiprocessing
 
@@ -16,22 +16,18 @@ script_path = os.path.abspath(__file__)
 script_dir = os.path.dirname(script_path)
 
 ### Read in the data
-# Check which server we're on (in case the data is in different places on different servers)
-import socket
-hostname = socket.gethostname()
-
-# Get paths to data
-if hostname == "blpc1" or hostname == "blpc2":
-    data_path = "/datax/scratch/nstieg/"
-elif hostname == "cosmic-gpu-1":
-    data_path = "/mnt/cosmic-gpu-1/data0/nstiegle/"
+sys.path.append(os.path.join(script_dir, "../.."))
+from hit_store import load_hits, default_store_path
+full_dataset_path = os.path.join(script_dir,"../../../highfrequency_hit_feb12024_apr302025_coherent_full.pkl")
+coherent_store_path = default_store_path(full_dataset_path)
+
+# Get the coherent dataset but with just the columns this filter needs, from the
+# hit store (made with hit_store.py) if there is one, otherwise from the pickle
+columns = ["id", "num_timesteps", "signal_snr"]
+if os.path.isdir(coherent_store_path):
+    full_coherent = load_hits(coherent_store_path, columns=columns)
 else:
-    raise Exception("Data path not known")
-
-from astropy.time import Time
-
-# Get the coherent dataset but with all the columns
-full_coherent = pd.read_pickle(data_path + "25GHz_higher_coherent_all_columns.pkl")
+    full_coherent = pd.read_pickle(full_dataset_path)[columns].reset_index(drop=True)
 
 # Reject hits which have fewer than 16 timesteps and an snr less than 15
 enough_timesteps = full_coherent.num_timesteps >= 16
@@ -9,10 +9,14 @@ import pandas as pd
 import os
 from datetime import datetime, timedelta
 import multiprocessing
+import sys
 
 ### Setup for logging
 script_path = os.path.abspath(__file__)
 script_dir = os.path.dirname(script_path)
+sys.path.append(os.path.join(script_dir, ".."))
+from filter_chain import filter2
+from shared_hits import share_columns, read_rows, remove_shared_columns, schedule_ranges, run_scheduled
 log_filepath = script_dir + "/run_filter_2_coherent_log.txt"
 # Setup for logging messages
 def log_message(message):
@@ -38,73 +42,70 @@ def print_and_log(message):
 
 full_dataset_path = os.path.join(script_dir,"../../../highfrequency_hit_feb12024_apr302025_coherent_full.pkl")
 coherent_dataset_path = full_dataset_path
-print_and_log("Reading in coherent data from: " + coherent_dataset_path)
-coherent_orig = pd.read_pickle(coherent_dataset_path)
-good_indices_path = os.path.join(script_dir,"../filter1/run_filter_1_coherent_results.npy")
-print_and_log("Reading in good indices from: " + good_indices_path)
-good_indices = np.load(good_indices_path)
-coherent = coherent_orig[coherent_orig.id.isin(good_indices)]
-# coherent_dataset_path = data_path + "25GHz_higher_coherent.pkl"
-# incoherent_dataset_path = data_path + "25GHz_higher_incoherent.pkl"
-# coherent_after_1_path = data_path + "25GHz_higher_coherent_post_filter_1.pkl"
-
-# Read in data
-# coherent = pd.read_pickle(coherent_after_1_path)
-# incoherent = pd.read_pickle(incoherent_dataset_path)
-# df = pd.read_pickle(full_dataset_path)
-print_and_log("Coherent data post filter 1 read in correctly")
 
 ### Run filter 2
-# The filter (for filter 2) to run on a single group of frequencies to see if they
-# count as RFI or not
-# Takes:
-# - A df containing hits from a single source all at the same frequency
-# Returns:
-# - True if those hits don't count as RFI or false if they do
-def pass_filter2_single_group(group):
-    if len(group) == 1:
-        # No other hit at this frequency, could be a genuine signal
-        return True
-    else:
-        unique_drs = group.signal_drift_rate.unique()
-        
-        # There is a drift rate greater than or equal to 0.25Hz/s
-        return max(abs(unique_drs)) >= 0.25
-
 # Run filter two on a single source
 # A part of the filter two algorithm
 # Parameters:
 # - source: The df of source from the coherent data
 # Returns the ids of the hits which pass the filter
+# The whole source is done at once with the vectorized filter in filter_chain.py
+# instead of looping over its groups of frequencies
 def filter2_single_source(source, name=None):
-    source_good_ids = np.array([], dtype=int) # Put all the good ids from this source
-    
-    # Put things into groups of frequencies which are *exactly* the same
-    groups = source.groupby("signal_frequency")
-    for f, group in groups:
-        if pass_filter2_single_group(group):
-            source_good_ids = np.concatenate((source_good_ids, group.id.values))
+    source = source.reset_index(drop=True)
+    passes = filter2(source, np.ones(len(source), dtype=bool))
+    source_good_ids = source.id.values[passes]
 
-    # Log
+    # Log and return
     if name != None:
         print_and_log("Done with: " + name)
-
     return source_good_ids
 
+# Run filter two on the rows start to stop of the shared columns (which are all
+# the hits from the source name). This is what the workers run so they don't
+# have to be sent the source's dataframe
+def filter2_source_rows(columns_dir, start, stop, name=None):
+    source = read_rows(columns_dir, start, stop)
+    source["source_name"] = name
+    return filter2_single_source(source, name)
+
 if __name__ == "__main__":
-# Setup for multiprocessing
-    sources = coherent.groupby("source_name")
-    inputs = [(source, source_name) for source_name, source in sources] 
-    p = multiprocessing.Pool() 
+    # Read in data (only in the main process, so workers started with spawn don't read it in again)
+    print_and_log("Reading in coherent data from: " + coherent_dataset_path)
+    coherent_orig = pd.read_pickle(coherent_dataset_path)
+    good_indices_path = os.path.join(script_dir,"../filter1/run_filter_1_coherent_results.npy")
+    print_and_log("Reading in good indices from: " + good_indices_path)
+    good_indices = np.load(good_indices_path)
+    coherent = coherent_orig[coherent_orig.id.isin(good_indices)]
+    # coherent_dataset_path = data_path + "25GHz_higher_coherent.pkl"
+    # incoherent_dataset_path = data_path + "25GHz_higher_incoherent.pkl"
+    # coherent_after_1_path = data_path + "25GHz_higher_coherent_post_filter_1.pkl"
+
+    # Read in data
+    # coherent = pd.read_pickle(coherent_after_1_path)
+    # incoherent = pd.read_pickle(incoherent_dataset_path)
+    # df = pd.read_pickle(full_dataset_path)
+    print_and_log("Coherent data post filter 1 read in correctly")
+
+    # Setup for multiprocessing
+    # Put the columns the filter needs in shared memory so the workers only get row ranges.
+    # They're sorted by frequency within each source so big sources can be split up between
+    # groups of hits at the same frequency, and small sources are packed together
+    columns_dir, source_ranges = share_columns(coherent, ["id", "signal_frequency", "signal_drift_rate"],
+                                               by="source_name", then_by="signal_frequency")
 
-    # Run algorithm with multiprocessing
-    print_and_log("Running algorithm")
-    results = p.starmap(filter2_single_source, inputs)
+    # Run algorithm with multiprocessing, collecting the results as each task finishes.
+    # The shared columns are removed even if a worker fails
+    try:
+        tasks = schedule_ranges(columns_dir, source_ranges, split_on="signal_frequency")
+        print_and_log(f"Running algorithm ({len(source_ranges)} sources in {len(tasks)} tasks)")
+        with multiprocessing.Pool() as p:
+            results = list(run_scheduled(p, filter2_source_rows, columns_dir, tasks))
+    finally:
+        remove_shared_columns(columns_dir)
     print_and_log("Algorithm done. Saving")
 
-    # Save results
-    good_indices = np.array([], dtype=int)
-    for result in results:
-        good_indices = np.concatenate([good_indices, result])
+    # Save results (no tasks if there were no hits)
+    good_indices = np.sort(np.concatenate(results)) if results else np.array([], dtype=np.int64)
     np.save(script_dir + "/run_filter_2_coherent_results", good_indices)
     print_and_log("Saved. Done!")
\ No newline at end of file
@@ -7,6 +7,7 @@
 import numpy as np
 import pandas as pd
 import os
+import sys
 from datetime import datetime, timedelta
 import multiprocessing
 
@@ -25,6 +26,10 @@ def print_and_log(message):
 ### Setup for logging
 script_path = os.path.abspath(__file__)
 script_dir = os.path.dirname(script_path)
+sys.path.append(os.path.join(script_dir, ".."))
+sys.path.append(os.path.join(script_dir, "../.."))
+from frequency_collisions import singleton_frequency_ids
+from hit_store import iter_hit_batches, default_store_path, source_categories
 
 ### Read in the data
 # Check which server we're on (in case the data is in different places on different servers)
@@ -41,20 +46,41 @@ script_dir = os.path.dirname(script_path)
 
 full_dataset_path = os.path.join(script_dir,"../../../highfrequency_hit_feb12024_apr302025_coherent_full.pkl")
 coherent_dataset_path = full_dataset_path
+# Every category of hit (the dataset trim_dataset.py splits into coherent, incoherent and phase center)
+all_categories_dataset_path = os.path.join(script_dir,"../../../highfrequency_hit_feb12024_apr302025_full.pkl")
+
+# Categories of hits to look for collisions in. Coherent hits are only counted if they
+# passed filter 4, but every hit in the other categories is counted, so with
+# categories = ["coherent", "incoherent", "phase_center"] coherent hits at the same
+# frequency as an incoherent or phase center hit are cut too. The coherent dataset only
+# has coherent hits, so the other categories are read from the dataset with all of them
+categories = ["coherent"]
+dataset_path = coherent_dataset_path if categories == ["coherent"] else all_categories_dataset_path
+store_path = default_store_path(dataset_path)
 
-print_and_log("Reading in coherent data from: " + coherent_dataset_path)
-coherent_orig = pd.read_pickle(coherent_dataset_path)
 good_indices_path = os.path.join(script_dir,"../filter4/run_filter_4_coherent_results.npy")
 print_and_log("Reading in good indices from: " + good_indices_path)
 good_indices = np.load(good_indices_path)
-coherent = coherent_orig[coherent_orig.id.isin(good_indices)]
 
-# Read in data
-# coherent = pd.read_pickle(coherent_dataset_path)
-# incoherent = pd.read_pickle(incoherent_dataset_path)
-# df = pd.read_pickle(full_dataset_path)
+# Hits of the categories, a batch at a time from the hit store (made with hit_store.py) if
+# there is one, otherwise all at once from the pickle
+def hit_batches():
+    if os.path.isdir(store_path):
+        print_and_log("Streaming " + ", ".join(categories) + " data from: " + store_path)
+        yield from iter_hit_batches(store_path, ["id", "signal_frequency", "category"], categories=categories)
+    else:
+        print_and_log("Reading in " + ", ".join(categories) + " data from: " + dataset_path)
+        hits = pd.read_pickle(dataset_path)[["id", "signal_frequency", "source_name"]]
+        hits["category"] = source_categories(hits.source_name)
+        yield hits[hits.category.isin(categories)]
 
 ### Run filter 5
-groups = coherent.groupby("signal_frequency")
-filtered_groups = groups.filter(lambda x: len(x) == 1) # Save all data in a group by itself
-np.save(script_dir + "/run_filter_5_coherent_results", filtered_groups.id.values)
\ No newline at end of file
+# Save all hits alone at their frequency. The hits are counted a batch at a time (see
+# frequency_collisions.py) so with a store the full table never has to be in memory
+def counted_batches():
+    for batch in hit_batches():
+        counted = (batch.category.astype(str).values != "coherent") | np.isin(batch.id.values, good_indices)
+        yield batch.id.values[counted], batch.signal_frequency.values[counted]
+singletons = singleton_frequency_ids(counted_batches())
+passed = np.sort(singletons[np.isin(singletons, good_indices)])
+np.save(script_dir + "/run_filter_5_coherent_results", passed)
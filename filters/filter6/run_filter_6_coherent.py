@@ -9,10 +9,13 @@ import pandas as pd
 import os
 from datetime import datetime, timedelta
 import multiprocessing
+import sys
 
 ### Setup for logging
 script_path = os.path.abspath(__file__)
 script_dir = os.path.dirname(script_path)
+sys.path.append(os.path.join(script_dir, "../.."))
+from hit_store import load_hits, default_store_path
 log_filepath = script_dir + "/run_filter_4_coherent_log.txt"
 # Setup for logging messages
 def log_message(message):
@@ -39,8 +42,15 @@ def print_and_log(message):
 full_dataset_path = os.path.join(script_dir,"../../../highfrequency_hit_feb12024_apr302025_coherent_full.pkl")
 coherent_dataset_path = full_dataset_path
 # coherent_after_5_path = data_path + "25GHz_higher_coherent_post_filter5.pkl"
-print_and_log("Reading in coherent data from: " + coherent_dataset_path)
-coherent_orig = pd.read_pickle(coherent_dataset_path)
+# Only read in the columns this filter needs, from the hit store (made with hit_store.py)
+# if there is one, otherwise from the pickle
+coherent_store_path = default_store_path(coherent_dataset_path)
+if os.path.isdir(coherent_store_path):
+    print_and_log("Reading in coherent data from: " + coherent_store_path)
+    coherent_orig = load_hits(coherent_store_path, columns=["id", "signal_drift_rate"])
+else:
+    print_and_log("Reading in coherent data from: " + coherent_dataset_path)
+    coherent_orig = pd.read_pickle(coherent_dataset_path)[["id", "signal_drift_rate"]].reset_index(drop=True)
 good_indices_path = os.path.join(script_dir,"../filter5/run_filter_5_coherent_results.npy")
 print_and_log("Reading in good indices from: " + good_indices_path)
 good_indices = np.load(good_indices_path)
@@ -0,0 +1,93 @@
+# filter_bitmask.py
+# Stores the results of filters as packed bitmasks (one bit per hit) aligned to the
+# rows of the coherent hit table instead of arrays of hit ids. Combining the results
+# of filters is then a bitwise and/or over 2.9M / 8 bytes instead of an isin or merge
+# on ids, and the files are 1 bit per hit instead of 8 bytes per passing hit
+# Noah Stiegler
+# 10/18/26
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import os
+
+### Paths
+script_path = os.path.abspath(__file__)
+script_dir = os.path.dirname(script_path)
+
+# Ids of the hits in the order of the rows the bitmasks line up with (saved by the filter chain)
+row_ids_path = os.path.join(script_dir, "coherent_row_ids.npy")
+
+# Where the bitmask of hits which pass filter i (and every filter before it) is stored
+def get_filter_bitmask_path(i):
+    return os.path.join(script_dir, f"filter{i}/run_filter_{i}_coherent_results.bits.npy")
+
+### Packing and unpacking
+# Pack a boolean array (one entry per row) into bits. The unused bits at the end
+# of the last byte are always 0
+def pack_mask(mask):
+    return np.packbits(np.asarray(mask, dtype=bool))
+
+# Unpack bits back into a boolean array of n rows
+def unpack_mask(bits, n):
+    return np.unpackbits(bits, count=n).astype(bool)
+
+### Combining bitmasks
+# Hits which pass all of the filters
+def bitmask_and(*bitmasks):
+    return np.bitwise_and.reduce(bitmasks)
+
+# Hits which pass any of the filters
+def bitmask_or(*bitmasks):
+    return np.bitwise_or.reduce(bitmasks)
+
+# Hits which don't pass the filter. Needs the number of rows to keep the padding bits at 0
+def bitmask_not(bits, n):
+    inverted = np.invert(bits)
+    if n % 8 != 0:
+        inverted[-1] &= np.uint8((0xFF << (8 - n % 8)) & 0xFF)
+    return inverted
+
+# Number of set bits in each possible byte
+_popcount_table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Number of hits which pass
+def popcount(bits):
+    return int(_popcount_table[bits].sum(dtype=np.int64))
+
+### Converting to and from hit ids
+# Get the ids of the hits which pass from a bitmask
+def ids_from_bitmask(bits, row_ids):
+    return row_ids[unpack_mask(bits, len(row_ids))]
+
+# Make a bitmask from an array of hit ids (ex. an old run_filter_N_coherent_results.npy)
+def bitmask_from_ids(ids, row_ids):
+    return pack_mask(np.isin(row_ids, ids))
+
+### Saving and loading
+def save_bitmask(path, bits):
+    np.save(path, bits)
+
+def load_bitmask(path):
+    return np.load(path)
+
+### Stats
+# How many hits survive each filter
+# Parameters:
+# - bitmasks: dict of filter number -> bitmask of hits which passed that filter and every one
+#   before it, in the order the filters were run (like the output of the filter chain)
+# - n: number of hits in the table
+# Returns a dataframe with the number of hits which passed each filter, and what fraction of
+# the hits going into the filter and of all hits that is
+def survival_stats(bitmasks, n):
+    rows = []
+    num_before = n
+    for number, bits in bitmasks.items():
+        num_passed = popcount(bits)
+        rows.append({"filter": number,
+                     "passed": num_passed,
+                     "cut": num_before - num_passed,
+                     "fraction_of_previous": num_passed / num_before if num_before else 0.0,
+                     "fraction_of_all": num_passed / n if n else 0.0})
+        num_before = num_passed
+    return pd.DataFrame(rows)
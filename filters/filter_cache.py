@@ -0,0 +1,110 @@
+# filter_cache.py
+# Caches the result of each stage of the filter chain under a key made from
+# everything the result depends on: the hit table it ran on, the key of the stage
+# before it, and the filter itself (its number, its code and its thresholds, and the code
+# of every helper in this repository it calls, however deep). If any of those change, the
+# key changes, so rerunning the chain skips every stage whose inputs are the same and only
+# recomputes the stages downstream of a change
+# Noah Stiegler
+# 10/18/26
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import os
+import hashlib
+import inspect
+import json
+import types
+from filter_bitmask import pack_mask, unpack_mask, save_bitmask, load_bitmask
+
+# Hash of the contents (and order) of the hit table
+def dataset_fingerprint(hits):
+    row_hashes = pd.util.hash_pandas_object(hits, index=False).values
+    h = hashlib.sha256()
+    h.update(json.dumps(list(map(str, hits.columns))).encode())
+    h.update(row_hashes.tobytes())
+    return h.hexdigest()
+
+# The thresholds of a filter (its keyword arguments and their values)
+def filter_parameters(filter_function):
+    parameters = inspect.signature(filter_function).parameters.values()
+    return {p.name: p.default for p in parameters if p.default is not inspect.Parameter.empty}
+
+# Code of a function, or its name if the code can't be found
+def _source(function):
+    try:
+        return inspect.getsource(function)
+    except (OSError, TypeError):
+        return function.__qualname__
+
+# Everything in this repository (functions and modules) the code of a function refers to,
+# following the helpers it calls down to the ones they call. Libraries (numpy, pandas, ...)
+# aren't followed, only the code in this repository
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+def _in_repo(value):
+    try:
+        path = inspect.getsourcefile(value)
+    except TypeError:
+        return False
+    return path is not None and os.path.abspath(path).startswith(repo_dir + os.sep)
+
+def _names(code):
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType): # Functions defined inside the function
+            names |= _names(constant)
+    return names
+
+# Returns a dict of "module.name" -> code of every function (or whole module, for modules
+# used as module.function) filter_function depends on, not including filter_function itself
+def code_dependencies(filter_function):
+    dependencies = {}
+    to_visit = [filter_function]
+    while to_visit:
+        function = to_visit.pop()
+        referenced = [function.__globals__.get(name) for name in _names(function.__code__)]
+        referenced += [cell.cell_contents for cell in function.__closure__ or ()]
+        for value in referenced:
+            if not isinstance(value, (types.FunctionType, types.ModuleType)) or not _in_repo(value):
+                continue
+            name = value.__name__ if isinstance(value, types.ModuleType) else value.__module__ + "." + value.__qualname__
+            if name in dependencies or value is filter_function:
+                continue
+            dependencies[name] = _source(value)
+            if isinstance(value, types.FunctionType):
+                to_visit.append(value)
+    return dependencies
+
+# Key for the result of running filter number on the output of the stage with upstream_key
+# (or on the whole table, in which case upstream_key is the dataset fingerprint)
+def stage_key(upstream_key, number, filter_function):
+    description = {
+        "upstream": upstream_key,
+        "filter": number,
+        "name": filter_function.__name__,
+        "code": _source(filter_function),
+        "dependencies": code_dependencies(filter_function),
+        "parameters": {name: repr(value) for name, value in filter_parameters(filter_function).items()},
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+def _cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key + ".bits.npy")
+
+# Get the cached rows which passed the stage with key (None if it isn't cached). This is
+# the filter's own result, which the chain ANDs with the selection going into it
+def load_cached_selection(cache_dir, key, n):
+    path = _cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    return unpack_mask(load_bitmask(path), n)
+
+# Cache the rows which passed the stage with key. Written to a temporary file
+# first so an interrupted run never leaves a half written result behind
+def save_cached_selection(cache_dir, key, selected):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(cache_dir, key)
+    tmp_path = path + ".tmp.npy"
+    save_bitmask(tmp_path, pack_mask(selected))
+    os.replace(tmp_path, path)
@@ -0,0 +1,298 @@
+# filter_chain.py
+# Runs the whole chain of filters (1-12) in one process over a single in-memory
+# copy of the coherent hit table instead of one script (and one pickle load) per filter
+# Noah Stiegler
+# 10/18/26
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import os
+import sys
+
+### Paths
+script_path = os.path.abspath(__file__)
+script_dir = os.path.dirname(script_path)
+coherent_dataset_path = os.path.join(script_dir, "../../highfrequency_hit_feb12024_apr302025_coherent_full.pkl")
+sys.path.append(os.path.join(script_dir, ".."))
+from hit_store import load_hits, default_store_path
+from filter_bitmask import pack_mask, save_bitmask, get_filter_bitmask_path, row_ids_path
+from filter_cache import dataset_fingerprint, stage_key, load_cached_selection, save_cached_selection
+from frequency_gaps import has_close_neighbour
+from run_manifest import stage
+coherent_store_path = default_store_path(coherent_dataset_path)
+
+# Where the results of filter i are stored (same place the single filter scripts save them)
+def get_filter_results_path(i):
+    return os.path.join(script_dir, f"filter{i}/run_filter_{i}_coherent_results.npy")
+
+### Read in the data
+# The columns of the hit table the filters use
+chain_columns = ["id", "source_name", "signal_frequency", "signal_drift_rate", "signal_snr",
+                 "num_timesteps", "signal_num_timesteps", "tsamp", "tstart"]
+
+# Read in the hit table once, either from a hit store made with hit_store.py (only
+# reading the columns the filters need) or from the pickle. The index is reset so that
+# row positions are the same as the index (like the tables frequency_adjacency is built from)
+def load_coherent(path=coherent_dataset_path, columns=chain_columns):
+    if os.path.isdir(path):
+        return load_hits(path, columns=columns, categories=["coherent"])
+    return pd.read_pickle(path).reset_index(drop=True)
+
+### Filters
+# Every filter below has the same signature:
+# Takes:
+# - hits: the full hit table (RangeIndex, so index == row position)
+# - selected: boolean array over the rows of hits, True for hits which passed every previous filter
+# Returns:
+# - boolean array over the rows of hits, True for hits which pass this filter
+# The chain runner ANDs the result with the selection, so filters are free to say
+# True for rows which were already removed. Any thresholds are keyword arguments so
+# the filter cache (filter_cache.py) can tell when they change
+
+# Filters 1-5 look at groups of hits at *exactly* the same frequency. Instead of running
+# a python function on every group, work out what each filter needs to know about a
+# hit's group (how many hits are in it and the largest |drift rate| in it, which is 0
+# if all the drift rates are 0) with one groupby-transform over the selected hits
+# Takes:
+# - hits, selected: as above
+# - by: the columns to group by
+# Returns:
+# - (size, max_abs_dr) arrays over the rows of hits. Rows which aren't selected have
+#   a size of 0 and a max_abs_dr of nan
+def group_aggregates(hits, selected, by=("source_name", "signal_frequency")):
+    abs_dr = pd.Series(np.abs(hits.signal_drift_rate.values[selected]))
+    keys = [hits[column].values[selected] for column in by]
+    groups = abs_dr.groupby(keys, sort=False, dropna=False)
+
+    size = np.zeros(len(hits), dtype=np.int64)
+    size[selected] = groups.transform("size").values
+    max_abs_dr = np.full(len(hits), np.nan)
+    max_abs_dr[selected] = groups.transform("max").values
+    return size, max_abs_dr
+
+# Filter 1: rejects groups of hits from one source at exactly the same frequency
+# where every hit has zero drift rate
+def filter1(hits, selected):
+    size, max_abs_dr = group_aggregates(hits, selected)
+    return (size == 1) | (max_abs_dr != 0)
+
+# Filter 2: same grouping, rejects groups where every drift rate is below 0.25Hz/s
+def filter2(hits, selected, min_drift_rate=0.25):
+    size, max_abs_dr = group_aggregates(hits, selected)
+    return (size == 1) | (max_abs_dr >= min_drift_rate)
+
+# Filter 3: same grouping, rejects groups where every drift rate is below 2Hz/s
+def filter3(hits, selected, min_drift_rate=2):
+    size, max_abs_dr = group_aggregates(hits, selected)
+    return (size == 1) | (max_abs_dr >= min_drift_rate)
+
+# Filter 4: rejects any group of more than one hit from a source at exactly the same frequency
+def filter4(hits, selected):
+    size, _ = group_aggregates(hits, selected)
+    return size == 1
+
+# Filter 5: rejects any group of more than one hit at exactly the same frequency across all sources
+def filter5(hits, selected):
+    size, _ = group_aggregates(hits, selected, by=("signal_frequency",))
+    return size == 1
+
+# Filter 6: rejects zero drift rate hits
+def filter6(hits, selected):
+    return hits.signal_drift_rate.values != 0
+
+# Filter 7: rejects hits with SNR <= 10
+def filter7(hits, selected, min_snr=10):
+    return hits.signal_snr.values > min_snr
+
+# Filter 8: rejects hits with SNR >= 100
+def filter8(hits, selected, max_snr=100):
+    return hits.signal_snr.values < max_snr
+
+# Get which hits have another coherent hit within threshold (in MHz) of them.
+# The closest other hit is always next to a hit in the sorted frequencies (see frequency_gaps.py)
+def hits_with_close_neighbor(hits, threshold):
+    return has_close_neighbour(hits.signal_frequency.values, threshold)
+
+# Filter 9: rejects hits within 2Hz of any other coherent hit
+def filter9(hits, selected, threshold=2e-6):
+    return ~hits_with_close_neighbor(hits, threshold)
+
+# Filter 10: rejects hits within 10Hz of any other coherent hit
+def filter10(hits, selected, threshold=10e-6):
+    return ~hits_with_close_neighbor(hits, threshold)
+
+# Start times of each hit in seconds. Uses the human readable times made by
+# trim_dataset.py if they're there, otherwise the MJD start times
+def tstart_seconds(hits):
+    if "tstart_h" in hits.columns:
+        tstart_h = pd.to_datetime(hits.tstart_h)
+        return (tstart_h - tstart_h.min()).dt.total_seconds().values
+    return hits.tstart.values * 24 * 60 * 60
+
+# Error on the drift rate of each hit (see filter11/run_filter_11_coherent.py)
+# Error propagation on the error of the drift rate as dr = df/dt (change in frequency / change in time)
+def sigma_drift_rate(drift_rate, tsamp, num_timesteps):
+    signal_dt = tsamp * num_timesteps # Total number of seconds observed for
+    sigma_df = 2 # Error in measured frequency - 2Hz bins
+    sigma_dt = tsamp # Error in measured time - tsamp integration time per timestep
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.abs((drift_rate / signal_dt) * np.sqrt((sigma_df / drift_rate)**2 + (sigma_dt)**2))
+
+# Binary search for values within blocks of a sorted array, for lots of blocks at once
+# Parameters:
+# - data_blocks, data_values: block number and value of each element of the data, sorted by (block, value)
+# - query_blocks, query_values: block to search in and value to search for
+# - side: like np.searchsorted. "left" counts the data in the block < the value, "right" counts <=
+# Returns:
+# - the position in the whole data array each query would be inserted at to keep it sorted
+def block_searchsorted(data_blocks, data_values, query_blocks, query_values, side="left"):
+    num_data = len(data_values)
+    blocks = np.concatenate([data_blocks, query_blocks])
+    values = np.concatenate([data_values, query_values])
+    # On ties, queries go after the data for "right" and before it for "left"
+    is_query = np.concatenate([np.zeros(num_data, dtype=np.int8), np.ones(len(query_values), dtype=np.int8)])
+    ties = is_query if side == "right" else 1 - is_query
+    order = np.lexsort((ties, values, blocks))
+    is_data = order < num_data
+    data_before = np.cumsum(is_data) - is_data
+    positions = np.empty(len(query_values), dtype=np.int64)
+    positions[order[~is_data] - num_data] = data_before[~is_data]
+    return positions
+
+# Find every pair of hits where it looks like the first hit drifted to the second one in
+# the next observation of the same source (if that was within max_drift_time_to_search
+# seconds). The frequency each hit should have drifted to (signal_frequency + dt * drift rate,
+# give or take the error in that drift, which is at least 2Hz) is matched against the sorted
+# frequencies of the next observation with a binary search, for every observation at once
+# Parameters:
+# - hits: the hit table (RangeIndex)
+# - t: start time of each hit in seconds (tstart_seconds(hits) if None)
+# Returns:
+# - (from_rows, to_rows, residuals) arrays with a row of hits which drifted, the row of the
+#   hit it drifted to, and how far that hit was from where it was expected in Hz
+def drift_follow_up_matches(hits, max_drift_time_to_search=10 * 60, t=None):
+    if t is None:
+        t = tstart_seconds(hits)
+    frequency = hits.signal_frequency.values
+    drift_rate = hits.signal_drift_rate.values
+    source_codes = pd.factorize(hits.source_name)[0]
+
+    # Sort by source, then time, then frequency. Each (source, time) is an observation
+    order = np.lexsort((frequency, t, source_codes))
+    sorted_sources, sorted_t, sorted_frequency = source_codes[order], t[order], frequency[order]
+    new_observation = np.ones(len(order), dtype=bool)
+    new_observation[1:] = (sorted_sources[1:] != sorted_sources[:-1]) | (sorted_t[1:] != sorted_t[:-1])
+    sorted_observation = np.cumsum(new_observation) - 1
+    observation = np.empty(len(order), dtype=np.int64)
+    observation[order] = sorted_observation
+
+    # Time to the next observation of the same source (inf if there isn't one)
+    observation_source = sorted_sources[new_observation]
+    observation_time = sorted_t[new_observation]
+    dt_to_next = np.full(len(observation_time), np.inf)
+    same_source = observation_source[1:] == observation_source[:-1]
+    dt_to_next[:-1][same_source] = (observation_time[1:] - observation_time[:-1])[same_source]
+
+    # Hits which should be searched for in the next observation (ignore zero drift rate signals)
+    dt = dt_to_next[observation]
+    searched = np.flatnonzero((dt <= max_drift_time_to_search) & (drift_rate != 0))
+    dt = dt[searched]
+    drift = (dt * drift_rate[searched]) * 1e-6 # Total drift in MHz
+    sigma_drift = np.maximum((dt * sigma_drift_rate(drift_rate[searched], hits.tsamp.values[searched],
+                                                    hits.signal_num_timesteps.values[searched])) * 1e-6, 2 * 1e-6) # Error in drift in MHz
+    expected_new_frequency = frequency[searched] + drift # Where we expect it to drift to in MHz
+
+    # Hits in the next observation strictly inside the window
+    next_observation = observation[searched] + 1
+    lo = block_searchsorted(sorted_observation, sorted_frequency, next_observation, expected_new_frequency - sigma_drift, side="right")
+    hi = block_searchsorted(sorted_observation, sorted_frequency, next_observation, expected_new_frequency + sigma_drift, side="left")
+    counts = np.maximum(hi - lo, 0)
+
+    # Turn each window into the pairs of hits in it
+    from_rows = np.repeat(searched, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    to_rows = order[np.repeat(lo, counts) + offsets]
+    residuals = (frequency[to_rows] - np.repeat(expected_new_frequency, counts)) * 1e6
+    return from_rows, to_rows, residuals
+
+# Filter 11: flags hits which look like they drifted to a hit in the next observation
+# of the same source (within max_drift_time_to_search seconds), and the hits they drifted
+# to. Searches over all coherent hits like the original script. Unlike the original
+# script, a hit is only flagged if there was actually a hit where it should have drifted to
+def filter11(hits, selected, max_drift_time_to_search=10 * 60):
+    from_rows, to_rows, _ = drift_follow_up_matches(hits, max_drift_time_to_search)
+    valid = np.zeros(len(hits), dtype=bool)
+    valid[from_rows] = True
+    valid[to_rows] = True
+    return valid
+
+# Filter 12: rejects hits with fewer than 16 timesteps or an SNR less than 15
+def filter12(hits, selected, min_timesteps=16, min_snr=15):
+    return (hits.num_timesteps.values >= min_timesteps) & (hits.signal_snr.values >= min_snr)
+
+# All the filters in the order they're run
+FILTERS = [
+    (1, filter1),
+    (2, filter2),
+    (3, filter3),
+    (4, filter4),
+    (5, filter5),
+    (6, filter6),
+    (7, filter7),
+    (8, filter8),
+    (9, filter9),
+    (10, filter10),
+    (11, filter11),
+    (12, filter12),
+]
+
+### Run the chain
+# Save the hits which passed filter number (and every filter before it) as ids and as a bitmask
+def save_selection(hits, number, selected):
+    np.save(get_filter_results_path(number), hits.id.values[selected])
+    save_bitmask(get_filter_bitmask_path(number), pack_mask(selected))
+
+# Apply the filters in order to a shared row selection
+# Parameters:
+# - hits: the hit table from load_coherent
+# - filters: list of (filter number, filter function) to run in order
+# - save: whether to save the ids which pass each filter to filterN/run_filter_N_coherent_results.npy
+#   and a bitmask of them (lined up with the rows of hits, see filter_bitmask.py) next to it
+# - log: function to call with progress messages
+# - cache_dir: directory to cache the result of each stage in (see filter_cache.py). Stages
+#   whose hits, upstream stages, code and thresholds haven't changed are read from the cache
+# - manifest: run manifest (see run_manifest.py) to record the time, memory and rows in/out of each filter in
+# - passes: if a dict is given, each filter's own result (before it's ANDed with the
+#   selection) is put in it by filter number (see rejections.py)
+# Returns a dict of filter number -> boolean array of hits which passed that filter and every one before it
+def run_chain(hits, filters=FILTERS, save=True, log=print, cache_dir=None, manifest=None, passes=None):
+    selected = np.ones(len(hits), dtype=bool)
+    selections = {}
+    if save:
+        np.save(row_ids_path, hits.id.values)
+    if cache_dir is not None:
+        key = dataset_fingerprint(hits)
+    for number, filter_function in filters:
+        num_before = selected.sum()
+        with stage(manifest, f"filter {number}", rows_in=int(num_before)) as record:
+            cached = None
+            if cache_dir is not None:
+                key = stage_key(key, number, filter_function)
+                cached = load_cached_selection(cache_dir, key, len(hits))
+            if cached is not None:
+                passed = cached
+            else:
+                passed = filter_function(hits, selected)
+                if cache_dir is not None:
+                    save_cached_selection(cache_dir, key, passed)
+            selected = selected & passed
+            if save:
+                save_selection(hits, number, selected)
+            record["rows_out"] = int(selected.sum())
+            record["cached"] = cached is not None
+        selections[number] = selected
+        if passes is not None:
+            passes[number] = passed
+        log(f"Filter {number}: {selected.sum()} out of {num_before} passed" + (" (cached)" if cached is not None else ""))
+    return selections
@@ -1,5 +1,8 @@
-# run_filter_5_coherent.py
-# Runs filter 5 on all coherent data
+# run_filter_distances_coherent.py
+# Finds the coherent hits which look like one drifting signal with another hit of the same
+# source: a later hit is where the earlier one should have drifted to. Unlike filter 11,
+# which only looks in the next observation of the source, this looks in every later
+# observation within max_drift_time_to_search (see drift_neighbours.py)
 # Noah Stiegler
 # 7/29/24
 
@@ -7,17 +10,17 @@
 import numpy as np
 import pandas as pd
 import os
+import sys
 from datetime import datetime, timedelta
-import multiprocessing
-from scipy.sparse import csr_array
-from scipy.sparse import lil_array
-from scipy.sparse import save_npz
-from scipy.sparse import load_npz
 
 ### Setup for logging
 script_path = os.path.abspath(__file__)
 script_dir = os.path.dirname(script_path)
-log_filepath = script_dir + "/run_filter_5_coherent_log.txt"
+sys.path.append(os.path.join(script_dir, ".."))
+sys.path.append(os.path.join(script_dir, "../.."))
+from hit_store import load_hits, default_store_path
+from drift_neighbours import drift_consistent_pairs
+log_filepath = script_dir + "/run_filter_distances_coherent_log.txt"
 # Setup for logging messages
 def log_message(message):
     with open(log_filepath, 'a') as f:
@@ -27,56 +30,38 @@ def print_and_log(message):
     print(message)
     log_message(message)
 
-### Read in the data
-# Check which server we're on (in case the data is in different places on different servers)
-import socket
-hostname = socket.gethostname()
+# Parameters of search
+max_drift_time_to_search = 60 * 60 # in seconds
 
-# Get paths to data
-if hostname == "blpc1" or hostname == "blpc2":
-    data_path = "/datax/scratch/nstieg/"
-elif hostname == "cosmic-gpu-1":
-    data_path = "/mnt/cosmic-gpu-1/data0/nstiegle/"
+### Read in the data
+full_dataset_path = os.path.join(script_dir, "../../../highfrequency_hit_feb12024_apr302025_coherent_full.pkl")
+coherent_store_path = default_store_path(full_dataset_path)
+columns = ["id", "source_name", "signal_frequency", "signal_drift_rate", "tsamp", "signal_num_timesteps", "tstart"]
+# From the hit store (made with hit_store.py) if there is one, otherwise from the pickle
+if os.path.isdir(coherent_store_path):
+    print_and_log("Reading in coherent data from: " + coherent_store_path)
+    coherent = load_hits(coherent_store_path, columns=columns)
 else:
-    raise Exception("Data path not known")
-
-full_dataset_path = data_path + "25GHz_higher.pkl"
-coherent_dataset_path = data_path + "25GHz_higher_coherent.pkl"
-incoherent_dataset_path = data_path + "25GHz_higher_incoherent.pkl"
-coherent_after_1_path = data_path + "25GHz_higher_coherent_post_filter1.pkl"
-coherent_after_2_path = data_path + "25GHz_higher_coherent_post_filter2.pkl"
-coherent_after_3_path = data_path + "25GHz_higher_coherent_post_filter3.pkl"
-
-# Read in data
-coherent = pd.read_pickle(coherent_dataset_path)
-# incoherent = pd.read_pickle(incoherent_dataset_path)
-# df = pd.read_pickle(full_dataset_path)
-print_and_log("Coherent data read in correctly")
-
-# Read in adjacency information
-adjacency_path = os.path.expanduser("~") + "/BL-COSMIC-2024-proj/frequency_adjacency/adjacent_in_coherent/"
-distances_path = adjacency_path + "coherent_within_1000hz.distances.npz"
-mask_path = adjacency_path + "coherent_within_1000hz.mask.npz"
-distances = load_npz(distances_path)
-mask = load_npz(mask_path)
-
-
-### Run filter 5
-
-
-# # Setup for multiprocessing
-# sources = coherent.groupby("source_name")
-# inputs = [(source, source_name) for source_name, source in sources] 
-# p = multiprocessing.Pool() 
+    print_and_log("Reading in coherent data from: " + full_dataset_path)
+    coherent = pd.read_pickle(full_dataset_path)[columns].reset_index(drop=True)
 
-# # Run algorithm with multiprocessing
-# print_and_log("Running algorithm")
-# results = p.starmap(filter4_single_source, inputs)
-# print_and_log("Algorithm done. Saving")
+### Run filter
+# Find every pair of hits where the first looks like it drifted to the second, in one
+# search over all the coherent hits
+print_and_log("Running algorithm")
+from_rows, to_rows, residuals, dt = drift_consistent_pairs(coherent, max_drift_time_to_search)
+print_and_log(f"Found {len(from_rows)} drift consistent pairs. Saving")
 
-# Save results
-good_indices = np.array([], dtype=int)
-for result in results:
-    good_indices = np.concatenate([good_indices, result])
-np.save(script_dir + "/run_filter_5_coherent_results", good_indices)
-print_and_log("Saved. Done!")
\ No newline at end of file
+# Save results: the ids of the hits in a pair, and the pairs themselves
+valid = np.zeros(len(coherent), dtype=bool)
+valid[from_rows] = True
+valid[to_rows] = True
+good_indices = coherent.id.values[valid]
+np.save(script_dir + "/run_filter_distances_coherent_results", good_indices)
+pd.DataFrame({
+    "from_id": coherent.id.values[from_rows],
+    "to_id": coherent.id.values[to_rows],
+    "residual_hz": residuals,
+    "dt_s": dt,
+}).to_parquet(script_dir + "/run_filter_distances_coherent_pairs.parquet", index=False)
+print_and_log(f"Saved. {len(good_indices)} hits out of {len(coherent)} are in a pair. Done!")
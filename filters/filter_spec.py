@@ -0,0 +1,265 @@
+# filter_spec.py
+# Describes the filter chain as data instead of code, and plans how to run it so cuts
+# which only look at the hit itself (like filters 6, 7, 8 and 12) are done together in a
+# single pass over the columns instead of one pass each
+# Noah Stiegler
+# 10/18/26
+#
+# A spec is a list of stages, in the order the chain is defined, each a dict with:
+# - number: the filter number (what its results are saved as)
+# - where: a list of (column, op, value) conditions a hit has to meet to pass, like the
+#   filters in hit_store.load_hits. op is one of ==, !=, <, <=, >, >=
+#   or
+# - filter: name of a filter function in filter_chain.py (ex. "filter9")
+# - params: (optional) thresholds to run the filter function with (ex. {"threshold": 5e-6})
+# - uses_selection: (optional) whether the filter function's answer depends on which hits
+#   passed the filters before it. True by default, except for filters 9-11 which look at
+#   every hit no matter what was cut before them
+# Specs can also be written as a JSON file of the same list and read with load_spec
+#
+# Planning: filters 1-5 group the hits which are still selected, so they have to see
+# exactly the hits the filters before them let through. Everything else gives the same
+# answer for a hit whatever ran before it, so between the filters which use the selection,
+# the planner is free to reorder. All the "where" cuts there are fused into one pass over
+# the selected rows, which runs first, and the expensive filters (9-11) run after it. The
+# result of each filter is still the same as running the chain in order
+
+### Import useful packages
+import numpy as np
+import json
+import inspect
+import operator
+import types
+import filter_chain
+from filter_chain import save_selection
+from filter_bitmask import row_ids_path
+from filter_cache import dataset_fingerprint, stage_key, load_cached_selection, save_cached_selection
+from run_manifest import stage
+
+# The filter chain in filter_chain.FILTERS as a spec
+DEFAULT_SPEC = [
+    {"number": 1, "filter": "filter1"},
+    {"number": 2, "filter": "filter2", "params": {"min_drift_rate": 0.25}},
+    {"number": 3, "filter": "filter3", "params": {"min_drift_rate": 2}},
+    {"number": 4, "filter": "filter4"},
+    {"number": 5, "filter": "filter5"},
+    {"number": 6, "where": [("signal_drift_rate", "!=", 0)]},
+    {"number": 7, "where": [("signal_snr", ">", 10)]},
+    {"number": 8, "where": [("signal_snr", "<", 100)]},
+    {"number": 9, "filter": "filter9", "params": {"threshold": 2e-6}},
+    {"number": 10, "filter": "filter10", "params": {"threshold": 10e-6}},
+    {"number": 11, "filter": "filter11", "params": {"max_drift_time_to_search": 10 * 60}},
+    {"number": 12, "where": [("num_timesteps", ">=", 16), ("signal_snr", ">=", 15)]},
+]
+
+# Filter functions which give the same answer for a hit no matter which hits are selected
+selection_independent_filters = {"filter6", "filter7", "filter8", "filter9", "filter10", "filter11", "filter12"}
+
+comparisons = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+### Reading specs
+def load_spec(path):
+    with open(path) as f:
+        spec = json.load(f)
+    for entry in spec:
+        if "where" in entry:
+            entry["where"] = [tuple(condition) for condition in entry["where"]]
+    return spec
+
+def save_spec(spec, path):
+    with open(path, "w") as f:
+        json.dump(spec, f, indent=2)
+
+### Turning specs into filter functions
+# Which hits meet every (column, op, value) condition
+def evaluate_conditions(hits, conditions):
+    passes = np.ones(len(hits), dtype=bool)
+    for column, op, value in conditions:
+        passes &= comparisons[op](hits[column].values, value)
+    return passes
+
+# Filter function (with the usual signature, see filter_chain.py) for a list of conditions.
+# The conditions are its keyword default so the filter cache sees when they change
+def make_where_filter(conditions):
+    conditions = tuple(tuple(condition) for condition in conditions)
+    for _, op, _ in conditions:
+        if op not in comparisons:
+            raise ValueError(f"Unknown comparison: {op}")
+    def where_filter(hits, selected, conditions=conditions):
+        return evaluate_conditions(hits, conditions)
+    return where_filter
+
+# Copy of a filter function with different default thresholds
+def with_parameters(filter_function, params):
+    if not params:
+        return filter_function
+    defaults = {p.name: p.default for p in inspect.signature(filter_function).parameters.values()
+                if p.default is not inspect.Parameter.empty}
+    unknown = set(params) - set(defaults)
+    if unknown:
+        raise ValueError(f"{filter_function.__name__} has no parameters {sorted(unknown)}")
+    defaults.update(params)
+    configured = types.FunctionType(filter_function.__code__, filter_function.__globals__, filter_function.__name__,
+                                    tuple(defaults.values()), filter_function.__closure__)
+    configured.__qualname__ = filter_function.__qualname__
+    return configured
+
+# Filter function for one stage of a spec
+def stage_function(entry):
+    if "where" in entry:
+        return make_where_filter(entry["where"])
+    return with_parameters(getattr(filter_chain, entry["filter"]), entry.get("params"))
+
+def uses_selection(entry):
+    if "where" in entry:
+        return False
+    return entry.get("uses_selection", entry["filter"] not in selection_independent_filters)
+
+# Same for a filter function (ex. from filter_chain.FILTERS or compile_spec)
+def function_uses_selection(filter_function):
+    return filter_function.__name__ not in selection_independent_filters | {"where_filter"}
+
+# Turn a spec into a list of (number, filter function) like filter_chain.FILTERS, for
+# running with run_chain (which runs every stage in order, one pass each, and can cache them)
+def compile_spec(spec):
+    return [(entry["number"], stage_function(entry)) for entry in spec]
+
+### Planning
+# Plan how to run a spec
+# Returns a list of steps, each a dict with:
+# - kind: "ordered" (a filter which uses the selection, run where it is in the spec),
+#   "fused" (every where cut between two ordered filters, in one pass) or "independent"
+#   (a filter function which doesn't use the selection, run after the fused cuts)
+# - stages: the spec entries the step runs
+def plan_spec(spec):
+    numbers = [entry["number"] for entry in spec]
+    if len(set(numbers)) != len(numbers):
+        raise ValueError("Filter numbers in a spec have to be unique")
+
+    steps = []
+    segment = []
+    def close_segment():
+        fused = [entry for entry in segment if "where" in entry]
+        if fused:
+            steps.append({"kind": "fused", "stages": fused})
+        for entry in segment:
+            if "where" not in entry:
+                steps.append({"kind": "independent", "stages": [entry]})
+        segment.clear()
+
+    for entry in spec:
+        if uses_selection(entry):
+            close_segment()
+            steps.append({"kind": "ordered", "stages": [entry]})
+        else:
+            segment.append(entry)
+    close_segment()
+    return steps
+
+# One line per step of a plan, for logging
+def describe_plan(plan):
+    lines = []
+    for step in plan:
+        numbers = ", ".join(str(entry["number"]) for entry in step["stages"])
+        lines.append(f"{step['kind']}: filter{'s' if len(step['stages']) > 1 else ''} {numbers}")
+    return lines
+
+### Running a plan
+# Run every where cut of a fused step over the selected rows in one pass. The selected
+# rows of each column used are gathered once, then all the cuts are evaluated a block of
+# rows at a time (so the block stays in cache between cuts)
+# Returns a dict of filter number -> boolean array over the rows of hits (False for rows
+# which weren't selected)
+def run_fused(hits, selected, entries, block_size=1 << 16):
+    rows = np.flatnonzero(selected)
+    columns = {column for entry in entries for column, _, _ in entry["where"]}
+    values = {column: hits[column].values[rows] for column in columns}
+
+    passes = {entry["number"]: np.empty(len(rows), dtype=bool) for entry in entries}
+    for start in range(0, len(rows), block_size):
+        block = slice(start, start + block_size)
+        for entry in entries:
+            out = passes[entry["number"]][block]
+            out[:] = True
+            for column, op, value in entry["where"]:
+                out &= comparisons[op](values[column][block], value)
+
+    full = {}
+    for number, passed in passes.items():
+        full[number] = np.zeros(len(hits), dtype=bool)
+        full[number][rows] = passed
+    return full
+
+# Run a spec with the plan from plan_spec
+# Parameters:
+# - hits: the hit table from filter_chain.load_coherent
+# - spec: the chain to run (DEFAULT_SPEC is the same as filter_chain.FILTERS)
+# - save, log, cache_dir, manifest: like filter_chain.run_chain. Stages are keyed in the
+#   order the plan runs them, so a cached spec run and a cached run_chain don't share results
+# - passes: like filter_chain.run_chain. The rejection bits (see rejections.py) need every
+#   filter's result on every hit, so when it's given, the fused cuts are done on every hit
+#   instead of only the selected ones. Leave it out unless the bits are wanted
+# Returns a dict of filter number -> boolean array of hits which passed that filter and
+# every one before it in the spec (the same as run_chain on compile_spec(spec))
+def run_spec(hits, spec=DEFAULT_SPEC, save=True, log=print, cache_dir=None, manifest=None, passes=None):
+    plan = plan_spec(spec)
+    for line in describe_plan(plan):
+        log("Plan: " + line)
+    if save:
+        np.save(row_ids_path, hits.id.values)
+    if cache_dir is not None:
+        fingerprint = dataset_fingerprint(hits)
+        key = fingerprint
+
+    keep_passes = passes is not None
+    if passes is None:
+        passes = {} # Result of each filter on its own
+    selected = np.ones(len(hits), dtype=bool) # Rows which passed every filter run so far
+    for step in plan:
+        entries = step["stages"]
+        name = "filters " + ", ".join(str(entry["number"]) for entry in entries)
+        # If the caller wants every filter's own result, the cuts are done on every hit
+        every_hit = step["kind"] == "fused" and keep_passes
+        with stage(manifest, name, rows_in=int(selected.sum()), step=step["kind"]) as record:
+            keys = {}
+            if cache_dir is not None:
+                for entry in entries:
+                    key = stage_key(key, entry["number"], stage_function(entry))
+                    # Cuts done on every hit only depend on the hits, not on the stages before them
+                    keys[entry["number"]] = stage_key(fingerprint, entry["number"], stage_function(entry)) if every_hit else key
+                    cached = load_cached_selection(cache_dir, keys[entry["number"]], len(hits))
+                    if cached is not None:
+                        passes[entry["number"]] = cached
+            to_run = [entry for entry in entries if entry["number"] not in passes]
+            if to_run:
+                if step["kind"] == "fused":
+                    passes.update(run_fused(hits, selected if not every_hit else np.ones(len(hits), dtype=bool), to_run))
+                else:
+                    passes[to_run[0]["number"]] = stage_function(to_run[0])(hits, selected)
+                if cache_dir is not None:
+                    for entry in to_run:
+                        save_cached_selection(cache_dir, keys[entry["number"]], passes[entry["number"]])
+            for entry in entries:
+                selected = selected & passes[entry["number"]]
+            record["rows_out"] = int(selected.sum())
+            record["cached"] = len(to_run) == 0
+
+    # Put the results back together in the order of the spec
+    selections = {}
+    selected = np.ones(len(hits), dtype=bool)
+    for entry in spec:
+        number = entry["number"]
+        num_before = selected.sum()
+        selected = selected & passes[number]
+        selections[number] = selected
+        log(f"Filter {number}: {selected.sum()} out of {num_before} passed")
+        if save:
+            save_selection(hits, number, selected)
+    return selections
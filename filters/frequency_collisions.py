@@ -0,0 +1,65 @@
+# frequency_collisions.py
+# Finds the hits which are the only hit at their exact frequency (what filter 5 keeps)
+# without needing the whole table in memory, so it can be run over the coherent,
+# incoherent and phase center data together
+# Noah Stiegler
+# 10/18/26
+#
+# Works like a hash join which spills to disk:
+# 1. Stream through the hits a batch at a time and append each (id, frequency) to one of
+#    num_buckets files on disk picked by a hash of the frequency. Every hit at the same
+#    frequency ends up in the same bucket
+# 2. Read the buckets back in one at a time and count how many hits are at each frequency
+#    with np.unique. Only one bucket (about 1/num_buckets of the hits) is in memory at once
+
+### Import useful packages
+import numpy as np
+import os
+import shutil
+import tempfile
+
+# Bucket for each frequency from a hash of its bits (Fibonacci hashing)
+def frequency_buckets(frequencies, num_buckets):
+    bits = np.ascontiguousarray(frequencies, dtype=np.float64).view(np.uint64)
+    hashed = bits * np.uint64(0x9E3779B97F4A7C15)
+    return ((hashed >> np.uint64(32)) % np.uint64(num_buckets)).astype(np.int64)
+
+# Ids of the hits which are the only hit at their exact frequency
+# Parameters:
+# - batches: iterable of (ids, frequencies) arrays, ex. from hit_store.iter_hit_batches
+# - num_buckets: how many pieces to split the hits into. Memory use is about
+#   16 bytes * (number of hits) / num_buckets
+# - tmp_dir: where to put the bucket files (a new temporary directory if None)
+# Returns:
+# - array of ids of the hits alone at their frequency
+def singleton_frequency_ids(batches, num_buckets=64, tmp_dir=None):
+    bucket_dir = tempfile.mkdtemp(prefix="frequency_collisions_", dir=tmp_dir)
+    try:
+        # Spill each hit to its bucket
+        id_files = [open(os.path.join(bucket_dir, f"{b}.ids"), "ab") for b in range(num_buckets)]
+        frequency_files = [open(os.path.join(bucket_dir, f"{b}.frequencies"), "ab") for b in range(num_buckets)]
+        try:
+            for ids, frequencies in batches:
+                ids = np.asarray(ids, dtype=np.int64)
+                frequencies = np.asarray(frequencies, dtype=np.float64)
+                buckets = frequency_buckets(frequencies, num_buckets)
+                order = np.argsort(buckets, kind="stable")
+                bounds = np.searchsorted(buckets[order], np.arange(num_buckets + 1))
+                for b in np.flatnonzero(np.diff(bounds)):
+                    rows = order[bounds[b]:bounds[b + 1]]
+                    ids[rows].tofile(id_files[b])
+                    frequencies[rows].tofile(frequency_files[b])
+        finally:
+            for f in id_files + frequency_files:
+                f.close()
+
+        # Count each bucket on its own
+        singleton_ids = []
+        for b in range(num_buckets):
+            ids = np.fromfile(os.path.join(bucket_dir, f"{b}.ids"), dtype=np.int64)
+            frequencies = np.fromfile(os.path.join(bucket_dir, f"{b}.frequencies"), dtype=np.float64)
+            _, inverse, counts = np.unique(frequencies, return_inverse=True, return_counts=True)
+            singleton_ids.append(ids[counts[inverse] == 1])
+        return np.concatenate(singleton_ids)
+    finally:
+        shutil.rmtree(bucket_dir)
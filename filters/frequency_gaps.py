@@ -0,0 +1,61 @@
+# frequency_gaps.py
+# Finds how far each hit is from the closest other hit in frequency, which is all
+# filters 9 and 10 ("no other hit within X Hz") need. Once the frequencies are sorted,
+# a hit's closest neighbour is either the hit just below it or just above it, so the
+# gaps to those two hits answer "is there another hit within X" for any X, instead of
+# going through the 1000Hz adjacency matrices
+# Noah Stiegler
+# 10/18/26
+#
+# Ex. hits which passed filter 8 with no other hit from the same source within 5Hz:
+#   gaps = nearest_neighbour_gaps(hits.signal_frequency.values, selected=selections[8], groups=hits.source_name.values)
+#   lonely = selections[8] & (gaps > 5e-6)
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+
+# Gaps between each sorted frequency and the ones on either side of it (inf if there
+# isn't one, or if the hit next to it is in a different group)
+# Parameters:
+# - sorted_frequencies: frequencies in increasing order (within each group)
+# - sorted_groups: group of each frequency, with the groups contiguous (None for one group)
+# Returns:
+# - (left, right) gaps
+def sorted_gaps(sorted_frequencies, sorted_groups=None):
+    steps = np.diff(sorted_frequencies)
+    if sorted_groups is not None:
+        steps = np.where(sorted_groups[1:] == sorted_groups[:-1], steps, np.inf)
+    left = np.concatenate([[np.inf], steps])
+    right = np.concatenate([steps, [np.inf]])
+    return left, right
+
+# How far (in MHz) each hit is from the closest other hit
+# Parameters:
+# - frequencies: frequency of each hit
+# - selected: only look for neighbours among these hits (None for all of them). Hits
+#   which aren't selected get a gap of inf
+# - groups: only look for neighbours in the same group (ex. the source names)
+# - order: the order which sorts the (selected) frequencies, if it's already known
+# Returns:
+# - array of the distance from each hit to its closest neighbour
+def nearest_neighbour_gaps(frequencies, selected=None, groups=None, order=None):
+    rows = np.arange(len(frequencies)) if selected is None else np.flatnonzero(selected)
+    if order is None:
+        if groups is None:
+            order = np.argsort(frequencies[rows], kind="stable")
+        else:
+            group_codes = pd.factorize(groups[rows])[0]
+            order = np.lexsort((frequencies[rows], group_codes))
+    sorted_rows = rows[order]
+    sorted_groups = None if groups is None else groups[sorted_rows]
+    left, right = sorted_gaps(frequencies[sorted_rows], sorted_groups)
+
+    gaps = np.full(len(frequencies), np.inf)
+    gaps[sorted_rows] = np.minimum(left, right)
+    return gaps
+
+# Which hits have another hit within threshold (in MHz) of them. Takes the same
+# arguments as nearest_neighbour_gaps
+def has_close_neighbour(frequencies, threshold, selected=None, groups=None, order=None):
+    return nearest_neighbour_gaps(frequencies, selected, groups, order) <= threshold
@@ -0,0 +1,423 @@
+# incremental_chain.py
+# Keeps the state of the filter chain (1-12) on disk between runs so a new batch of hits
+# appended to the dataset only costs as much as the hits it touches, instead of
+# re-running every filter over the whole archive
+# Noah Stiegler
+# 10/18/26
+#
+# What a new batch of hits can change:
+# - Filters 1-5: only look at groups of hits at exactly the same frequency (by source for
+#   1-4, over all sources for 5), and a (source, frequency) group is inside a frequency
+#   group. So rerunning 1-5 on every hit at one of the new frequencies gives exactly the
+#   right answer for them, and nothing else changes
+# - Filters 6-8 and 12: only look at the hit itself, so only the new hits are run
+# - Filters 9 and 10: adding hits can only make a hit's closest neighbour closer. A new
+#   hit's closest neighbour is the hit just below or just above it in one of the batches'
+#   sorted frequencies, and the only old hits which can get a closer neighbour are the ones
+#   just below or above a new hit in their batch (if another old hit is between them, that
+#   one is already closer). The gaps are the difference of the two frequencies (higher
+#   minus lower), like frequency_gaps.has_close_neighbour, so hits exactly the threshold
+#   apart get the same answer as running the whole chain
+# - Filter 11: a new hit can change the next observation of its source, so the hits from
+#   the observations either side of any new time (and the ones either side of those, which
+#   they're paired with) are rerun
+#
+# The state is a directory with:
+# - arrays/<name>.bin: a flat binary file for each column of the hits the chain uses
+#   (text like the source names as a number for each distinct value, with the values in
+#   info.json) and for each piece of the chain's state: group_1-5 (passed filters 1-5 and
+#   the ones before them), passes_6/7/8/12 (passed that filter on its own), close_9/10 (has
+#   a hit within 2/10Hz) and valid_11 (passed filter 11). Each batch's rows are added to the
+#   end of the files, which are memory mapped so an update only reads the rows it touches
+#   and only rewrites the state of the old rows which change
+# - runs/: for each batch k, its frequencies sorted (frequencies_k.npy, with the row of each
+#   in frequency_rows_k.npy) and its hits sorted by source then time (time_sources_k.npy,
+#   time_keys_k.npy, time_rows_k.npy). Each is searched with a binary search, so an update
+#   costs a few binary searches for each batch so far plus the rows it touches. start_state
+#   puts everything back into one batch
+# - info.json: the number of hits and batches, and the type of each array. It's replaced
+#   last (atomically), so rows and runs from an update which was stopped partway aren't
+#   counted. Running the same update again gives the right state
+#
+# Ex.
+#   state = start_state(coherent, state_dir)
+#   state = update_state(load_state(state_dir), new_hits)
+#   selections = chain_selections(state)
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import os
+import json
+import shutil
+from filter_chain import FILTERS, run_chain, chain_columns, filter6, filter7, filter8, filter11, filter12
+from frequency_gaps import nearest_neighbour_gaps
+
+### Setup
+group_filters = FILTERS[:5] # Filters 1-5
+rowwise_filters = {6: filter6, 7: filter7, 8: filter8, 12: filter12}
+neighbour_thresholds = {9: 2e-6, 10: 10e-6} # in MHz
+state_names = ([f"group_{number}" for number, _ in group_filters] + [f"passes_{number}" for number in rowwise_filters]
+               + [f"close_{number}" for number in neighbour_thresholds] + ["valid_11"])
+run_names = ["frequencies", "frequency_rows", "time_sources", "time_keys", "time_rows"]
+
+# Don't print anything when running parts of the chain on subsets of the hits
+def _no_log(message):
+    pass
+
+### Pieces of the chain
+# Rows which passed each of filters 1-5 (and the ones before it)
+# Returns a dict of group_<number> -> boolean array
+def group_selections(hits):
+    selections = run_chain(hits, group_filters, save=False, log=_no_log)
+    return {f"group_{number}": selections[number] for number, _ in group_filters}
+
+# Every piece of the state for a table of hits, from running the whole chain on it
+def _chain_state(hits):
+    state = group_selections(hits)
+    for number, f in rowwise_filters.items():
+        state[f"passes_{number}"] = f(hits, None)
+    gaps = nearest_neighbour_gaps(hits.signal_frequency.values)
+    for number, threshold in neighbour_thresholds.items():
+        state[f"close_{number}"] = gaps <= threshold
+    state["valid_11"] = filter11(hits, np.ones(len(hits), dtype=bool))
+    return state
+
+# Put all the pieces of the state together into the rows which pass each filter
+# Returns a dict of filter number -> boolean array (like run_chain)
+def chain_selections(state):
+    arrays = state["arrays"]
+    selections = {}
+    for number, _ in group_filters:
+        selections[number] = np.asarray(arrays[f"group_{number}"])
+    selected = selections[5]
+    for number in (6, 7, 8):
+        selected = selected & arrays[f"passes_{number}"]
+        selections[number] = selected
+    for number in (9, 10):
+        selected = selected & ~arrays[f"close_{number}"]
+        selections[number] = selected
+    selected = selected & arrays["valid_11"]
+    selections[11] = selected
+    selections[12] = selected & arrays["passes_12"]
+    return selections
+
+### Storing the columns
+# The columns of the hits which are kept (the ones the chain uses, plus the human readable
+# start times if they're there, since filter 11 uses them instead of tstart)
+def state_columns(hits):
+    return [column for column in chain_columns + ["tstart_h"] if column in hits.columns]
+
+# The column which tells the observations of a source apart (the one tstart_seconds uses)
+def _time_column(columns):
+    return "tstart_h" if "tstart_h" in columns else "tstart"
+
+# Just the columns which are kept, with the start times as times (they can be text)
+def _prepare(hits, columns):
+    hits = hits[columns].reset_index(drop=True)
+    if "tstart_h" in columns:
+        hits["tstart_h"] = pd.to_datetime(hits.tstart_h)
+    return hits
+
+# How a column is stored: "datetime" (int64 nanoseconds), "number" (as it is) or "text"
+# (a number for each distinct value)
+def _column_kind(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return "datetime"
+    if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        return "number"
+    return "text"
+
+# Turn a column into the array which is stored. New text values are added to categories
+def _encode(values, kind, categories=None):
+    if kind == "datetime":
+        return pd.to_datetime(values).values.astype("datetime64[ns]").view(np.int64)
+    if kind == "text":
+        values = pd.Series(values).astype(str)
+        codes = {value: code for code, value in enumerate(categories)}
+        for value in values.unique():
+            if value not in codes:
+                codes[value] = len(categories)
+                categories.append(value)
+        return values.map(codes).values.astype(np.int32)
+    return np.asarray(values)
+
+# Turn a stored array back into the column
+def _decode(array, kind, categories=None):
+    if kind == "datetime":
+        return np.asarray(array).view("datetime64[ns]")
+    if kind == "text":
+        return np.asarray(categories, dtype=object)[array]
+    return np.asarray(array)
+
+def _array_path(directory, name):
+    return os.path.join(directory, "arrays", name + ".bin")
+
+# Add rows to the end of array files. Anything after the first num_rows rows (left by an
+# update which was stopped) is cut off first
+def _append_arrays(directory, arrays, dtypes, num_rows):
+    os.makedirs(os.path.join(directory, "arrays"), exist_ok=True)
+    for name, values in arrays.items():
+        dtype = np.dtype(dtypes[name])
+        path = _array_path(directory, name)
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.truncate(num_rows * dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+# Memory map the first num_rows rows of array files
+def _open_arrays(directory, dtypes, num_rows, mode="r"):
+    if num_rows == 0:
+        return {name: np.zeros(0, dtype=dtype) for name, dtype in dtypes.items()}
+    return {name: np.memmap(_array_path(directory, name), dtype=dtype, mode=mode, shape=(num_rows,))
+            for name, dtype in dtypes.items()}
+
+# Read some rows of the hits (rows in increasing order) into a dataframe
+def read_rows(state, rows):
+    info = state["info"]
+    return pd.DataFrame({column: _decode(state["arrays"][column][rows], info["kinds"][column], info["categories"].get(column))
+                         for column in info["columns"]})
+
+def _run_path(directory, name, k):
+    return os.path.join(directory, "runs", f"{name}_{k}.npy")
+
+# Sort a batch's hits by frequency, and by source then time, and save them as run k
+def _save_runs(directory, k, rows, frequencies, source_codes, time_keys):
+    os.makedirs(os.path.join(directory, "runs"), exist_ok=True)
+    order = np.argsort(frequencies, kind="stable")
+    np.save(_run_path(directory, "frequencies", k), frequencies[order])
+    np.save(_run_path(directory, "frequency_rows", k), rows[order])
+    order = np.lexsort((time_keys, source_codes))
+    np.save(_run_path(directory, "time_sources", k), source_codes[order])
+    np.save(_run_path(directory, "time_keys", k), time_keys[order])
+    np.save(_run_path(directory, "time_rows", k), rows[order])
+
+def _load_runs(directory, num_batches):
+    return [{name: np.load(_run_path(directory, name, k), mmap_mode="r") for name in run_names} for k in range(num_batches)]
+
+# Replace info.json all at once
+def _commit_info(directory, info):
+    path = os.path.join(directory, "info.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(info, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+### Searching the runs
+# The values at the ranges lo to hi of an array, all in one array
+def _ranges(values, lo, hi):
+    counts = np.maximum(hi - lo, 0)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.asarray(values[np.repeat(lo, counts) + offsets])
+
+# Every row (in any batch) at one of the frequencies
+def _rows_at_frequencies(runs, frequencies):
+    parts = [np.array([], dtype=np.int64)]
+    for run in runs:
+        lo = np.searchsorted(run["frequencies"], frequencies, side="left")
+        hi = np.searchsorted(run["frequencies"], frequencies, side="right")
+        parts.append(_ranges(run["frequency_rows"], lo, hi))
+    return np.sort(np.concatenate(parts))
+
+# The (up to) two distinct times before (or after) time in the sorted times of a source
+def _times_before(times, time):
+    found = []
+    position = np.searchsorted(times, time, side="left")
+    while position > 0 and len(found) < 2:
+        found.append(times[position - 1])
+        position = np.searchsorted(times, times[position - 1], side="left")
+    return found
+
+def _times_after(times, time):
+    found = []
+    position = np.searchsorted(times, time, side="right")
+    while position < len(times) and len(found) < 2:
+        found.append(times[position])
+        position = np.searchsorted(times, times[position], side="right")
+    return found
+
+### Updating each piece of the state
+# Rerun filters 1-5 on every hit at one of the new frequencies
+# Returns the rows (old and new) and a dict of their group_<number> results
+def _update_group_selections(state, runs, new_frequencies):
+    rows = _rows_at_frequencies(runs, np.unique(new_frequencies))
+    return rows, group_selections(read_rows(state, rows))
+
+# Gaps of the new hits to their closest neighbour, and the old hits which are next to a
+# new hit in their batch with the gap between them
+# Returns (new_gaps, old_rows, old_gaps)
+def _update_gaps(old_runs, new_frequencies):
+    new_gaps = nearest_neighbour_gaps(new_frequencies)
+    old_rows, old_gaps = [np.array([], dtype=np.int64)], [np.array([])]
+    for run in old_runs:
+        sorted_frequencies = run["frequencies"]
+        position = np.searchsorted(sorted_frequencies, new_frequencies, side="left")
+        above = np.flatnonzero(position < len(sorted_frequencies))
+        below = np.flatnonzero(position > 0)
+        gap_above = np.asarray(sorted_frequencies[position[above]]) - new_frequencies[above]
+        gap_below = new_frequencies[below] - np.asarray(sorted_frequencies[position[below] - 1])
+        new_gaps[above] = np.minimum(new_gaps[above], gap_above)
+        new_gaps[below] = np.minimum(new_gaps[below], gap_below)
+        old_rows += [np.asarray(run["frequency_rows"][position[above]]), np.asarray(run["frequency_rows"][position[below] - 1])]
+        old_gaps += [gap_above, gap_below]
+    return new_gaps, np.concatenate(old_rows), np.concatenate(old_gaps)
+
+# Rerun filter 11 on the observations of each source around the times of the new hits
+# Returns the rows whose result is redone, their results and the number of rows read
+def _update_valid_11(state, runs, new_sources, new_times):
+    time_keys = state["arrays"][_time_column(state["info"]["columns"])]
+    redone_rows, redone_valid = [np.array([], dtype=np.int64)], [np.array([], dtype=bool)]
+    num_read = 0
+    for source in np.unique(new_sources):
+        # Where the source's hits are in each batch
+        pieces = []
+        for run in runs:
+            start = np.searchsorted(run["time_sources"], source, side="left")
+            stop = np.searchsorted(run["time_sources"], source, side="right")
+            if stop > start:
+                pieces.append((run, start, run["time_keys"][start:stop]))
+
+        # Times to read for each new time: the two times either side of it. The hits in the
+        # times next to it are the ones which can change, and they need the times next to them
+        windows = []
+        for time in np.unique(new_times[new_sources == source]):
+            before = sorted(set(t for _, _, times in pieces for t in _times_before(times, time)), reverse=True)[:2]
+            after = sorted(set(t for _, _, times in pieces for t in _times_after(times, time)))[:2]
+            windows.append((before[-1] if before else time, after[-1] if after else time,
+                            before[0] if before else time, after[0] if after else time))
+
+        # Run filter 11 on each stretch of overlapping windows
+        windows.sort()
+        stretches = []
+        for first, last, rerun_first, rerun_last in windows:
+            if stretches and first <= stretches[-1][1]:
+                stretches[-1][1] = max(stretches[-1][1], last)
+                stretches[-1][2].append((rerun_first, rerun_last))
+            else:
+                stretches.append([first, last, [(rerun_first, rerun_last)]])
+        for first, last, reruns in stretches:
+            rows = np.sort(np.concatenate([np.asarray(run["time_rows"][start + np.searchsorted(times, first, side="left"):
+                                                                        start + np.searchsorted(times, last, side="right")])
+                                           for run, start, times in pieces]))
+            valid = filter11(read_rows(state, rows), np.ones(len(rows), dtype=bool))
+            times = np.asarray(time_keys[rows])
+            rerun = np.zeros(len(rows), dtype=bool)
+            for rerun_first, rerun_last in reruns:
+                rerun |= (times >= rerun_first) & (times <= rerun_last)
+            redone_rows.append(rows[rerun])
+            redone_valid.append(valid[rerun])
+            num_read += len(rows)
+    return np.concatenate(redone_rows), np.concatenate(redone_valid), num_read
+
+### Starting and updating the state
+# Run the whole chain on hits and save everything needed to update it later in directory
+# (replacing any state there)
+# Returns the state, loaded from the directory
+def start_state(hits, directory):
+    columns = state_columns(hits)
+    hits = _prepare(hits, columns)
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(os.path.join(directory, "info.json")):
+        os.remove(os.path.join(directory, "info.json"))
+    for name in ["arrays", "runs"]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    info = {"num_hits": 0, "num_batches": 0, "columns": columns,
+            "kinds": {column: _column_kind(hits[column]) for column in columns}}
+    info["categories"] = {column: [] for column in columns if info["kinds"][column] == "text"}
+    arrays = {column: _encode(hits[column], info["kinds"][column], info["categories"].get(column)) for column in columns}
+    arrays.update(_chain_state(hits))
+    info["dtypes"] = {name: array.dtype.str for name, array in arrays.items()}
+
+    _append_arrays(directory, arrays, info["dtypes"], 0)
+    if len(hits) > 0:
+        _save_runs(directory, 0, np.arange(len(hits)), arrays["signal_frequency"], arrays["source_name"],
+                   arrays[_time_column(columns)])
+    _commit_info(directory, dict(info, num_hits=len(hits), num_batches=int(len(hits) > 0)))
+    return load_state(directory)
+
+# Load a state saved by start_state or update_state. Every array is memory mapped
+# Returns a dict with the directory, info (from info.json), arrays (name -> array over
+# the hits, see the top of this file) and runs (a dict of sorted arrays for each batch)
+def load_state(directory):
+    with open(os.path.join(directory, "info.json")) as f:
+        info = json.load(f)
+    return {
+        "directory": directory,
+        "info": info,
+        "arrays": _open_arrays(directory, info["dtypes"], info["num_hits"]),
+        "runs": _load_runs(directory, info["num_batches"]),
+    }
+
+# Add a batch of new hits to the state, only reading and rerunning what they touch
+# Parameters:
+# - state: from start_state, load_state or a previous update_state
+# - new_hits: dataframe of new hits with (at least) the columns of the hits in the state
+# - log: function to call with progress messages
+# Returns the updated state, loaded from its directory, with last_update: how many rows
+# of the archive the update read (rows_read) and how many old rows' results it changed
+# (old_rows_changed)
+def update_state(state, new_hits, log=print):
+    directory = state["directory"]
+    info = json.loads(json.dumps(state["info"])) # A copy, so the state passed in doesn't change
+    if len(new_hits) == 0:
+        return load_state(directory)
+    columns = info["columns"]
+    time_column = _time_column(columns)
+    num_old = info["num_hits"]
+    new_hits = _prepare(new_hits, columns)
+    num_all = num_old + len(new_hits)
+
+    # Add the new hits' columns and runs (they don't count until info.json is replaced)
+    new_columns = {column: np.asarray(_encode(new_hits[column], info["kinds"][column], info["categories"].get(column)),
+                                      dtype=info["dtypes"][column]) for column in columns}
+    _append_arrays(directory, new_columns, info["dtypes"], num_old)
+    batch = info["num_batches"]
+    _save_runs(directory, batch, np.arange(num_old, num_all), new_columns["signal_frequency"],
+               new_columns["source_name"], new_columns[time_column])
+    runs = _load_runs(directory, batch + 1)
+    updated = {"info": info, "arrays": _open_arrays(directory, {column: info["dtypes"][column] for column in columns}, num_all)}
+
+    # Work out what changes. The new rows' results are kept in new_state, and the old
+    # rows' are only changed once everything has been worked out
+    new_state = {name: np.zeros(len(new_hits), dtype=bool) for name in state_names}
+    changes = [] # (name, rows, results)
+
+    rows, group = _update_group_selections(updated, runs, new_columns["signal_frequency"])
+    changes += [(name, rows, passed) for name, passed in group.items()]
+    log(f"Filters 1-5: reran {len(rows)} hits at the {len(new_hits)} new hits' frequencies")
+
+    for number, f in rowwise_filters.items():
+        new_state[f"passes_{number}"] = f(new_hits, None)
+
+    new_gaps, neighbour_rows, neighbour_gaps = _update_gaps(runs[:-1], new_columns["signal_frequency"])
+    for number, threshold in neighbour_thresholds.items():
+        new_state[f"close_{number}"] = new_gaps <= threshold
+        close = neighbour_rows[neighbour_gaps <= threshold]
+        changes.append((f"close_{number}", close, np.ones(len(close), dtype=bool)))
+    log(f"Filters 9-10: checked the {len(neighbour_rows)} old hits next to a new one")
+
+    rows, valid, num_valid = _update_valid_11(updated, runs, new_columns["source_name"], new_columns[time_column])
+    changes.append(("valid_11", rows, valid))
+    log(f"Filter 11: reran {num_valid} hits from observations around the new ones")
+
+    # Save the changes: the old rows in place, then the new rows on the end
+    old_state = _open_arrays(directory, {name: info["dtypes"][name] for name in state_names}, num_old, mode="r+")
+    old_rows_changed = []
+    for name, rows, results in changes:
+        old = rows < num_old
+        old_rows_changed.append(rows[old][old_state[name][rows[old]] != results[old]])
+        old_state[name][rows[old]] = results[old]
+        new_state[name][rows[~old] - num_old] = results[~old]
+    for array in old_state.values():
+        if isinstance(array, np.memmap):
+            array.flush()
+    del old_state
+    _append_arrays(directory, new_state, info["dtypes"], num_old)
+    _commit_info(directory, dict(info, num_hits=num_all, num_batches=batch + 1))
+
+    state = load_state(directory)
+    state["last_update"] = {"rows_read": len(group["group_1"]) + len(neighbour_rows) + num_valid,
+                            "old_rows_changed": len(np.unique(np.concatenate(old_rows_changed)))}
+    return state
@@ -0,0 +1,116 @@
+# rejections.py
+# Keeps which filter removed each hit as one small array lined up with the rows of the
+# coherent hit table (like the bitmasks in filter_bitmask.py), so attrition tables and
+# "what if filter K wasn't there" questions are a bincount instead of loading every
+# filter's ids and set-differencing them
+# Noah Stiegler
+# 10/18/26
+#
+# Two arrays are made from a run of the chain:
+# - first rejecting filter (uint8): the number of the first filter which removed the hit,
+#   or 0 if it passed every filter
+# - rejection bits: bit i is set if the i-th filter in the chain rejects the hit. Filters
+#   which only look at the hit (or at every hit, like 9-11) judge every hit. Filters 1-5
+#   group the hits which are still selected, so they only judge the hits which reached them
+#
+# Ex.
+#   passes = {}
+#   selections = run_chain(coherent, passes=passes)
+#   first = first_rejecting_filter(selections)
+#   bits = rejection_bits(passes, selections, FILTERS)
+#   attrition(first), without_filter(bits, [number for number, _ in FILTERS])
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import os
+from filter_spec import function_uses_selection
+
+### Paths
+script_path = os.path.abspath(__file__)
+script_dir = os.path.dirname(script_path)
+first_rejecting_filter_path = os.path.join(script_dir, "coherent_first_rejecting_filter.npy")
+rejection_bits_path = os.path.join(script_dir, "coherent_rejection_bits.npy")
+
+### Making the arrays
+# Number of the first filter which removed each hit (0 if it passed them all)
+# Parameters:
+# - selections: dict of filter number -> hits which passed it and every filter before it
+#   (from run_chain), in the order the filters ran
+def first_rejecting_filter(selections):
+    numbers = list(selections)
+    if max(numbers, default=0) > 255 or min(numbers, default=1) < 1:
+        raise ValueError("Filter numbers have to be 1-255 to fit in a uint8")
+    n = len(next(iter(selections.values()))) if selections else 0
+    first = np.zeros(n, dtype=np.uint8)
+    previous = np.ones(n, dtype=bool)
+    for number, selected in selections.items():
+        first[previous & ~selected] = number
+        previous = selected
+    return first
+
+# Smallest unsigned integer type with a bit for every filter
+def _bits_dtype(num_filters):
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if num_filters <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError("Too many filters to fit in a uint64")
+
+# Bit i set for every hit the i-th filter rejects
+# Parameters:
+# - passes: dict of filter number -> the filter's own result (from run_chain(..., passes=passes))
+# - selections: dict of filter number -> hits which passed it and every filter before it
+# - filters: list of (number, filter function) that was run, to know which filters use the selection
+def rejection_bits(passes, selections, filters):
+    n = len(next(iter(selections.values()))) if selections else 0
+    bits = np.zeros(n, dtype=_bits_dtype(len(filters)))
+    reached = np.ones(n, dtype=bool)
+    for i, (number, filter_function) in enumerate(filters):
+        rejected = ~passes[number]
+        if function_uses_selection(filter_function):
+            rejected &= reached
+        bits[rejected] |= bits.dtype.type(1 << i)
+        reached = selections[number]
+    return bits
+
+### Questions
+# How many hits each filter removed (and how many were left after it) from one bincount
+# Parameters:
+# - first: from first_rejecting_filter
+# - numbers: the filter numbers in the order they ran (every number in first if None)
+def attrition(first, numbers=None):
+    counts = np.bincount(first, minlength=256)
+    if numbers is None:
+        numbers = [number for number in np.flatnonzero(counts) if number != 0]
+    cut = counts[numbers]
+    remaining = len(first) - np.cumsum(cut)
+    return pd.DataFrame({"filter": numbers, "cut": cut, "remaining": remaining,
+                         "fraction_cut": cut / np.maximum(remaining + cut, 1)})
+
+# How many more hits would survive without each filter: the hits rejected by that
+# filter and nothing else. For filters 1-5 this is a lower bound, since without one of
+# them the later group filters would see more hits
+# Parameters:
+# - bits: from rejection_bits
+# - numbers: the filter numbers, in the order of the bits
+def without_filter(bits, numbers):
+    only_one = bits[(bits != 0) & ((bits & (bits - 1)) == 0)] # Exactly one bit set
+    position = np.log2(only_one.astype(np.float64)).astype(np.int64)
+    counts = np.bincount(position, minlength=len(numbers))
+    survivors = np.count_nonzero(bits == 0)
+    return pd.DataFrame({"filter": numbers, "extra_survivors": counts, "survivors": survivors + counts})
+
+### Saving
+# Without bits, any bits saved by an earlier run are removed so they aren't read back with
+# the first rejecting filters of this one
+def save_rejections(first, bits=None):
+    np.save(first_rejecting_filter_path, first)
+    if bits is not None:
+        np.save(rejection_bits_path, bits)
+    elif os.path.exists(rejection_bits_path):
+        os.remove(rejection_bits_path)
+
+def load_rejections(mmap_mode=None):
+    first = np.load(first_rejecting_filter_path, mmap_mode=mmap_mode)
+    bits = np.load(rejection_bits_path, mmap_mode=mmap_mode) if os.path.exists(rejection_bits_path) else None
+    return first, bits
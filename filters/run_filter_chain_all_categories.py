@@ -0,0 +1,72 @@
+# run_filter_chain_all_categories.py
+# Runs filters 1-12 on the coherent, incoherent and phase center hits at the same time,
+# reading the full dataset in once (see category_chain.py)
+# Saves which filter removed each hit (lined up with all_categories_row_ids.npy) and
+# how many hits of each category survived each filter
+# Noah Stiegler
+# 10/18/26
+#
+# Usage: python run_filter_chain_all_categories.py [<full dataset .pkl or hit store>]
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import os
+import sys
+from datetime import datetime
+from filter_chain import FILTERS, chain_columns
+from category_chain import run_chain_by_category, category_survival
+from hit_store import load_hits, default_store_path
+from run_manifest import start_manifest, stage, default_manifest_path
+
+### Setup for logging
+script_path = os.path.abspath(__file__)
+script_dir = os.path.dirname(script_path)
+log_filepath = script_dir + "/run_filter_chain_all_categories_log.txt"
+manifest_path = default_manifest_path(script_dir, "run_filter_chain_all_categories")
+full_dataset_path = os.path.join(script_dir, "../../highfrequency_hit_feb12024_apr302025_full.pkl")
+# Setup for logging messages
+def log_message(message):
+    with open(log_filepath, 'a') as f:
+        f.write(f"{datetime.now()}: {message}" + '\n')
+# Print something and log it a the same time
+def print_and_log(message):
+    print(message)
+    log_message(message)
+
+# Where the results are saved
+row_ids_path = os.path.join(script_dir, "all_categories_row_ids.npy")
+first_rejecting_filter_path = os.path.join(script_dir, "all_categories_first_rejecting_filter.npy")
+rejection_bits_path = os.path.join(script_dir, "all_categories_rejection_bits.npy")
+survival_path = os.path.join(script_dir, "all_categories_survival.csv")
+
+if __name__ == "__main__":
+    ### Read in the data once
+    # Use the hit store of the full dataset if it's been made (python hit_store.py <pickle>)
+    dataset_path = sys.argv[1] if len(sys.argv) > 1 else full_dataset_path
+    if not os.path.isdir(dataset_path) and os.path.isdir(default_store_path(dataset_path)):
+        dataset_path = default_store_path(dataset_path)
+    manifest = start_manifest("run_filter_chain_all_categories", manifest_path)
+    print_and_log("Reading in all hits from: " + dataset_path)
+    with stage(manifest, "read data", inputs=[dataset_path]) as record:
+        if os.path.isdir(dataset_path):
+            hits = load_hits(dataset_path, columns=chain_columns)
+        else:
+            hits = pd.read_pickle(dataset_path).reset_index(drop=True)
+        record["rows_out"] = len(hits)
+    print_and_log("Data read in correctly")
+
+    ### Run the chain on every category
+    print_and_log("Running filter chain on every category")
+    with stage(manifest, "filter chain by category", rows_in=len(hits)) as record:
+        categories, first, bits = run_chain_by_category(hits, FILTERS)
+        record["rows_out"] = int(np.count_nonzero(first == 0))
+
+    ### Save results
+    np.save(row_ids_path, hits.id.values)
+    np.save(first_rejecting_filter_path, first)
+    np.save(rejection_bits_path, bits)
+    survival = category_survival(categories, first, [number for number, _ in FILTERS])
+    survival.to_csv(survival_path, index=False)
+    print_and_log("Survival by category:\n" + survival.to_string(index=False))
+    print_and_log("Saved. Done!")
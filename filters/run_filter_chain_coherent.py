@@ -0,0 +1,69 @@
+# run_filter_chain_coherent.py
+# Runs filters 1-12 on all coherent data in a single pass, reading the data in once
+# Saves the same run_filter_N_coherent_results.npy files as the single filter scripts
+#
+# Usage: python run_filter_chain_coherent.py [<spec.json>] [--rejection-bits]
+# With a spec (see filter_spec.py and filter_chain_spec.json), runs that chain instead,
+# with the cuts which only look at each hit fused into one pass over the hits still selected.
+# The rejection bits (see rejections.py) need those cuts done on every hit, so for a spec
+# they're only saved with --rejection-bits. Without a spec they're always saved, since the
+# chain has every filter's result anyway
+# Noah Stiegler
+# 10/18/26
+
+### Import useful packages
+import os
+import sys
+from datetime import datetime
+from filter_chain import load_coherent, run_chain, coherent_dataset_path, coherent_store_path
+from run_manifest import start_manifest, stage, default_manifest_path
+from filter_chain import FILTERS
+from filter_spec import load_spec, run_spec, compile_spec
+from rejections import first_rejecting_filter, rejection_bits, save_rejections, attrition
+
+### Setup for logging
+script_path = os.path.abspath(__file__)
+script_dir = os.path.dirname(script_path)
+log_filepath = script_dir + "/run_filter_chain_coherent_log.txt"
+cache_dir = script_dir + "/filter_cache/" # Results of each stage, so unchanged stages are skipped
+manifest_path = default_manifest_path(script_dir, "run_filter_chain_coherent") # Timings and memory of each stage
+# Setup for logging messages
+def log_message(message):
+    with open(log_filepath, 'a') as f:
+        f.write(f"{datetime.now()}: {message}" + '\n')
+# Print something and log it a the same time
+def print_and_log(message):
+    print(message)
+    log_message(message)
+
+if __name__ == "__main__":
+    ### Read in the data
+    # Use the hit store if it's been made (python hit_store.py <pickle>), it's much faster to read
+    dataset_path = coherent_store_path if os.path.isdir(coherent_store_path) else coherent_dataset_path
+    manifest = start_manifest("run_filter_chain_coherent", manifest_path)
+    print_and_log("Reading in coherent data from: " + dataset_path)
+    with stage(manifest, "read data", inputs=[dataset_path]) as record:
+        coherent = load_coherent(dataset_path)
+        record["rows_out"] = len(coherent)
+    print_and_log("Coherent data read in correctly")
+
+    ### Run all the filters
+    arguments = [argument for argument in sys.argv[1:] if argument != "--rejection-bits"]
+    if len(arguments) > 0:
+        print_and_log("Running filter chain from spec: " + arguments[0])
+        spec = load_spec(arguments[0])
+        filters = compile_spec(spec)
+        passes = {} if "--rejection-bits" in sys.argv else None
+        selections = run_spec(coherent, spec, log=print_and_log, cache_dir=cache_dir, manifest=manifest, passes=passes)
+    else:
+        print_and_log("Running filter chain")
+        filters = FILTERS
+        passes = {}
+        selections = run_chain(coherent, log=print_and_log, cache_dir=cache_dir, manifest=manifest, passes=passes)
+
+    # Save which filter removed each hit (see rejections.py)
+    first = first_rejecting_filter(selections)
+    save_rejections(first, rejection_bits(passes, selections, filters) if passes is not None else None)
+    print_and_log("Attrition:\n" + attrition(first, [number for number, _ in filters]).to_string(index=False))
+    print_and_log("Saved run manifest to: " + manifest_path)
+    print_and_log("Saved. Done!")
@@ -0,0 +1,60 @@
+# run_filter_chain_incremental.py
+# Runs filters 1-12 on coherent data incrementally. The first run does the whole
+# dataset and saves the state of the chain on disk. After that, pass in a pickle of newly
+# exported hits and only the parts of the chain they touch are rerun and rewritten
+# Saves the same run_filter_N_coherent_results.npy files as the filter chain
+#
+# Usage: python run_filter_chain_incremental.py [<new_hits.pkl>]
+# Noah Stiegler
+# 10/18/26
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import os
+import sys
+from datetime import datetime
+from filter_chain import load_coherent, save_selection, coherent_dataset_path, coherent_store_path
+from filter_bitmask import row_ids_path
+from incremental_chain import start_state, update_state, chain_selections, load_state
+
+### Setup for logging
+script_path = os.path.abspath(__file__)
+script_dir = os.path.dirname(script_path)
+log_filepath = script_dir + "/run_filter_chain_incremental_log.txt"
+state_dir = script_dir + "/incremental_state/"
+# Setup for logging messages
+def log_message(message):
+    with open(log_filepath, 'a') as f:
+        f.write(f"{datetime.now()}: {message}" + '\n')
+# Print something and log it a the same time
+def print_and_log(message):
+    print(message)
+    log_message(message)
+
+if __name__ == "__main__":
+    if not os.path.exists(state_dir + "info.json"):
+        # No state yet, run the whole chain on the coherent data
+        dataset_path = coherent_store_path if os.path.isdir(coherent_store_path) else coherent_dataset_path
+        print_and_log("No saved state. Reading in coherent data from: " + dataset_path)
+        state = start_state(load_coherent(dataset_path), state_dir)
+    else:
+        print_and_log("Reading in saved state from: " + state_dir)
+        state = load_state(state_dir)
+
+    # Add the new hits
+    if len(sys.argv) > 1:
+        new_hits_path = sys.argv[1]
+        print_and_log("Reading in new hits from: " + new_hits_path)
+        new_hits = pd.read_pickle(new_hits_path)
+        new_hits = new_hits[~new_hits.source_name.isin(["Incoherent", "PHASE_CENTER"])] # Just coherent hits
+        state = update_state(state, new_hits, log=print_and_log)
+
+    # Save the results (the state is already saved by start_state and update_state)
+    print_and_log("Saving results")
+    ids = pd.DataFrame({"id": np.asarray(state["arrays"]["id"])})
+    np.save(row_ids_path, ids.id.values)
+    for number, selected in chain_selections(state).items():
+        print_and_log(f"Filter {number}: {selected.sum()} passed")
+        save_selection(ids, number, selected)
+    print_and_log("Saved. Done!")
@@ -0,0 +1,139 @@
+# shared_hits.py
+# Puts the columns of the hit table that a filter needs into memory-mapped .npy files
+# (in shared memory when /dev/shm exists) so multiprocessing workers can be handed
+# ranges of rows instead of having whole dataframes pickled to them and back. Every
+# worker maps the same pages, so memory use doesn't grow with the number of workers
+# Noah Stiegler
+# 10/18/26
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+# Where to put the column files. /dev/shm is memory so nothing has to go to disk
+def shared_memory_dir():
+    return "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Write columns of the hit table out sorted by the column by, so all the hits with
+# the same value of by (ex. all the hits from one source) are a contiguous range of rows
+# Parameters:
+# - hits: the hit table
+# - columns: list of numeric columns to write out
+# - by: column to sort by and split into ranges
+# - columns_dir: directory to write the columns to (a new temporary one if None)
+# - then_by: column to sort by within each range (ex. signal_frequency, so the groups of
+#   hits at the same frequency are contiguous and a range can be split between them)
+# Returns:
+# - (columns_dir, ranges) where ranges is a list of (value of by, start row, stop row)
+def share_columns(hits, columns, by="source_name", columns_dir=None, then_by=None):
+    if columns_dir is None:
+        columns_dir = tempfile.mkdtemp(prefix="shared_hits_", dir=shared_memory_dir())
+    keys = hits[by].values
+    if then_by is None:
+        order = np.argsort(keys, kind="stable")
+    else:
+        order = np.lexsort((hits[then_by].values, pd.factorize(keys, sort=True)[0]))
+    keys = keys[order]
+    for column in columns:
+        np.save(os.path.join(columns_dir, column + ".npy"), np.ascontiguousarray(hits[column].values[order]))
+
+    # Find where each run of the same key starts and stops
+    if len(keys) == 0:
+        return columns_dir, []
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    stops = np.append(starts[1:], len(keys))
+    ranges = [(keys[start], start, stop) for start, stop in zip(starts, stops)]
+    return columns_dir, ranges
+
+# Memory map every column in columns_dir. Each process only opens them once
+_open_columns = {}
+def open_columns(columns_dir):
+    if columns_dir not in _open_columns:
+        columns = {}
+        for filename in sorted(os.listdir(columns_dir)):
+            if filename.endswith(".npy"):
+                columns[filename[:-len(".npy")]] = np.load(os.path.join(columns_dir, filename), mmap_mode="r")
+        _open_columns[columns_dir] = columns
+    return _open_columns[columns_dir]
+
+# Get a dataframe of rows start to stop of the shared columns (for use in a worker)
+def read_rows(columns_dir, start, stop):
+    columns = open_columns(columns_dir)
+    return pd.DataFrame({name: column[start:stop] for name, column in columns.items()}, copy=False)
+
+# Delete the column files once the workers are done with them
+def remove_shared_columns(columns_dir):
+    _open_columns.pop(columns_dir, None)
+    shutil.rmtree(columns_dir)
+
+### Scheduling work across processes
+# A few heavily observed sources have most of the hits, so handing each worker one
+# source at a time leaves one worker on a giant source while the rest sit idle. Instead
+# the work is cut into tasks of about the same number of hits: big sources are split
+# between groups of hits at the same frequency (so a group is never split) and small
+# sources are packed together. The biggest tasks are started first
+
+# Cut the ranges of rows from share_columns into tasks of about equal size
+# Parameters:
+# - columns_dir, ranges: from share_columns
+# - split_on: shared column whose runs of equal values can't be split (ex. signal_frequency,
+#   shared with then_by="signal_frequency"). If None, ranges are never split
+# - num_workers: number of processes the tasks will be run on (all cores if None)
+# - tasks_per_worker: how many tasks to aim for per worker. More tasks even out the
+#   load better but each one has some overhead
+# Returns:
+# - list of tasks, biggest first, where each task is a list of (name, start, stop) pieces
+def schedule_ranges(columns_dir, ranges, split_on=None, num_workers=None, tasks_per_worker=4):
+    if len(ranges) == 0:
+        return []
+    num_workers = num_workers or multiprocessing.cpu_count()
+    total = sum(stop - start for _, start, stop in ranges)
+    target = max(1, -(-total // (num_workers * tasks_per_worker))) # Hits per task
+
+    # Split up sources bigger than a task at the first group boundary past each multiple of target
+    pieces = []
+    for name, start, stop in ranges:
+        if stop - start <= target or split_on is None:
+            pieces.append((name, start, stop))
+            continue
+        values = open_columns(columns_dir)[split_on][start:stop]
+        boundaries = np.flatnonzero(values[1:] != values[:-1]) + 1 + start
+        piece_start = start
+        while stop - piece_start > target:
+            i = np.searchsorted(boundaries, piece_start + target)
+            if i == len(boundaries):
+                break
+            pieces.append((name, piece_start, boundaries[i]))
+            piece_start = boundaries[i]
+        pieces.append((name, piece_start, stop))
+
+    # Pack the small pieces together, biggest first
+    pieces.sort(key=lambda piece: piece[2] - piece[1], reverse=True)
+    tasks = []
+    task, task_size = [], 0
+    for piece in pieces:
+        task.append(piece)
+        task_size += piece[2] - piece[1]
+        if task_size >= target:
+            tasks.append(task)
+            task, task_size = [], 0
+    if task:
+        tasks.append(task)
+    return tasks
+
+# Run function(columns_dir, start, stop, name) on every piece of a task
+def _run_task(function, columns_dir, task):
+    return [function(columns_dir, int(start), int(stop), name) for name, start, stop in task]
+
+def _run_task_args(args):
+    return _run_task(*args)
+
+# Run function on every piece of every task from schedule_ranges in the pool, yielding
+# each piece's result as soon as its task is done (in no particular order)
+def run_scheduled(pool, function, columns_dir, tasks):
+    for results in pool.imap_unordered(_run_task_args, [(function, columns_dir, task) for task in tasks]):
+        yield from results
@@ -0,0 +1,118 @@
+# test_incremental_chain.py
+# Checks that updating the incremental chain state with a batch of new hits gives exactly
+# the same selections as running the whole chain on all of the hits at once
+# Noah Stiegler
+# 10/18/26
+#
+# Usage: python -m pytest test_incremental_chain.py (from the filters directory)
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import json
+from filter_chain import FILTERS, run_chain
+from incremental_chain import start_state, update_state, chain_selections, load_state
+
+# Don't print anything while testing
+def _no_log(message):
+    pass
+
+### Test data
+# Hits on a 1Hz frequency grid (in MHz, like the real data), so many hits are exactly
+# 2Hz or 10Hz apart: right at the thresholds of filters 9 and 10
+def make_hits(n, seed):
+    rng = np.random.default_rng(seed)
+    shared = np.round(rng.uniform(25000, 50000, n // 10), 6)
+    frequencies = np.where(rng.random(n) < 0.5, rng.choice(shared, n), np.round(rng.uniform(25000, 50000, n), 6))
+    # Runs of hits exactly 1Hz, 2Hz and 10Hz apart
+    runs = np.round(rng.choice(shared, n // 20)[:, None] + np.array([0, 1, 2, 4, 6, 16]) * 1e-6, 6).ravel()
+    frequencies[:len(runs)] = runs
+    hits = pd.DataFrame({
+        "id": rng.permutation(n) * 3 + 7,
+        "source_name": rng.choice([f"TARGET_{i:05d}" for i in range(20)], n),
+        "signal_frequency": frequencies,
+        "signal_drift_rate": np.where(rng.random(n) < 0.3, 0.0, np.round(rng.normal(0, 3, n), 3)),
+        "signal_snr": rng.lognormal(2.5, 0.6, n),
+        "tsamp": rng.choice([0.5, 1.0], n),
+        "num_timesteps": rng.choice([8, 16, 32], n),
+        "tstart": np.sort(rng.choice(60000 + np.arange(100) * 0.003, n)),
+    })
+    hits["signal_num_timesteps"] = hits.num_timesteps
+    hits["tstart_h"] = pd.to_datetime((hits.tstart - 40587) * 86400, unit="s")
+    return hits.sample(frac=1, random_state=seed).reset_index(drop=True) # Batches are out of frequency order
+
+def full_selections(hits):
+    return run_chain(hits, FILTERS, save=False, log=_no_log)
+
+def assert_same_selections(state, hits):
+    expected = full_selections(hits)
+    got = chain_selections(state)
+    for number in expected:
+        mismatched = np.flatnonzero(got[number] != expected[number])
+        assert len(mismatched) == 0, f"Filter {number} differs at rows {mismatched[:10]}"
+
+### Tests
+def test_thresholds_are_hit_exactly():
+    hits = make_hits(5000, 5)
+    gaps = np.diff(np.sort(hits.signal_frequency.values))
+    assert np.any(np.isclose(gaps, 2e-6, rtol=0, atol=1e-9))
+    assert np.any(np.isclose(gaps, 10e-6, rtol=0, atol=1e-9))
+
+def test_split_update_matches_full_run(tmp_path):
+    for seed in (0, 5):
+        hits = make_hits(5000, seed)
+        split = int(len(hits) * 0.8)
+        state = update_state(start_state(hits.iloc[:split], tmp_path), hits.iloc[split:], log=_no_log)
+        assert_same_selections(state, hits)
+
+def test_several_updates_match_full_run(tmp_path):
+    hits = make_hits(5000, 1)
+    state = start_state(hits.iloc[:2000], tmp_path)
+    for start, stop in [(2000, 2001), (2001, 3500), (3500, 5000)]:
+        state = update_state(state, hits.iloc[start:stop], log=_no_log)
+    assert_same_selections(state, hits)
+
+def test_hits_exactly_at_the_threshold(tmp_path):
+    # A new hit landing exactly 2Hz (filter 9) or 10Hz (filter 10) from an old one, between
+    # two old hits, and at the same frequency as an old one
+    hits = make_hits(200, 2)
+    base = 31234.567891
+    frequencies = np.round(base + np.array([0, 2, 12, 30, 32, 50, 60, 60]) * 1e-6, 6)
+    extra = hits.iloc[:len(frequencies)].copy()
+    extra["signal_frequency"] = frequencies
+    old = pd.concat([hits, extra.iloc[[0, 2, 3, 5, 6]]], ignore_index=True)
+    new = extra.iloc[[1, 4, 7]]
+    state = update_state(start_state(old, tmp_path), new, log=_no_log)
+    assert_same_selections(state, pd.concat([old, new], ignore_index=True))
+
+def test_loaded_state_updates_like_the_one_in_memory(tmp_path):
+    hits = make_hits(3000, 3)
+    start_state(hits.iloc[:1000], tmp_path)
+    for start, stop in [(1000, 2000), (2000, 3000)]:
+        update_state(load_state(tmp_path), hits.iloc[start:stop], log=_no_log)
+    loaded = load_state(tmp_path)
+    assert loaded["info"]["num_hits"] == len(hits)
+    assert np.array_equal(loaded["arrays"]["id"], hits.id.values)
+    assert_same_selections(loaded, hits)
+
+def test_stopped_update_can_be_redone(tmp_path):
+    # Arrays and runs written by an update which never replaced info.json are ignored
+    hits = make_hits(3000, 4)
+    state = start_state(hits.iloc[:2000], tmp_path)
+    update_state(state, hits.iloc[2000:2500], log=_no_log)
+    with open(tmp_path / "info.json", "w") as f:
+        json.dump(state["info"], f)
+    state = update_state(load_state(tmp_path), hits.iloc[2000:3000], log=_no_log)
+    assert_same_selections(state, hits)
+
+def test_update_only_reads_what_it_touches(tmp_path):
+    # A lot of sources and observations, so a few new hits only touch a small part of them
+    rng = np.random.default_rng(6)
+    hits = make_hits(40000, 6)
+    hits["source_name"] = rng.choice([f"TARGET_{i:05d}" for i in range(400)], len(hits))
+    hits["tstart"] = 60000 + rng.integers(0, 2000, len(hits)) * 0.003
+    hits["tstart_h"] = pd.to_datetime((hits.tstart - 40587) * 86400, unit="s")
+    split = len(hits) - 20
+    state = update_state(start_state(hits.iloc[:split], tmp_path), hits.iloc[split:], log=_no_log)
+    assert_same_selections(state, hits)
+    assert state["last_update"]["rows_read"] < 0.01 * split
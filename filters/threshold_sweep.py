@@ -0,0 +1,112 @@
+# threshold_sweep.py
+# Sweeps the thresholds of the filters which make a single cut (2, 3, 7, 8 and 12)
+# over a grid of values in one pass. The value each hit is cut on is sorted once,
+# then the number of hits which pass (and their ids) at every threshold comes from a
+# binary search into the sorted values, so a 100 point sweep costs about the same as
+# running the filter once
+# Noah Stiegler
+# 10/18/26
+#
+# Ex. survival curve of filter 7 on the hits which passed filter 6:
+#   selections = run_chain(coherent, FILTERS[:6], save=False)
+#   curve, ids = sweep(coherent, selections[6], 7, np.linspace(5, 30, 100))
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+from filter_chain import group_aggregates
+
+### Sweeping one value
+# Sweep a cut on values which are already sorted (see sweep_values)
+def _sweep_sorted(sorted_values, sorted_ids, thresholds, op):
+    thresholds = np.asarray(thresholds)
+
+    # Passing hits are always one end of the sorted values
+    if op in (">=", ">"):
+        starts = np.searchsorted(sorted_values, thresholds, side="left" if op == ">=" else "right")
+        passed = len(sorted_values) - starts
+        passing_ids = [sorted_ids[start:] for start in starts]
+    elif op in ("<=", "<"):
+        stops = np.searchsorted(sorted_values, thresholds, side="right" if op == "<=" else "left")
+        passed = stops
+        passing_ids = [sorted_ids[:stop] for stop in stops]
+    else:
+        raise ValueError(f"Unknown comparison: {op}")
+
+    curve = pd.DataFrame({"threshold": thresholds,
+                          "passed": passed,
+                          "fraction": passed / len(sorted_values) if len(sorted_values) else 0.0})
+    return curve, passing_ids
+
+# Sweep a cut on one value per hit
+# Parameters:
+# - values: the value each selected hit is cut on
+# - ids: the ids of those hits
+# - thresholds: grid of thresholds to try
+# - op: how a hit passes, one of ">=", ">", "<=", "<" (value op threshold)
+# Returns:
+# - (curve, ids) where curve is a dataframe of each threshold and how many hits passed it
+#   and ids is a list of the ids which passed each threshold (views of one sorted array,
+#   so they don't take any extra memory)
+def sweep_values(values, ids, thresholds, op):
+    order = np.argsort(values, kind="stable")
+    return _sweep_sorted(values[order], ids[order], thresholds, op)
+
+### Sweeps for each filter
+# Every sweep takes the hit table, the hits going into the filter (ex. the ones
+# which passed the filter before it) and the grid of thresholds
+
+# Filters 2 and 3: a group of hits at the same frequency from a source passes if it has
+# one hit in it or its largest |drift rate| is at least the threshold. Single hits
+# are given an infinite drift rate so they always pass
+def sweep_group_drift_rate(hits, selected, min_drift_rates):
+    size, max_abs_dr = group_aggregates(hits, selected)
+    group_drift_rate = np.where(size == 1, np.inf, max_abs_dr)[selected]
+    return sweep_values(group_drift_rate, hits.id.values[selected], min_drift_rates, ">=")
+
+def sweep_filter2(hits, selected, min_drift_rates):
+    return sweep_group_drift_rate(hits, selected, min_drift_rates)
+
+def sweep_filter3(hits, selected, min_drift_rates):
+    return sweep_group_drift_rate(hits, selected, min_drift_rates)
+
+# Filter 7: hits pass with SNR above the threshold
+def sweep_filter7(hits, selected, min_snrs):
+    return sweep_values(hits.signal_snr.values[selected], hits.id.values[selected], min_snrs, ">")
+
+# Filter 8: hits pass with SNR below the threshold
+def sweep_filter8(hits, selected, max_snrs):
+    return sweep_values(hits.signal_snr.values[selected], hits.id.values[selected], max_snrs, "<")
+
+# Filter 12: hits pass with at least min_timesteps timesteps and an SNR of at least min_snr.
+# Sweeps every combination of the two grids. The SNRs are sorted once. For each
+# min_timesteps the hits with enough timesteps are picked out of the sorted hits (a copy
+# of the ones left, which is still sorted so it isn't sorted again), and the ids of each
+# min_snr are views of that copy
+# Returns (curve, ids) like sweep_values, with a row in curve (and a list in ids) for each
+# combination, in the order (min_timesteps[0], min_snrs[0]), (min_timesteps[0], min_snrs[1]), ...
+def sweep_filter12(hits, selected, min_timesteps, min_snrs):
+    snrs = hits.signal_snr.values[selected]
+    timesteps = hits.num_timesteps.values[selected]
+    ids = hits.id.values[selected]
+    order = np.argsort(snrs, kind="stable")
+    sorted_snrs, sorted_timesteps, sorted_ids = snrs[order], timesteps[order], ids[order]
+
+    curves = []
+    passing_ids = []
+    for min_timestep in min_timesteps:
+        enough_timesteps = sorted_timesteps >= min_timestep
+        curve, timestep_ids = _sweep_sorted(sorted_snrs[enough_timesteps], sorted_ids[enough_timesteps], min_snrs, ">=")
+        curve.insert(0, "min_timesteps", min_timestep)
+        curve["fraction"] = curve.passed / len(ids) if len(ids) else 0.0
+        curves.append(curve.rename(columns={"threshold": "min_snr"}))
+        passing_ids.extend(timestep_ids)
+    return pd.concat(curves, ignore_index=True), passing_ids
+
+SWEEPS = {2: sweep_filter2, 3: sweep_filter3, 7: sweep_filter7, 8: sweep_filter8, 12: sweep_filter12}
+
+# Sweep the thresholds of filter number over the grid(s) given
+def sweep(hits, selected, number, *grids):
+    if number not in SWEEPS:
+        raise ValueError(f"Filter {number} doesn't have a single threshold to sweep")
+    return SWEEPS[number](hits, selected, *grids)
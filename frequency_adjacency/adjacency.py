@@ -0,0 +1,406 @@
+# adjacency.py
+# Finds every pair of hits closer than a window in frequency (ex. 1000Hz) without looping
+# over hits in python. Once the frequencies are sorted, the hits within the window of
+# hit i are i+1, i+2, ... up to the first one which is too far away. So instead of
+# walking forward from each hit, compare every hit with the hit k places after it for
+# k = 1, 2, ... in one numpy operation each. A hit whose k-th neighbour was out of the
+# window can't have a (k+1)-th neighbour in it, so only the hits still in the window are
+# checked at the next k, and the total work is about the number of pairs found.
+# build_pairs_sharded does the same on many cores at once
+# Noah Stiegler
+# 10/18/26
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import os
+import sys
+import json
+import hashlib
+import shutil
+import tempfile
+import multiprocessing
+from scipy.sparse import csr_array, load_npz
+
+# Pairs of hits within window_width of each other, in positions of the sorted frequencies
+# Parameters:
+# - sorted_frequencies: frequencies in increasing order
+# - window_width: largest distance between a pair, in the same units as the frequencies
+# - start, stop: only find pairs whose lower hit is at positions start to stop (for doing
+#   the work in pieces). The upper hit can be anywhere after it
+# - sorted_groups: (optional) group of each hit (ex. its source), with each group's hits
+#   next to each other. Only pairs in the same group are found
+# Returns:
+# - (i, j, distances): arrays with i < j for every pair, sorted by (i, j)
+def adjacent_pairs_sorted(sorted_frequencies, window_width, start=0, stop=None, sorted_groups=None):
+    n = len(sorted_frequencies)
+    stop = n if stop is None else min(stop, n)
+    i_parts, j_parts, distance_parts = [], [], []
+    active = np.arange(start, stop) # Hits which could still have a neighbour k places ahead
+    k = 1
+    while len(active) > 0:
+        active = active[active + k < n]
+        distances = sorted_frequencies[active + k] - sorted_frequencies[active]
+        within = distances <= window_width
+        if sorted_groups is not None: # Once the hit k places ahead is in another group, so are the rest
+            within &= sorted_groups[active + k] == sorted_groups[active]
+        active = active[within]
+        i_parts.append(active)
+        j_parts.append(active + k)
+        distance_parts.append(distances[within])
+        k += 1
+
+    if not i_parts:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=sorted_frequencies.dtype)
+    i = np.concatenate(i_parts)
+    j = np.concatenate(j_parts)
+    distances = np.concatenate(distance_parts)
+    # Each k's pairs are in order of i, and for the same i, pairs from a smaller k come first,
+    # so a stable sort by i (which merges the already sorted runs) puts them in order of (i, j)
+    order = np.argsort(i, kind="stable")
+    return i[order], j[order], distances[order]
+
+# Pairs of hits within window_width of each other, in the original positions of the hits
+# Parameters:
+# - frequencies: frequency of each hit (not sorted)
+# - window_width: largest distance between a pair, in the same units as the frequencies
+# Returns:
+# - (u, v, distances): arrays with u < v for every pair (like the upper triangle of a matrix)
+def adjacent_pairs(frequencies, window_width):
+    frequencies = np.asarray(frequencies)
+    order = np.argsort(frequencies, kind="stable")
+    i, j, distances = adjacent_pairs_sorted(frequencies[order], window_width)
+    u, v = order[i], order[j]
+    return np.minimum(u, v), np.maximum(u, v), distances
+
+# Pairs of hits from the same source within window_width of each other, for every source
+# at once. The hits are sorted by (source, frequency) so each source is one run of the
+# sorted hits, and the pairs are found in one go without crossing from one run to the next
+# Parameters:
+# - frequencies: frequency of each hit (not sorted)
+# - source_names: source of each hit
+# - window_width: largest distance between a pair, in the same units as the frequencies
+# Returns:
+# - (u, v, distances, source, sources): like adjacent_pairs, plus the source of each pair
+#   as a number and the name of each number
+def adjacent_pairs_by_source(frequencies, source_names, window_width):
+    frequencies = np.asarray(frequencies)
+    codes, sources = pd.factorize(np.asarray(source_names), sort=True)
+    order = np.lexsort((frequencies, codes))
+    sorted_codes = codes[order]
+    i, j, distances = adjacent_pairs_sorted(frequencies[order], window_width, sorted_groups=sorted_codes)
+    u, v = order[i], order[j]
+    return np.minimum(u, v), np.maximum(u, v), distances, sorted_codes[i], [str(source) for source in sources]
+
+### Pair files
+# The distance matrices can't tell a pair of hits at exactly the same frequency (distance 0)
+# from a pair which wasn't computed, which is why every .distances.npz has a .mask.npz next
+# to it. A pair file keeps the list of pairs instead, so a pair at distance 0 is still there.
+# It's a directory with:
+# - i.npy, j.npy (int32): the two hits in each pair, with i < j, sorted by (i, j)
+# - distance_hz.npy (float32): distance between the hits in Hz
+# - info.json: the number of hits and the window width (in Hz)
+# - (optional) source.npy (int32): the source of each pair as a number, with the name of
+#   each number in info.json (for pairs found within each source)
+# The arrays are plain .npy files so they can be memory mapped, and turned into a sparse
+# matrix (of the distances or of which hits are adjacent) only when it's needed
+pair_arrays = ["i", "j", "distance_hz"]
+
+# Put pairs (from adjacent_pairs) into the form of a pair file
+# Parameters:
+# - u, v: the two hits in each pair, with u < v (in any order)
+# - distances: distance of each pair in MHz
+# - num_hits: number of hits the pairs are between
+# - window_width: width of the window the pairs were found in (MHz)
+# - source, sources: (optional) source of each pair as a number, and the name of each number
+# Returns:
+# - dict of the arrays in pair_arrays plus num_hits and window_hz (and source and sources)
+def make_pairs(u, v, distances, num_hits, window_width, source=None, sources=None):
+    if num_hits > np.iinfo(np.int32).max:
+        raise ValueError("Pair files store hits as int32, so they can have at most 2^31 - 1 hits")
+    order = np.lexsort((v, u))
+    pairs = {
+        "i": u[order].astype(np.int32),
+        "j": v[order].astype(np.int32),
+        "distance_hz": (distances[order] * 1e6).astype(np.float32),
+        "num_hits": int(num_hits),
+        "window_hz": float(window_width * 1e6),
+    }
+    if source is not None:
+        pairs["source"] = source[order].astype(np.int32)
+        pairs["sources"] = list(sources)
+    return pairs
+
+def save_pairs(path, pairs):
+    os.makedirs(path, exist_ok=True)
+    for name in pair_arrays:
+        np.save(os.path.join(path, name + ".npy"), pairs[name])
+    info = {"num_hits": pairs["num_hits"], "window_hz": pairs["window_hz"], "num_pairs": len(pairs["i"])}
+    if "source" in pairs:
+        np.save(os.path.join(path, "source.npy"), pairs["source"])
+        info["sources"] = pairs["sources"]
+    with open(os.path.join(path, "info.json"), "w") as f:
+        json.dump(info, f, indent=2)
+
+# Load a pair file. The arrays are memory mapped unless mmap_mode is None
+def load_pairs(path, mmap_mode="r"):
+    with open(os.path.join(path, "info.json")) as f:
+        info = json.load(f)
+    pairs = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode) for name in pair_arrays}
+    pairs["num_hits"] = info["num_hits"]
+    pairs["window_hz"] = info["window_hz"]
+    if "sources" in info:
+        pairs["source"] = np.load(os.path.join(path, "source.npy"), mmap_mode=mmap_mode)
+        pairs["sources"] = info["sources"]
+    return pairs
+
+# Just the pairs of one source (from a pair file made within each source). The hits are
+# still numbered by their row in the whole table
+def source_pairs(pairs, source_name):
+    keep = np.asarray(pairs["source"]) == pairs["sources"].index(source_name)
+    one_source = {name: np.asarray(pairs[name])[keep] for name in pair_arrays + ["source"]}
+    one_source.update({"num_hits": pairs["num_hits"], "window_hz": pairs["window_hz"], "sources": pairs["sources"]})
+    return one_source
+
+# Sparse (num_hits x num_hits, upper triangular) matrix of the pairs
+# Parameters:
+# - pairs: from make_pairs or load_pairs
+# - within_hz: only the pairs at most this far apart (all of them if None). Pairs at the
+#   same frequency are included, so there's no need for a mask
+# - values: "distance" for the distance in Hz (pairs at the same frequency are stored as
+#   explicit zeros, so they're still in the matrix's structure) or "mask" for True
+# Returns:
+# - csr_array. If every pair is used, its column indices and distances are the arrays of
+#   the pair file (no copy, so they stay memory mapped)
+def pairs_to_csr(pairs, within_hz=None, values="distance"):
+    i, j, distance_hz = pairs["i"], pairs["j"], pairs["distance_hz"]
+    if within_hz is not None and within_hz < pairs["window_hz"]:
+        keep = distance_hz <= within_hz
+        i, j, distance_hz = i[keep], j[keep], distance_hz[keep]
+    if values == "distance":
+        data = distance_hz
+    elif values == "mask":
+        data = np.ones(len(j), dtype=bool)
+    else:
+        raise ValueError(f"Unknown values: {values}")
+
+    num_hits = pairs["num_hits"]
+    index_dtype = np.int32 if len(j) <= np.iinfo(np.int32).max else np.int64
+    indptr = np.zeros(num_hits + 1, dtype=index_dtype)
+    np.cumsum(np.bincount(i, minlength=num_hits), out=indptr[1:])
+    return csr_array((data, j.astype(index_dtype, copy=False), indptr), shape=(num_hits, num_hits), copy=False)
+
+# Make pairs from an old .distances.npz and .mask.npz (the mask says which pairs there are,
+# the distances matrix gives the distance for the ones which aren't 0)
+def pairs_from_npz(distances_path, mask_path, window_width):
+    mask = csr_array(load_npz(mask_path)).tocoo()
+    distances = csr_array(load_npz(distances_path))
+    pair_distances = np.asarray(distances[mask.row, mask.col], dtype=np.float64) # 0 where it wasn't stored
+    return make_pairs(mask.row, mask.col, pair_distances, mask.shape[0], window_width)
+
+### Building in parallel
+# The sorted frequencies are split into contiguous shards with about the same number of
+# pairs each, and each shard's pairs are found in its own process. A pair belongs to the
+# shard its lower frequency hit is in, so each process also reads the hits up to one
+# window width past the end of its shard (the halo) but never finds the same pair as
+# another process. Each process writes its pairs to its own files, and then the pair file
+# is filled in a range of hits at a time, so no process holds every pair at once
+#
+# Checkpoints: the shards are kept in a work directory with a small checkpoint.json which
+# says how the frequencies were split and which shards are done. A shard's files are
+# written once and never changed, and checkpoint.json is only replaced (atomically, with
+# os.replace) after the shard's files are on disk, so each checkpoint only costs writing
+# the new shard's pairs. If the build is stopped, running it again with the same work
+# directory skips every shard in checkpoint.json and redoes the rest
+
+# Sorted positions where each shard starts and stops, so each has about the same number
+# of pairs (estimated from how many hits are within the window of each hit)
+def shard_bounds(sorted_frequencies, window_width, num_shards):
+    n = len(sorted_frequencies)
+    num_in_window = np.searchsorted(sorted_frequencies, sorted_frequencies + window_width, side="right") - np.arange(n) - 1
+    work = np.cumsum(num_in_window + 1) # +1 so runs of hits without any pairs are split up too
+    starts = np.searchsorted(work, np.arange(num_shards) * work[-1] / num_shards, side="right") if n else np.zeros(num_shards, dtype=np.int64)
+    bounds = np.unique(np.append(starts, n))
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+# Make sure the files in a directory are on disk (not just in the page cache)
+def _sync_files(path):
+    for filename in os.listdir(path):
+        with open(os.path.join(path, filename), "rb") as f:
+            os.fsync(f.fileno())
+
+# Replace a JSON file all at once, so anyone reading it sees the old one or the new one
+def commit_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# Find the pairs of one shard and save them (what the workers run)
+# Parameters:
+# - work_dir: directory with sorted_frequencies.npy and order.npy (the original index of each sorted hit)
+# - shard: number of the shard (its pairs go in work_dir/shard_<shard>)
+# - start, stop: sorted positions of the hits in the shard
+# - window_width: in the units of the frequencies (MHz)
+# Returns:
+# - (shard, number of pairs)
+def shard_pairs(work_dir, shard, start, stop, window_width):
+    sorted_frequencies = np.load(os.path.join(work_dir, "sorted_frequencies.npy"), mmap_mode="r")
+    order = np.load(os.path.join(work_dir, "order.npy"), mmap_mode="r")
+    # The shard plus its halo (a little wider than the window so rounding can't drop a pair)
+    halo_stop = int(np.searchsorted(sorted_frequencies, sorted_frequencies[stop - 1] + window_width * (1 + 1e-6), side="right"))
+    i, j, distances = adjacent_pairs_sorted(np.asarray(sorted_frequencies[start:halo_stop]), window_width, 0, stop - start)
+    local_order = np.asarray(order[start:halo_stop])
+    u, v = local_order[i], local_order[j]
+    pairs = make_pairs(np.minimum(u, v), np.maximum(u, v), distances, len(order), window_width)
+    shard_dir = os.path.join(work_dir, f"shard_{shard}")
+    save_pairs(shard_dir, pairs)
+    _sync_files(shard_dir)
+    return shard, len(pairs["i"])
+
+def _shard_pairs_args(args):
+    return shard_pairs(*args)
+
+# Copy the pairs of every shard whose lower hit is in [low, high) into the pair file,
+# starting at row offset (what the workers run when merging)
+def merge_shards(shard_dirs, output_path, low, high, offset):
+    parts = {name: [] for name in pair_arrays}
+    for shard_dir in shard_dirs:
+        shard = load_pairs(shard_dir)
+        first, last = np.searchsorted(shard["i"], [low, high])
+        for name in pair_arrays:
+            parts[name].append(np.asarray(shard[name][first:last]))
+    merged = {name: np.concatenate(parts[name]) for name in pair_arrays}
+    order = np.lexsort((merged["j"], merged["i"]))
+    for name in pair_arrays:
+        output = np.load(os.path.join(output_path, name + ".npy"), mmap_mode="r+")
+        output[offset:offset + len(order)] = merged[name][order]
+        output.flush()
+    return len(order)
+
+# Ranges of lower hits [ranges[k], ranges[k + 1]) with about the same number of pairs each
+# (the pairs of each shard are sorted by their lower hit, so the number of pairs with a
+# lower hit before h is a searchsorted in every shard). Every boundary is found at once
+# with a binary search over h for where that count reaches k / num_ranges of the pairs
+# Returns:
+# - ranges: num_ranges + 1 hit numbers, from 0 to num_hits
+# - counts: number of pairs before each of them (the row each range starts at in the pair file)
+def merge_ranges(shard_dirs, num_hits, num_ranges):
+    shard_is = [load_pairs(shard_dir)["i"] for shard_dir in shard_dirs]
+    def pairs_before(hits):
+        return sum((np.searchsorted(i, hits) for i in shard_is), np.zeros(len(hits), dtype=np.int64))
+    num_pairs = sum(len(i) for i in shard_is)
+    targets = np.arange(num_ranges + 1) * num_pairs // num_ranges
+    low = np.zeros(num_ranges + 1, dtype=np.int64)
+    high = np.full(num_ranges + 1, num_hits, dtype=np.int64)
+    while np.any(low < high): # Smallest h with at least target pairs before it
+        middle = (low + high) // 2
+        reached = pairs_before(middle) >= targets
+        high = np.where(reached, middle, high)
+        low = np.where(reached, low, middle + 1)
+    ranges = low
+    ranges[0], ranges[-1] = 0, num_hits
+    return ranges, pairs_before(ranges)
+
+# Start a work directory, or check the one that's there is for the same build
+# Returns the checkpoint (dict with the shards and which of them are done)
+def _start_work_dir(work_dir, frequencies, window_width, num_shards):
+    checkpoint_path = os.path.join(work_dir, "checkpoint.json")
+    fingerprint = hashlib.sha256(np.ascontiguousarray(frequencies).data).hexdigest()
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if (checkpoint["num_hits"], checkpoint["window_hz"], checkpoint["frequencies_sha256"]) != (len(frequencies), float(window_width * 1e6), fingerprint):
+            raise ValueError(f"{work_dir} has a checkpoint of a different build. Delete it to start over")
+        return checkpoint
+
+    # Share the sorted frequencies with the workers
+    os.makedirs(work_dir, exist_ok=True)
+    order = np.argsort(frequencies, kind="stable")
+    sorted_frequencies = frequencies[order]
+    np.save(os.path.join(work_dir, "sorted_frequencies.npy"), sorted_frequencies)
+    np.save(os.path.join(work_dir, "order.npy"), order)
+    _sync_files(work_dir)
+    checkpoint = {
+        "num_hits": len(frequencies),
+        "window_hz": float(window_width * 1e6),
+        "frequencies_sha256": fingerprint,
+        "shards": shard_bounds(sorted_frequencies, window_width, num_shards),
+        "done": {}, # shard number (as a string) -> number of pairs
+    }
+    commit_json(checkpoint_path, checkpoint)
+    return checkpoint
+
+# Find every pair of hits within window_width of each other with one process per shard,
+# and save them as a pair file
+# Parameters:
+# - frequencies: frequency of each hit in MHz (not sorted)
+# - window_width: in MHz (ex. 1000Hz is 1000e-6)
+# - output_path: where to save the pair file
+# - processes: number of processes (all the cores if None)
+# - num_shards: number of shards (the same as processes if None). More shards than
+#   processes means fewer pairs in memory in each process at once, and more checkpoints
+# - log: function to call with progress messages
+# - work_dir: where to keep the shards and checkpoint while building, so a stopped build
+#   can be picked up again (a temporary directory in memory if None, so no resuming).
+#   It's removed once the pair file is saved
+# Returns:
+# - the pair file, loaded memory mapped
+def build_pairs_sharded(frequencies, window_width, output_path, processes=None, num_shards=None, log=print, work_dir=None):
+    processes = processes or os.cpu_count()
+    num_shards = num_shards or processes
+    frequencies = np.asarray(frequencies)
+    num_hits = len(frequencies)
+    if num_hits > np.iinfo(np.int32).max:
+        raise ValueError("Pair files store hits as int32, so they can have at most 2^31 - 1 hits")
+
+    temporary = work_dir is None
+    if temporary: # In memory if /dev/shm exists
+        work_dir = tempfile.mkdtemp(prefix="adjacency_shards_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    try:
+        checkpoint = _start_work_dir(work_dir, frequencies, window_width, num_shards)
+        checkpoint_path = os.path.join(work_dir, "checkpoint.json")
+        bounds = checkpoint["shards"]
+        done = checkpoint["done"]
+
+        # Find the pairs in every shard which isn't done yet, and check each one off as it finishes
+        log(f"Finding pairs of {num_hits} hits in {len(bounds)} shards with {processes} processes ({len(done)} already done)")
+        inputs = [(work_dir, shard, start, stop, window_width) for shard, (start, stop) in enumerate(bounds) if str(shard) not in done]
+        shard_dirs = [os.path.join(work_dir, f"shard_{shard}") for shard in range(len(bounds))]
+        with multiprocessing.Pool(processes) as p:
+            for shard, count in p.imap_unordered(_shard_pairs_args, inputs):
+                done[str(shard)] = count
+                commit_json(checkpoint_path, checkpoint)
+                log(f"Shard {shard} done ({len(done)} of {len(bounds)})")
+            num_pairs = sum(done.values())
+            log(f"Found {num_pairs} pairs. Merging shards")
+
+            # Make the (empty) pair file, then fill it in a range of hits at a time. The
+            # ranges are picked so each has about the same number of pairs
+            os.makedirs(output_path, exist_ok=True)
+            for name, dtype in zip(pair_arrays, [np.int32, np.int32, np.float32]):
+                np.lib.format.open_memmap(os.path.join(output_path, name + ".npy"), mode="w+", dtype=dtype, shape=(num_pairs,)).flush()
+            ranges, counts = merge_ranges(shard_dirs, num_hits, len(bounds))
+            merge_inputs = [(shard_dirs, output_path, ranges[k], ranges[k + 1], counts[k]) for k in range(len(ranges) - 1)]
+            p.starmap(merge_shards, merge_inputs)
+    finally:
+        if temporary:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    # info.json is written last, so a pair file with one is complete
+    with open(os.path.join(output_path, "info.json"), "w") as f:
+        json.dump({"num_hits": int(num_hits), "window_hz": float(window_width * 1e6), "num_pairs": int(num_pairs)}, f, indent=2)
+    if not temporary:
+        shutil.rmtree(work_dir)
+    log(f"Saved {num_pairs} pairs to: {output_path}")
+    return load_pairs(output_path)
+
+# Convert an old pair of .distances.npz and .mask.npz files to a pair file
+# Usage: python adjacency.py <.distances.npz> <.mask.npz> <output directory> [<window width in Hz>]
+if __name__ == "__main__":
+    window_hz = float(sys.argv[4]) if len(sys.argv) > 4 else 1000
+    pairs = pairs_from_npz(sys.argv[1], sys.argv[2], window_hz * 1e-6)
+    save_pairs(sys.argv[3], pairs)
+    print(f"Saved {len(pairs['i'])} pairs of {pairs['num_hits']} hits to: {sys.argv[3]}")
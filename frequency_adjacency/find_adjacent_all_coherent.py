@@ -3,11 +3,12 @@
 ## Import useful packages
 import numpy as np
 import pandas as pd
-from scipy.sparse import csr_array
-from scipy.sparse import lil_array
-from scipy.sparse import save_npz
-from scipy.sparse import load_npz
 import os
+import sys
+from datetime import datetime
+from adjacency import adjacent_pairs, make_pairs, build_pairs_sharded
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from run_manifest import start_manifest, stage, default_manifest_path
 
 ## Read in the data
 # Check which server we're on (in case the data is in different places on different servers)
@@ -23,10 +24,6 @@ import os
 #     raise Exception("Data path not known")
 
 coherent_dataset_path = os.path.join(os.path.dirname(__file__), "../../highfrequency_hit_feb12024_apr302025_coherent_full.pkl")
-# Read in data
-coherent = pd.read_pickle(coherent_dataset_path)
-# incoherent = pd.read_pickle(incoherent_dataset_path)
-# df = pd.read_pickle(full_dataset_path)
 
 ## Setup for logging messages
 def log_message(log_path, message):
@@ -34,49 +31,18 @@ def log_message(log_path, message):
         f.write(message + '\n')
 
 ## Define algorithm to find distances
-# Find adjacent points (like algorithm described above)
+# Find adjacent points (see adjacency.py for how) in one process, keeping them in memory.
+# The script below uses build_pairs_sharded to do the same on every core
 # data: pandas series with reset index (index goes 0...n-1 consecutively)
 # window_width: width of window to find adjacency in same units as data (ie MHz and MHz)
 # Returns:
-# (distances, mask) tuple
-# distances is a scipy sparse lil_array of float distances between adjacent points
-# mask is a scipy sparse lil_array of booleans indicating whether 
-def find_adjacent_distances(data, window_width, log_path):
-    # Sort the data by frequency
-    sdata = data.sort_values() # sfs is sorted frequencies
-    # Make sure to keep track of the original indices
-    original_indices = sdata.index # Maps index in sfs to index in fs
-
-    # Setup empty arrays, indices are original indices of data
-    num_hits = len(data)
-    mask = lil_array((num_hits, num_hits), dtype=bool) 
-    distances = lil_array((num_hits, num_hits), dtype=np.float32) 
-
-    # Find which hits are adjacent in order. Stop if we find one that isn't
-    for i, datum in enumerate(sdata):
-        j = i + 1 # Index of point to compare to
-        while ((j < num_hits) and # Don't index off the end of the array
-               (abs(sdata.iloc[j] - datum) <= window_width)): 
-            # Find coordinates in the non-sorted list
-            u = original_indices[i]
-            v = original_indices[j]
-
-            # Make sure it's upper triangular (might have to flip over diagonal)
-            if u > v: u, v = v, u # swap u and v
-            
-            # Set elements in matrix
-            mask[u, v] = True
-            distances[u, v] = abs(sdata.iloc[j] - datum)
-
-            # Check next point
-            j += 1
-        
-        # Log progress
-        if (i % 100_000 == 0):
-            log_message(log_path, f"On hit {i}")
-
-    # Return data
-    return distances, mask
+# pairs in the form of a pair file (see adjacency.py), with every pair of adjacent points
+# and the distance between them (including pairs at the same frequency)
+def find_adjacent_pairs(data, window_width, log_path):
+    log_message(log_path, f"Finding pairs of {len(data)} hits at {datetime.now()}")
+    u, v, pair_distances = adjacent_pairs(data.values, window_width)
+    log_message(log_path, f"Found {len(u)} pairs at {datetime.now()}")
+    return make_pairs(u, v, pair_distances, len(data), window_width)
 
 
 
@@ -85,23 +51,25 @@ def find_adjacent_distances(data, window_width, log_path):
 threshold_hz = 1000
 threshold = threshold_hz * 1e-6 # in MHz
 path = os.path.join(os.path.dirname(__file__),"./adjacent_in_coherent/") # Place to save arrays
-distances_file_path = path + f'coherent_within_{round(threshold_hz)}hz.distances.npz'
-mask_file_path = path + f'coherent_within_{round(threshold_hz)}hz.mask.npz'
+pairs_file_path = path + f'coherent_within_{round(threshold_hz)}hz.pairs'
 log_path = path + f"log.txt"
-if not (os.path.exists(distances_file_path) and os.path.exists(mask_file_path)):
+if __name__ == "__main__" and not os.path.exists(os.path.join(pairs_file_path, "info.json")):
+    # Read in data (only when run as a script, so find_adjacent_pairs can be imported)
+    coherent = pd.read_pickle(coherent_dataset_path)
+    # incoherent = pd.read_pickle(incoherent_dataset_path)
+    # df = pd.read_pickle(full_dataset_path)
+
     # Log progress
     log_message(log_path, "Starting calculation")
+    manifest = start_manifest("find_adjacent_all_coherent", default_manifest_path(path, "find_adjacent_all_coherent"))
     
     # Compute results
-    frequencies = coherent["signal_frequency"].copy().reset_index(drop=True)
-    distances, mask = find_adjacent_distances(frequencies, threshold, log_path)
-
-    # Log
-    log_message(log_path, "Done with calculation, saving")
-    
-    # Save results to file
-    save_npz(distances_file_path, csr_array(distances))
-    save_npz(mask_file_path, csr_array(mask))
+    # (with a process per shard of the frequencies, saved to pairs_file_path as they're found)
+    with stage(manifest, "find adjacent distances", rows_in=len(coherent), inputs=[coherent_dataset_path]) as record:
+        frequencies = coherent["signal_frequency"].values
+        pairs = build_pairs_sharded(frequencies, threshold, pairs_file_path,
+                                    log=lambda message: log_message(log_path, f"{message} at {datetime.now()}"))
+        record["rows_out"] = len(pairs["i"]) # Number of adjacent pairs
 
     # Log again
     log_message(log_path, "Script finishing")
@@ -0,0 +1,72 @@
+#!/home/nstieg/.conda/envs/cosmic/bin/python
+# find_adjacent_in_sources.py
+# Finds the pairs of hits within 1000Hz of each other from the same source, for every
+# source in the coherent data at once (what find_adjacent_frequencies_in_sources.ipynb
+# does one source at a time). Saves one pair file (see adjacency.py) with the source of
+# each pair, instead of a distances and mask matrix per source
+# Noah Stiegler
+# 10/18/26
+
+## Import useful packages
+import numpy as np
+import pandas as pd
+import os
+import sys
+from datetime import datetime
+from adjacency import adjacent_pairs_by_source, make_pairs, save_pairs
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from run_manifest import start_manifest, stage, default_manifest_path
+from hit_store import load_hits, default_store_path
+
+coherent_dataset_path = os.path.join(os.path.dirname(__file__), "../../highfrequency_hit_feb12024_apr302025_coherent_full.pkl")
+
+## Setup for logging messages
+def log_message(log_path, message):
+    with open(log_path, 'a') as f:
+        f.write(message + '\n')
+
+## Define algorithm to find distances
+# Find adjacent points within each source (see adjacency.py for how)
+# data: dataframe with signal_frequency and source_name, with reset index (index goes 0...n-1 consecutively)
+# window_width: width of window to find adjacency in same units as data (ie MHz and MHz)
+# Returns:
+# pairs in the form of a pair file (see adjacency.py), with every pair of adjacent points
+# from the same source, the distance between them and their source
+def find_adjacent_pairs_in_sources(data, window_width, log_path):
+    log_message(log_path, f"Finding pairs of {len(data)} hits at {datetime.now()}")
+    u, v, pair_distances, source, sources = adjacent_pairs_by_source(data.signal_frequency.values, data.source_name.values, window_width)
+    log_message(log_path, f"Found {len(u)} pairs in {len(sources)} sources at {datetime.now()}")
+    return make_pairs(u, v, pair_distances, len(data), window_width, source, sources)
+
+## Run algorithm
+# Set the threshold distance in hz to call two hits 'adjacent' and record their relative distances
+threshold_hz = 1000
+threshold = threshold_hz * 1e-6 # in MHz
+path = os.path.join(os.path.dirname(__file__), "./adjacent_in_each_source/") # Place to save arrays
+pairs_file_path = path + f'each_source_within_{round(threshold_hz)}hz.pairs'
+log_path = path + f"log.txt"
+if __name__ == "__main__" and not os.path.exists(os.path.join(pairs_file_path, "info.json")):
+    # Read in just the columns needed (hits are numbered by their row in the coherent table),
+    # from the hit store (made with hit_store.py) if there is one, otherwise from the pickle
+    coherent_store_path = default_store_path(coherent_dataset_path)
+    columns = ["signal_frequency", "source_name"]
+    if os.path.isdir(coherent_store_path):
+        coherent = load_hits(coherent_store_path, columns=columns)
+    else:
+        coherent = pd.read_pickle(coherent_dataset_path)[columns].reset_index(drop=True)
+
+    # Log progress
+    log_message(log_path, "Starting calculation")
+    manifest = start_manifest("find_adjacent_in_sources", default_manifest_path(path, "find_adjacent_in_sources"))
+
+    # Compute results
+    with stage(manifest, "find adjacent distances in sources", rows_in=len(coherent)) as record:
+        pairs = find_adjacent_pairs_in_sources(coherent, threshold, log_path)
+        record["rows_out"] = len(pairs["i"]) # Number of adjacent pairs
+
+    # Save results to file
+    with stage(manifest, "save"):
+        save_pairs(pairs_file_path, pairs)
+
+    # Log again
+    log_message(log_path, "Script finishing")
@@ -0,0 +1,167 @@
+# frequency_index.py
+# An index of the hits by frequency which is saved to disk and memory mapped, for asking
+# local questions (which hits are within X Hz of hit i, which hits of this source are
+# between f1 and f2) without loading a distance matrix of every pair into memory. Each
+# question is a binary search in the sorted frequencies, which only reads the few pages
+# of the files around the answer
+# Noah Stiegler
+# 10/18/26
+#
+# An index is a directory with:
+# - sorted_frequencies.npy (float64): every hit's frequency in MHz, in increasing order
+# - order.npy: the hit (row of the table the index was made from) at each sorted position
+# - rank.npy: the sorted position of each hit (the inverse of order)
+# - blocks.npy: the first frequency of every block of block_size sorted positions. It's
+#   small enough to read into memory, so a search finds its block there and then only
+#   touches one block of sorted_frequencies.npy
+# - (optional) sorted_source_codes.npy and sources.json: the source of each sorted hit as
+#   a number, and the source name of each number
+# - (optional) sorted_tstart.npy: the start time (MJD) of each sorted hit
+# - info.json: number of hits, block size and which of the optional columns there are
+#
+# Ex.
+#   build_frequency_index(index_path, coherent.signal_frequency.values, coherent.source_name.values, coherent.tstart.values)
+#   index = load_frequency_index(index_path)
+#   hits, distances_hz = neighbours(index, 1234, within_hz=500)
+#   hits = hits_between(index, 30000.1, 30000.2, source="TARGET_00012", time_range=(60400, 60410))
+#
+# Usage: python frequency_index.py <dataset.pkl> [<index directory>]
+# (reads from the dataset's hit store made with hit_store.py if there is one, otherwise
+# the pickle, and the index defaults to the pickle's path with _frequency_index instead of .pkl)
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import os
+import sys
+import json
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hit_store import load_hits, default_store_path
+
+### Making and loading indexes
+# Smallest integer type which can hold every number up to n
+def _index_dtype(n):
+    return np.int32 if n <= np.iinfo(np.int32).max else np.int64
+
+# Make an index and save it
+# Parameters:
+# - path: directory to save the index in
+# - frequencies: frequency of each hit in MHz
+# - source_names: (optional) source name of each hit, for restricting searches to one source
+# - tstarts: (optional) start time of each hit's observation (MJD), for restricting searches to a time range
+# - block_size: number of sorted positions in each block of the block directory
+def build_frequency_index(path, frequencies, source_names=None, tstarts=None, block_size=4096):
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    n = len(frequencies)
+    order = np.argsort(frequencies, kind="stable").astype(_index_dtype(n))
+    rank = np.empty(n, dtype=order.dtype)
+    rank[order] = np.arange(n, dtype=order.dtype)
+    sorted_frequencies = frequencies[order]
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "sorted_frequencies.npy"), sorted_frequencies)
+    np.save(os.path.join(path, "order.npy"), order)
+    np.save(os.path.join(path, "rank.npy"), rank)
+    np.save(os.path.join(path, "blocks.npy"), sorted_frequencies[::block_size])
+    if source_names is not None:
+        codes, sources = pd.factorize(np.asarray(source_names), sort=True)
+        np.save(os.path.join(path, "sorted_source_codes.npy"), codes[order].astype(np.int32))
+        with open(os.path.join(path, "sources.json"), "w") as f:
+            json.dump([str(source) for source in sources], f)
+    if tstarts is not None:
+        np.save(os.path.join(path, "sorted_tstart.npy"), np.asarray(tstarts, dtype=np.float64)[order])
+
+    # info.json is written last, so an index with one is complete
+    with open(os.path.join(path, "info.json"), "w") as f:
+        json.dump({"num_hits": n, "block_size": block_size,
+                   "has_sources": source_names is not None, "has_tstart": tstarts is not None}, f, indent=2)
+
+# Load an index. Every array is memory mapped except the block directory
+# Returns a dict of the arrays (named like their files) plus num_hits, block_size and
+# sources (a dict of source name -> code, if the index has sources)
+def load_frequency_index(path):
+    with open(os.path.join(path, "info.json")) as f:
+        info = json.load(f)
+    index = {"num_hits": info["num_hits"], "block_size": info["block_size"]}
+    for name in ["sorted_frequencies", "order", "rank"]:
+        index[name] = np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+    index["blocks"] = np.load(os.path.join(path, "blocks.npy"))
+    if info["has_sources"]:
+        index["sorted_source_codes"] = np.load(os.path.join(path, "sorted_source_codes.npy"), mmap_mode="r")
+        with open(os.path.join(path, "sources.json")) as f:
+            index["sources"] = {source: code for code, source in enumerate(json.load(f))}
+    if info["has_tstart"]:
+        index["sorted_tstart"] = np.load(os.path.join(path, "sorted_tstart.npy"), mmap_mode="r")
+    return index
+
+### Searching
+# Sorted position of a frequency (like np.searchsorted on the sorted frequencies), looking
+# in the block directory first so only one block of the frequencies is read
+def locate(index, frequency, side="left"):
+    block_size = index["block_size"]
+    block = max(int(np.searchsorted(index["blocks"], frequency, side=side)) - 1, 0)
+    start = block * block_size
+    stop = min(start + block_size + 1, index["num_hits"]) # +1 so an answer at the end of the block is still in it
+    return start + int(np.searchsorted(index["sorted_frequencies"][start:stop], frequency, side=side))
+
+# Which of the sorted positions start to stop are of the source and in the time range
+def _restrict(index, start, stop, source=None, time_range=None):
+    keep = np.ones(stop - start, dtype=bool)
+    if source is not None:
+        if "sorted_source_codes" not in index:
+            raise ValueError("This index was made without source names")
+        code = index["sources"].get(source, -1)
+        keep &= np.asarray(index["sorted_source_codes"][start:stop]) == code
+    if time_range is not None:
+        if "sorted_tstart" not in index:
+            raise ValueError("This index was made without start times")
+        tstart = np.asarray(index["sorted_tstart"][start:stop])
+        keep &= (tstart >= time_range[0]) & (tstart <= time_range[1])
+    return start + np.flatnonzero(keep)
+
+# Every hit with a frequency from f1 to f2 (MHz, inclusive)
+# Parameters:
+# - index: from load_frequency_index
+# - f1, f2: the frequency range in MHz
+# - source: (optional) only hits from this source
+# - time_range: (optional) (first, last) tstart (MJD, inclusive) of hits to include
+# Returns:
+# - the hits (rows of the table the index was made from), in order of frequency
+def hits_between(index, f1, f2, source=None, time_range=None):
+    start, stop = locate(index, f1, "left"), locate(index, f2, "right")
+    positions = _restrict(index, start, stop, source, time_range)
+    return np.asarray(index["order"][positions]).astype(np.int64)
+
+# Every other hit within within_hz of a hit
+# Parameters:
+# - index: from load_frequency_index
+# - hit: the hit (row of the table the index was made from)
+# - within_hz: largest distance in Hz (inclusive, so hits at the same frequency are included)
+# - source, time_range: (optional) like hits_between. source="same" means the hit's own source
+# Returns:
+# - (hits, distances_hz): the neighbours in order of frequency, and how far each is from the hit in Hz
+def neighbours(index, hit, within_hz, source=None, time_range=None):
+    position = int(index["rank"][hit])
+    frequency = float(index["sorted_frequencies"][position])
+    if source == "same":
+        source = {code: name for name, code in index["sources"].items()}[int(index["sorted_source_codes"][position])]
+    start, stop = locate(index, frequency - within_hz * 1e-6, "left"), locate(index, frequency + within_hz * 1e-6, "right")
+    positions = _restrict(index, start, stop, source, time_range)
+    positions = positions[positions != position]
+    distances_hz = np.abs(np.asarray(index["sorted_frequencies"][positions]) - frequency) * 1e6
+    return np.asarray(index["order"][positions]).astype(np.int64), distances_hz
+
+# Make an index of a dataset's coherent hits
+if __name__ == "__main__":
+    dataset_path = sys.argv[1]
+    index_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(dataset_path)[0] + "_frequency_index"
+    store_path = default_store_path(dataset_path)
+    columns = ["signal_frequency", "source_name", "tstart"]
+    if os.path.isdir(store_path):
+        print("Reading in data from: " + store_path)
+        hits = load_hits(store_path, columns=columns)
+    else:
+        print("Reading in data from: " + dataset_path)
+        hits = pd.read_pickle(dataset_path)[columns].reset_index(drop=True)
+    build_frequency_index(index_path, hits.signal_frequency.values, hits.source_name.values, hits.tstart.values)
+    print("Saved index to: " + index_path)
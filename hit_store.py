@@ -0,0 +1,121 @@
+# hit_store.py
+# Noah Stiegler - 10/18/26
+#
+# Converts a pickled dataset of hits from COSMIC into a parquet dataset
+# partitioned by source category (coherent, incoherent, phase center) and
+# by month, and loads back just the columns and rows which are needed.
+# Reading one column out of the store doesn't read any of the others and
+# filters like signal_snr > 10 are pushed down into the parquet reader, so
+# scripts which only need id, signal_frequency and signal_drift_rate don't
+# have to read in the whole multi-GB pickle.
+#
+# Usage: python hit_store.py <dataset.pkl> [<store directory>]
+# (the store defaults to the pickle's path with _store instead of .pkl)
+#
+
+# Import useful packages
+import numpy as np
+import pandas as pd
+import os
+import sys
+import pyarrow.dataset as ds
+from pyarrow.parquet import filters_to_expression
+
+# Columns added to the table to partition it. They're stored as directory names
+# (category=coherent/month=2024-03/...) rather than in the files themselves
+partition_cols = ["category", "month"]
+
+# Column holding the position of each hit in the table it was converted from,
+# so tables read back from the store can be put back into the original order
+row_col = "row"
+
+# Which of the three datasets made by trim_dataset.py each hit belongs to
+def source_categories(source_names):
+    source_names = pd.Series(source_names)
+    categories = np.full(len(source_names), "coherent", dtype=object)
+    categories[source_names.isin(["Incoherent"]).values] = "incoherent"
+    categories[source_names.isin(["PHASE_CENTER"]).values] = "phase_center"
+    return categories
+
+# Year and month (as "YYYY-MM") each hit was observed in. Uses the human
+# readable times made by trim_dataset.py if they're there, otherwise
+# converts the MJD start times
+def observation_months(df):
+    if "tstart_h" in df.columns:
+        times = pd.to_datetime(df["tstart_h"])
+    else:
+        times = pd.to_datetime((df["tstart"] - 40587) * 24 * 60 * 60, unit="s") # 40587 is the MJD of the unix epoch
+    return times.dt.strftime("%Y-%m").values
+
+# Default place to put the store for a pickled dataset
+def default_store_path(dataset_path):
+    return os.path.splitext(dataset_path)[0] + "_store"
+
+# Write a dataframe of hits out to a partitioned store
+# Parameters:
+# - df: dataframe of hits (needs source_name and tstart or tstart_h)
+# - store_path: directory to write the store to
+def write_hit_store(df, store_path):
+    df = df.reset_index(drop=True)
+    df[row_col] = np.arange(len(df), dtype=np.int64)
+    df["category"] = source_categories(df["source_name"])
+    df["month"] = observation_months(df)
+    df.to_parquet(store_path, partition_cols=partition_cols, index=False)
+
+# Add the categories and months to read to a list of filters
+def _with_partition_filters(filters, categories, months):
+    filters = list(filters) if filters is not None else []
+    if categories is not None:
+        filters.append(("category", "in", list(categories)))
+    if months is not None:
+        filters.append(("month", "in", list(months)))
+    return filters
+
+# Read hits back from a store
+# Parameters:
+# - store_path: directory the store was written to
+# - columns: list of the columns to read (None for all of them)
+# - filters: list of (column, op, value) predicates which rows must all pass,
+#   ex. [("signal_snr", ">", 10)] or [("source_name", "==", name)]. These are
+#   handed to the parquet reader so rows which don't pass are never loaded
+# - categories: list of source categories to read (None for all of them)
+# - months: list of "YYYY-MM" months to read (None for all of them)
+# Returns:
+# - dataframe of hits in the same order they were in the original table
+def load_hits(store_path, columns=None, filters=None, categories=None, months=None):
+    filters = _with_partition_filters(filters, categories, months)
+    read_columns = None if columns is None else list(dict.fromkeys(list(columns) + [row_col]))
+    df = pd.read_parquet(store_path, columns=read_columns, filters=filters if filters else None)
+
+    # Put the rows back in their original order and drop the bookkeeping columns
+    df = df.sort_values(row_col, kind="stable").reset_index(drop=True)
+    if columns is None:
+        df = df.drop(columns=partition_cols + [row_col])
+    else:
+        df = df[list(columns)]
+    for c in partition_cols:
+        if c in df.columns:
+            df[c] = df[c].astype(str)
+    return df
+
+# Read hits from a store a batch at a time, for when the whole table (or even the
+# columns needed) won't fit in memory. Takes the same arguments as load_hits
+# Yields:
+# - dataframes of at most batch_size hits (not in the original order)
+def iter_hit_batches(store_path, columns, filters=None, categories=None, months=None, batch_size=1_000_000):
+    filters = _with_partition_filters(filters, categories, months)
+    dataset = ds.dataset(store_path, format="parquet", partitioning="hive")
+    expression = filters_to_expression(filters) if filters else None
+    for batch in dataset.to_batches(columns=list(columns), filter=expression, batch_size=batch_size):
+        yield batch.to_pandas()
+
+if __name__ == "__main__":
+    # Read in file
+    dataset_path = sys.argv[1]
+    store_path = sys.argv[2] if len(sys.argv) > 2 else default_store_path(dataset_path)
+    df = pd.read_pickle(dataset_path)
+    print("File read in correctly")
+
+    # Write it out
+    write_hit_store(df, store_path)
+    print("Saved hit store to " + store_path)
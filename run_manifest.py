@@ -0,0 +1,180 @@
+# run_manifest.py
+# Records how long each stage of a long run (the filter chain, the adjacency build,
+# the SARFI scan) took, how much memory it used and how many rows went in and out,
+# and saves it all as a JSON manifest so runs can be compared with each other
+# Noah Stiegler
+# 10/18/26
+#
+# Ex.
+#   manifest = start_manifest("filter chain", manifest_path)
+#   with stage(manifest, "filter 1", rows_in=len(hits), inputs=[dataset_path]) as record:
+#       passed = filter1(hits, selected)
+#       record["rows_out"] = int(passed.sum())
+#
+# Every stage records:
+# - wall_time_s: seconds the stage took
+# - cpu_time_s: CPU seconds used by this process, and child_cpu_time_s used by any
+#   processes it started and waited for (ex. a multiprocessing pool)
+# - peak_rss_mb: most memory this process had in use during the stage (on Linux, the
+#   high water mark is reset when the stage starts; elsewhere it's the peak so far in the run)
+#   and peak_child_rss_mb for the largest child process so far
+# - rows_in, rows_out: set by the caller
+# - inputs: fingerprints of the files the stage read (see file_fingerprint)
+# The manifest is rewritten after every stage so a run which dies still leaves a record
+
+### Import useful packages
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import resource
+import platform
+import pandas as pd
+from contextlib import contextmanager
+from datetime import datetime
+
+### Fingerprints of input files
+# Size, modification time and a sha256 of a file, or of every file in a directory (ex. a
+# hit store). By default the sha256 is of each file's size and modification time (so it's
+# quick even for a dataset of many GB), and it's only of the contents if hash_contents
+def file_fingerprint(path, hash_contents=False, chunk_size=1 << 24):
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, f) for root, _, fs in os.walk(path) for f in fs)
+    else:
+        files = [path]
+
+    h = hashlib.sha256()
+    size = 0
+    modified = 0
+    for f in files:
+        stat = os.stat(f)
+        size += stat.st_size
+        modified = max(modified, stat.st_mtime)
+        h.update(os.path.relpath(f, path).encode() if f != path else b"")
+        if hash_contents:
+            with open(f, "rb") as file:
+                while chunk := file.read(chunk_size):
+                    h.update(chunk)
+        else:
+            h.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return {
+        "path": os.path.abspath(path),
+        "size_bytes": size,
+        "modified": datetime.fromtimestamp(modified).isoformat() if files else None,
+        "sha256" if hash_contents else "stat_sha256": h.hexdigest(),
+    }
+
+### Memory
+# Peak memory (in MB) this process has used since it started or since the last reset
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kB on Linux but bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+def peak_child_rss_mb():
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+# Reset the peak memory of this process to what it's using now (Linux only)
+def _reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+### Manifests
+# Start a manifest for a run called name, saved to path
+def start_manifest(name, path):
+    manifest = {
+        "name": name,
+        "path": path,
+        "started": datetime.now().isoformat(),
+        "host": socket.gethostname(),
+        "python": platform.python_version(),
+        "argv": sys.argv,
+        "stages": [],
+    }
+    save_manifest(manifest)
+    return manifest
+
+# Write the manifest to its path (through a temporary file, so it's never half written)
+def save_manifest(manifest):
+    path = manifest["path"]
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+def load_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+# Time a stage of the run and add it to the manifest (if manifest is None nothing is recorded)
+# Parameters:
+# - manifest: from start_manifest
+# - name: name of the stage
+# - rows_in: how many rows went into the stage (can also be set on the record)
+# - inputs: paths of files the stage reads, to fingerprint
+# - hash_contents: whether the fingerprints hash the whole contents of the files instead
+#   of their size and modification time (slow for very large files, so only if asked for)
+# Yields:
+# - the dict recorded for the stage, which the caller can add to (ex. rows_out)
+@contextmanager
+def stage(manifest, name, rows_in=None, inputs=(), hash_contents=False, **details):
+    record = {"stage": name, "rows_in": rows_in, "rows_out": None, **details}
+    if manifest is None:
+        yield record
+        return
+    record["inputs"] = [file_fingerprint(path, hash_contents) for path in inputs]
+
+    _reset_peak_rss()
+    start = datetime.now()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        yield record
+        record["status"] = "ok"
+    except BaseException as err:
+        record["status"] = f"failed: {type(err).__name__}: {err}"
+        raise
+    finally:
+        children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+        record["started"] = start.isoformat()
+        record["wall_time_s"] = time.perf_counter() - wall_start
+        record["cpu_time_s"] = time.process_time() - cpu_start
+        record["child_cpu_time_s"] = ((children_end.ru_utime + children_end.ru_stime)
+                                      - (children_start.ru_utime + children_start.ru_stime))
+        record["peak_rss_mb"] = peak_rss_mb()
+        record["peak_child_rss_mb"] = peak_child_rss_mb()
+        manifest["stages"].append(record)
+        save_manifest(manifest)
+
+### Comparing runs
+# Line up the stages of two manifests by name, with how much slower / bigger the new run was
+# Returns a pandas dataframe with a row for each stage in both runs
+def compare_manifests(old, new):
+    columns = ["stage", "rows_in", "rows_out", "wall_time_s", "cpu_time_s", "peak_rss_mb"]
+    old_stages = pd.DataFrame(old["stages"]).reindex(columns=columns)
+    new_stages = pd.DataFrame(new["stages"]).reindex(columns=columns)
+    comparison = pd.merge(old_stages, new_stages, on="stage", suffixes=("_old", "_new"))
+    for column in ["wall_time_s", "cpu_time_s", "peak_rss_mb"]:
+        comparison[column + "_ratio"] = comparison[column + "_new"] / comparison[column + "_old"]
+    return comparison
+
+# Path for the manifest of a run of a script, in a run_manifests directory next to it
+def default_manifest_path(script_dir, name):
+    return os.path.join(script_dir, "run_manifests", f"{name}_{datetime.now():%Y%m%d_%H%M%S}.json")
@@ -7,9 +7,14 @@ from datetime import datetime, timedelta
 from seticore import viewer, hit_capnp, stamp_capnp
 import traceback
 import multiprocessing
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from run_manifest import start_manifest, stage, default_manifest_path
+
+targets_indexed_path = "/mnt/cosmic-gpu-1/data0/nstiegle/representative_samples/1in25_targets_indexed.csv"
 
 # Load in the indexed targets
-targets_indexed = pd.read_csv("/mnt/cosmic-gpu-1/data0/nstiegle/representative_samples/1in25_targets_indexed.csv") # Read in indexed his from above
+targets_indexed = pd.read_csv(targets_indexed_path) # Read in indexed his from above
 
 # Take out the files which didn't have .hits files
 good_targets = targets_indexed.dropna()
@@ -65,20 +70,28 @@ def find_sarfi(stamp_uri, frameidx):
     antenna_titles = [stamp.recipe.antenna_names[i] for i in range(stamp.stamp.numAntennas)]
     return antenna_titles, snrs, signals
 
-# Setup for multiprocessing
-inputs = []
-for i, row in good_targets.iterrows():
-    inputs.append((row.stamp_uri, row.frameidx))
-p = multiprocessing.Pool() 
+# Only run the scan in the main process (not in the pool's workers, which import this file
+# if they're started with spawn)
+if __name__ == "__main__":
+    # Record how long the scan takes and how much memory it uses (see run_manifest.py)
+    manifest = start_manifest("find_SARFI_multi", default_manifest_path(os.path.dirname(os.path.abspath(__file__)), "find_SARFI_multi"))
+
+    # Setup for multiprocessing
+    inputs = []
+    for i, row in good_targets.iterrows():
+        inputs.append((row.stamp_uri, row.frameidx))
+    p = multiprocessing.Pool() 
 
-# Run algorithm with multiprocessing
-results = p.starmap(find_sarfi, inputs)
+    # Run algorithm with multiprocessing
+    with stage(manifest, "find SARFI", rows_in=len(inputs), inputs=[targets_indexed_path]) as record:
+        results = p.starmap(find_sarfi, inputs)
+        record["rows_out"] = len(results)
 
-# Save results
-antenna_titles = np.array([results[0] for result in results], dtype='str')
-antenna_snrs = np.array([results[1] for result in results], dtype='object')
-antenna_signals = np.array([results[2] for result in results], dtype='object')
-good_targets["antenna_titles"] = antenna_titles
-good_targets["antenna_snrs"] = antenna_snrs
-good_targets["antenna_signals"] = antenna_signals
-good_targets.to_csv("/mnt/cosmic-gpu-1/data0/nstiegle/representative_samples/1in25_good_targets_results")
\ No newline at end of file
+    # Save results
+    antenna_titles = np.array([results[0] for result in results], dtype='str')
+    antenna_snrs = np.array([results[1] for result in results], dtype='object')
+    antenna_signals = np.array([results[2] for result in results], dtype='object')
+    good_targets["antenna_titles"] = antenna_titles
+    good_targets["antenna_snrs"] = antenna_snrs
+    good_targets["antenna_signals"] = antenna_signals
+    good_targets.to_csv("/mnt/cosmic-gpu-1/data0/nstiegle/representative_samples/1in25_good_targets_results")
\ No newline at end of file
@@ -0,0 +1,189 @@
+# synthetic_hits.py
+# Makes fake hit tables with the same columns as the COSMIC hit tables (see
+# messing_around/col_info.txt and trim_dataset.py) so the filters can be run and timed
+# without the real data. The numbers are made up, but they're made up to look like the
+# things in the real data the filters care about:
+# - A few sources are observed far more than the rest (hits per source fall off like a power law)
+# - Sources are observed in sessions of back to back scans a few minutes apart
+# - A lot of the hits are RFI at exactly the same frequency in many observations and sources
+#   (mostly with zero drift rate), which is what filters 1-5 cut
+# - Some drifting hits show up again in the next scan where they should have drifted to,
+#   which is what filter 11 looks for
+# - SNRs have a long tail above the detection threshold, and scans have a mix of timesteps
+# - Some hits are from the incoherent beam and phase center beams instead of targets
+# Noah Stiegler
+# 10/18/26
+#
+# Usage: python synthetic_hits.py <number of hits> <output.pkl> [<seed>]
+
+### Import useful packages
+import numpy as np
+import pandas as pd
+import sys
+
+# MJDs of the start and end of the real dataset (2/1/24 - 4/30/25)
+first_mjd = 60341
+last_mjd = 60795
+# Frequency range of the high frequency hits in MHz
+min_frequency = 25_000
+max_frequency = 50_000
+# Frequencies are multiples of this (1Hz, in MHz)
+frequency_resolution = 1e-6
+
+# Mixes of the settings of each scan
+timestep_mix = {8: 0.1, 16: 0.35, 32: 0.4, 64: 0.15}
+tsamp_mix = {0.131072: 0.5, 0.262144: 0.3, 0.524288: 0.2}
+tunings = ["AC", "BD"]
+
+def _choose(rng, mix, size):
+    return rng.choice(list(mix.keys()), size=size, p=list(mix.values()))
+
+def _heavy_tailed_weights(rng, n, exponent=1.1):
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return rng.permutation(weights / weights.sum())
+
+# Make scans (observations) of each source: sessions of session_length back to back
+# scans a few minutes apart, with the sessions on random days
+# Returns a dataframe of scans sorted by source and time
+def make_observations(rng, num_sources, num_observations, source_weights, session_length=5):
+    # Every source gets at least one scan, the rest go to the sources by how much they're observed
+    source = np.concatenate([np.arange(num_sources),
+                             rng.choice(num_sources, num_observations - num_sources, p=source_weights)])
+    source = np.sort(source)
+    first_of_source = np.searchsorted(source, np.arange(num_sources))
+    scan = np.arange(len(source)) - first_of_source[source] # Which scan of the source it is
+    session = scan // session_length
+
+    # Time of each scan: start of its session plus a gap for every scan before it in the session
+    session_start = rng.uniform(first_mjd, last_mjd, len(source)) # (only the first scan's is used)
+    session_start = session_start[np.flatnonzero(scan % session_length == 0)][np.cumsum(scan % session_length == 0) - 1]
+    gap = rng.uniform(60, 300, num_sources)[source] # seconds between scans of a source
+    tstart = session_start + (scan % session_length) * gap / (24 * 60 * 60)
+    next_in_session = np.append((source[1:] == source[:-1]) & (session[1:] == session[:-1]), False)
+
+    return pd.DataFrame({
+        "source": source,
+        "tstart": tstart,
+        "num_timesteps": _choose(rng, timestep_mix, len(source)),
+        "tsamp": _choose(rng, tsamp_mix, len(source)),
+        "tuning": rng.choice(tunings, len(source)),
+        "next_in_session": next_in_session,
+    })
+
+# Make a table of fake hits
+# Parameters:
+# - num_hits: number of hits (rows) to make
+# - seed: seed for the random numbers, the same seed always gives the same table
+# - num_sources: number of target sources (about sqrt(num_hits) / 2 if None)
+# - hits_per_observation: average number of hits in a scan
+# - rfi_fraction: fraction of hits at one of the RFI frequencies
+# - num_rfi_frequencies: number of distinct RFI frequencies (num_hits / 500 if None)
+# - zero_drift_fraction: fraction of the hits which aren't RFI with a zero drift rate
+#   (RFI has zero drift rate 80% of the time)
+# - follow_up_fraction: fraction of target hits which are a drifting hit seen again in the next scan
+# - incoherent_fraction, phase_center_fraction: fraction of hits from the incoherent and phase center beams
+# - full_schema: add the rest of the columns in col_info.txt (more memory)
+# Returns:
+# - dataframe of hits (in a random order, with a RangeIndex)
+def make_synthetic_hits(num_hits, seed=0, num_sources=None, hits_per_observation=200, rfi_fraction=0.4,
+                        num_rfi_frequencies=None, zero_drift_fraction=0.3, follow_up_fraction=0.05,
+                        incoherent_fraction=0.1, phase_center_fraction=0.05, full_schema=False):
+    rng = np.random.default_rng(seed)
+    if num_sources is None:
+        num_sources = max(10, int(np.sqrt(num_hits) / 2))
+    if num_rfi_frequencies is None:
+        num_rfi_frequencies = max(1, num_hits // 500)
+
+    # Sources: the targets, plus the incoherent beam and phase center as one source each
+    source_names = np.array([f"TARGET_{i:05d}" for i in range(num_sources)] + ["Incoherent", "PHASE_CENTER"], dtype=object)
+    beam_fractions = np.array([1 - incoherent_fraction - phase_center_fraction, incoherent_fraction, phase_center_fraction])
+    source_weights = np.concatenate([beam_fractions[0] * _heavy_tailed_weights(rng, num_sources), beam_fractions[1:]])
+    observations = make_observations(rng, num_sources + 2, max(num_sources + 2, num_hits // hits_per_observation), source_weights)
+    first_observation = np.searchsorted(observations.source.values, np.arange(num_sources + 2))
+    observation_count = np.diff(np.append(first_observation, len(observations)))
+
+    # Save some of the hits to be follow ups of drifting hits
+    num_follow_ups = int(follow_up_fraction * num_hits * beam_fractions[0])
+    num_base = num_hits - num_follow_ups
+
+    # Which scan each hit is in
+    source = rng.choice(num_sources + 2, num_base, p=source_weights)
+    observation = first_observation[source] + (rng.random(num_base) * observation_count[source]).astype(np.int64)
+
+    # Frequencies: RFI at exact shared frequencies (some much more common than others), the rest anywhere
+    rfi_frequencies = np.round(rng.uniform(min_frequency, max_frequency, num_rfi_frequencies) / frequency_resolution) * frequency_resolution
+    is_rfi = rng.random(num_base) < rfi_fraction
+    frequency = np.round(rng.uniform(min_frequency, max_frequency, num_base) / frequency_resolution) * frequency_resolution
+    frequency[is_rfi] = rfi_frequencies[rng.choice(num_rfi_frequencies, is_rfi.sum(), p=_heavy_tailed_weights(rng, num_rfi_frequencies, 1.3))]
+
+    # Drift rates (Hz/s): zero for lots of RFI and some of everything else, otherwise heavy tailed around zero
+    zero_drift = np.where(is_rfi, rng.random(num_base) < 0.8, rng.random(num_base) < zero_drift_fraction)
+    drift_rate = np.round(rng.laplace(0, 1.5, num_base), 3)
+    drift_rate[zero_drift] = 0
+
+    # SNRs above the detection threshold of 8, with a long tail (brighter for RFI)
+    snr = np.where(is_rfi, 10 * (1 + rng.pareto(1.5, num_base)), 8 * (1 + rng.pareto(2.0, num_base)))
+
+    # Follow ups: a drifting target hit seen again where it drifted to in the next scan of its session
+    eligible = np.flatnonzero((source < num_sources) & ~is_rfi & (drift_rate != 0) &
+                              observations.next_in_session.values[observation])
+    if len(eligible) == 0:
+        num_follow_ups = 0
+    parents = rng.choice(eligible, num_follow_ups) if num_follow_ups else np.array([], dtype=np.int64)
+    follow_up_observation = observation[parents] + 1
+    dt = (observations.tstart.values[follow_up_observation] - observations.tstart.values[observation[parents]]) * 24 * 60 * 60
+    follow_up_frequency = np.round((frequency[parents] + drift_rate[parents] * dt * 1e-6) / frequency_resolution) * frequency_resolution
+
+    source = np.concatenate([source, source[parents]])
+    observation = np.concatenate([observation, follow_up_observation])
+    frequency = np.concatenate([frequency, follow_up_frequency])
+    drift_rate = np.concatenate([drift_rate, drift_rate[parents]])
+    snr = np.concatenate([snr, 8 * (1 + rng.pareto(2.0, len(parents)))])
+
+    # Put the table together in a random order
+    shuffle = rng.permutation(len(source))
+    source, observation, frequency, drift_rate, snr = (a[shuffle] for a in (source, observation, frequency, drift_rate, snr))
+    n = len(source)
+    tstart = observations.tstart.values[observation]
+    num_timesteps = observations.num_timesteps.values[observation]
+    hits = pd.DataFrame({
+        "id": rng.permutation(n).astype(np.int64) + 1,
+        "signal_frequency": frequency,
+        "signal_drift_rate": drift_rate,
+        "signal_snr": snr,
+        "signal_beam": np.where(source_names[source] == "Incoherent", -1, rng.integers(0, 8, n)),
+        "signal_power": snr * rng.uniform(50, 150, n),
+        "signal_incoherent_power": snr * rng.uniform(5, 50, n),
+        "signal_num_timesteps": num_timesteps,
+        "num_timesteps": num_timesteps,
+        "tsamp": observations.tsamp.values[observation],
+        "tstart": tstart,
+        "tstart_h": pd.to_datetime((tstart - 40587) * 24 * 60 * 60, unit="s"), # 40587 is the MJD of the unix epoch
+        "ra_hours": rng.uniform(0, 24, num_sources + 2)[source],
+        "dec_degrees": rng.uniform(-40, 90, num_sources + 2)[source],
+        "source_name": source_names[source],
+        "tuning": observations.tuning.values[observation],
+        "observation_id": observation,
+        "file_local_enumeration": rng.integers(0, 1000, n),
+    })
+    if full_schema:
+        foff_mhz = frequency_resolution # 1Hz fine channels
+        hits["file_uri"] = "/mnt/buf0/synthetic/" + hits.tuning + "/" + pd.Series(observation).astype(str).values + ".hits"
+        hits["foff_mhz"] = foff_mhz
+        hits["fch1_mhz"] = np.floor(frequency) # Start of the coarse channel
+        hits["signal_index"] = np.round((frequency - hits.fch1_mhz.values) / foff_mhz).astype(np.int64)
+        hits["signal_drift_steps"] = np.round(drift_rate * hits.tsamp.values * num_timesteps / (foff_mhz * 1e6)).astype(np.int64)
+        hits["signal_coarse_channel"] = (np.floor(frequency) % 64).astype(np.int64)
+        hits["num_channels"] = 1024
+        hits["fft_size"] = 1024 * 1024
+        hits["telescope_id"] = 6
+    return hits
+
+if __name__ == "__main__":
+    num_hits = int(float(sys.argv[1]))
+    output_path = sys.argv[2]
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    print(f"Making {num_hits} synthetic hits")
+    hits = make_synthetic_hits(num_hits, seed=seed)
+    hits.to_pickle(output_path)
+    print("Saved to: " + output_path)